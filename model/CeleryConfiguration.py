@@ -34,7 +34,9 @@ app = Celery('innovation-lab',
              backend='redis://localhost:6379/0',
              broker='redis://localhost:6379/0',
              track_started=True,
-             include=['model.MaxEntRequestCelery'])
+             include=['model.MaxEntRequestCelery',
+                      'projects.aviris_regression_algorithms.model.' +
+                      'ApplyAlgorithmCelery'])
 
 app.conf.accept_content = ['application/json',
                            'json',
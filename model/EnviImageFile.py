@@ -0,0 +1,345 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+import numpy
+
+from model.GeospatialImageFile import GeospatialImageFile
+
+
+# -----------------------------------------------------------------------------
+# class EnviImageFile
+#
+# This class represents a raw ENVI image, like an AVIRIS cube, exposing its
+# pixels as a numpy.memmap.  Reading a window slices the map, so no copy is
+# made and the OS page cache does the buffering.  The geospatial information
+# still comes from GDAL, through GeospatialImageFile.
+#
+# The cube is shaped as it is laid out on disk:
+#     bsq:  (bands, lines, samples)
+#     bil:  (lines, bands, samples)
+#     bip:  (lines, samples, bands)
+# -----------------------------------------------------------------------------
+class EnviImageFile(GeospatialImageFile):
+
+    # ENVI data type codes
+    DATA_TYPES = {1: numpy.uint8,
+                  2: numpy.int16,
+                  3: numpy.int32,
+                  4: numpy.float32,
+                  5: numpy.float64,
+                  12: numpy.uint16,
+                  13: numpy.uint32,
+                  14: numpy.int64,
+                  15: numpy.uint64}
+
+    INTERLEAVES = ['bsq', 'bil', 'bip']
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, pathToFile, spatialReference=None):
+
+        # Initialize the base class.
+        super(EnviImageFile, self).__init__(pathToFile, spatialReference, None)
+
+        hdrFile = EnviImageFile.headerName(pathToFile)
+
+        if not hdrFile:
+            raise RuntimeError('No ENVI header found for ' + pathToFile + '.')
+
+        self._header = EnviImageFile.readHeader(hdrFile)
+
+        try:
+
+            self._samples = int(self._header['samples'])
+            self._lines = int(self._header['lines'])
+            self._bands = int(self._header['bands'])
+            self._interleave = self._header.get('interleave', 'bsq').lower()
+            dataType = int(self._header['data type'])
+            byteOrder = int(self._header.get('byte order', 0))
+            self._offset = int(self._header.get('header offset', 0))
+
+        except (KeyError, ValueError) as e:
+
+            raise RuntimeError('Invalid ENVI header, ' +
+                               hdrFile +
+                               ': ' +
+                               str(e))
+
+        if dataType not in EnviImageFile.DATA_TYPES:
+
+            raise RuntimeError('Unsupported ENVI data type ' +
+                               str(dataType) +
+                               ' in ' +
+                               hdrFile)
+
+        if self._interleave not in EnviImageFile.INTERLEAVES:
+
+            raise RuntimeError('Unsupported ENVI interleave ' +
+                               self._interleave +
+                               ' in ' +
+                               hdrFile)
+
+        self._dtype = numpy.dtype(EnviImageFile.DATA_TYPES[dataType]). \
+            newbyteorder('>' if byteOrder == 1 else '<')
+
+        self._cube = None
+
+    # -------------------------------------------------------------------------
+    # convert
+    #
+    # This writes a copy of the image in another interleave, like bsq for
+    # repeated band-subset reads of a bip scene, and returns it.  The copy is
+    # written linesPerChunk lines at a time.  Its header is this image's,
+    # with the new interleave, and it is written last, so an interrupted copy
+    # is not mistaken for a complete one.
+    # -------------------------------------------------------------------------
+    def convert(self, outFile, interleave, linesPerChunk=64):
+
+        if interleave not in EnviImageFile.INTERLEAVES:
+
+            raise RuntimeError('Unsupported ENVI interleave ' +
+                               str(interleave) +
+                               '.')
+
+        shape = {'bsq': (self._bands, self._lines, self._samples),
+                 'bil': (self._lines, self._bands, self._samples),
+                 'bip': (self._lines, self._samples, self._bands)}
+
+        outCube = numpy.memmap(outFile,
+                               dtype=self._dtype,
+                               mode='w+',
+                               shape=shape[interleave])
+
+        for yOff in range(0, self._lines, linesPerChunk):
+
+            rows = slice(yOff, min(yOff + linesPerChunk, self._lines))
+            window = self.readWindow(0, rows.start, self._samples,
+                                     rows.stop - rows.start)
+
+            if interleave == 'bsq':
+                outCube[:, rows, :] = window
+
+            elif interleave == 'bil':
+                outCube[rows] = window.transpose(1, 0, 2)
+
+            else:
+                outCube[rows] = window.transpose(1, 2, 0)
+
+        outCube.flush()
+        del outCube
+
+        with open(EnviImageFile.headerName(self._filePath)) as f:
+            text = f.read()
+
+        for key, value in [('interleave', interleave), ('header offset', 0)]:
+
+            pattern = re.compile(r'^\s*' + key + r'\s*=[^\n]*$',
+                                 re.MULTILINE | re.IGNORECASE)
+
+            line = key + ' = ' + str(value)
+
+            if pattern.search(text):
+                text = pattern.sub(line, text, 1)
+            else:
+                text = text.rstrip('\n') + '\n' + line + '\n'
+
+        with open(os.path.splitext(outFile)[0] + '.hdr', 'w') as f:
+            f.write(text)
+
+        return EnviImageFile(outFile, self._srs)
+
+    # -------------------------------------------------------------------------
+    # cube
+    #
+    # This returns the read-only memory map shaped for the interleave.
+    # -------------------------------------------------------------------------
+    def cube(self):
+
+        if self._cube is None:
+
+            shape = {'bsq': (self._bands, self._lines, self._samples),
+                     'bil': (self._lines, self._bands, self._samples),
+                     'bip': (self._lines, self._samples, self._bands)}
+
+            self._cube = numpy.memmap(self._filePath,
+                                      dtype=self._dtype,
+                                      mode='r',
+                                      offset=self._offset,
+                                      shape=shape[self._interleave])
+
+        return self._cube
+
+    # -------------------------------------------------------------------------
+    # dtype
+    # -------------------------------------------------------------------------
+    def dtype(self):
+
+        return self._dtype
+
+    # -------------------------------------------------------------------------
+    # header
+    # -------------------------------------------------------------------------
+    def header(self):
+
+        return dict(self._header)
+
+    # -------------------------------------------------------------------------
+    # headerName
+    #
+    # This returns the path of the header for an ENVI image, like clip.hdr for
+    # clip.img or x_img.hdr for x_img, or None when there is none.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def headerName(pathToFile):
+
+        for hdrFile in [os.path.splitext(pathToFile)[0] + '.hdr',
+                        pathToFile + '.hdr']:
+
+            if os.path.isfile(hdrFile):
+                return hdrFile
+
+        return None
+
+    # -------------------------------------------------------------------------
+    # interleave
+    # -------------------------------------------------------------------------
+    def interleave(self):
+
+        return self._interleave
+
+    # -------------------------------------------------------------------------
+    # isEnvi
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def isEnvi(pathToFile):
+
+        hdrFile = EnviImageFile.headerName(pathToFile)
+
+        if not hdrFile:
+            return False
+
+        with open(hdrFile) as f:
+            return f.readline().strip() == 'ENVI'
+
+    # -------------------------------------------------------------------------
+    # numBands
+    # -------------------------------------------------------------------------
+    def numBands(self):
+
+        return self._bands
+
+    # -------------------------------------------------------------------------
+    # numLines
+    # -------------------------------------------------------------------------
+    def numLines(self):
+
+        return self._lines
+
+    # -------------------------------------------------------------------------
+    # numSamples
+    # -------------------------------------------------------------------------
+    def numSamples(self):
+
+        return self._samples
+
+    # -------------------------------------------------------------------------
+    # readHeader
+    #
+    # This returns the header's key-value pairs with lower-case keys.  Values
+    # in braces, which may span lines, are returned without the braces.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def readHeader(hdrFile):
+
+        with open(hdrFile) as f:
+            text = f.read()
+
+        if not text.startswith('ENVI'):
+            raise RuntimeError(hdrFile + ' is not an ENVI header.')
+
+        header = {}
+        pattern = re.compile(r'^\s*([^=\n]+?)\s*=\s*(\{[^}]*\}|[^\n]*)',
+                             re.MULTILINE)
+
+        for match in pattern.finditer(text):
+
+            value = match.group(2).strip()
+
+            if value.startswith('{'):
+                value = value[1:-1].strip()
+
+            header[match.group(1).lower()] = value
+
+        return header
+
+    # -------------------------------------------------------------------------
+    # readWindow
+    #
+    # This returns a window of the cube shaped (bands, rows, cols), whatever
+    # the interleave.  The bands argument is a list of 0-based band indices,
+    # or None for every band.  For every band, or a contiguous range of bands,
+    # the result is a view of the memory map, not a copy, so it must not be
+    # modified.
+    #
+    # Given out, an array shaped (bands, rows, cols), the window is copied
+    # into it and it is returned.  The copy is made a band at a time for
+    # bsq and a line at a time for bil and bip, so no window-sized temporary
+    # is needed.
+    # -------------------------------------------------------------------------
+    def readWindow(self, xOff, yOff, xSize, ySize, bands=None, out=None):
+
+        rows = slice(yOff, yOff + ySize)
+        cols = slice(xOff, xOff + xSize)
+        bandIndex = EnviImageFile._bandIndex(bands)
+        cube = self.cube()
+
+        if out is not None:
+
+            if self._interleave == 'bsq':
+
+                bandList = range(self._bands) if bands is None else bands
+
+                for i, band in enumerate(bandList):
+                    out[i] = cube[band, rows, cols]
+
+            elif self._interleave == 'bil':
+
+                for row in range(ySize):
+                    out[:, row] = cube[yOff + row][bandIndex, cols]
+
+            else:
+
+                for row in range(ySize):
+                    out[:, row] = cube[yOff + row][cols, bandIndex].T
+
+            return out
+
+        if self._interleave == 'bsq':
+            return cube[bandIndex, rows, cols]
+
+        if self._interleave == 'bil':
+            return cube[rows, bandIndex, cols].transpose(1, 0, 2)
+
+        return cube[rows, cols, bandIndex].transpose(2, 0, 1)
+
+    # -------------------------------------------------------------------------
+    # _bandIndex
+    #
+    # This returns a slice for contiguous bands, so indexing yields a view.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _bandIndex(bands):
+
+        if bands is None:
+            return slice(None)
+
+        bands = list(bands)
+
+        if bands and bands == list(range(bands[0], bands[-1] + 1)):
+            return slice(bands[0], bands[-1] + 1)
+
+        return bands
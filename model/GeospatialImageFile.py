@@ -147,6 +147,26 @@ class GeospatialImageFile(ImageFile):
 
         return math.fabs(yScale * -1)
 
+    # -------------------------------------------------------------------------
+    # readWindow
+    #
+    # This returns a window of the image shaped (bands, rows, cols).  The bands
+    # argument is a list of 0-based band indices, or None for every band.
+    # Given out, an array of that shape, GDAL reads the window into it.
+    # -------------------------------------------------------------------------
+    def readWindow(self, xOff, yOff, xSize, ySize, bands=None, out=None):
+
+        bandList = None if bands is None else [band + 1 for band in bands]
+
+        window = self._getDataset().ReadAsArray(xOff,
+                                                yOff,
+                                                xSize,
+                                                ySize,
+                                                band_list=bandList,
+                                                buf_obj=out)
+
+        return window.reshape((-1, ySize, xSize))
+
     # -------------------------------------------------------------------------
     # resample
     # -------------------------------------------------------------------------
@@ -0,0 +1,149 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from model.EnviImageFile import EnviImageFile
+
+
+# -----------------------------------------------------------------------------
+# class EnviImageFileTestCase
+#
+# python -m unittest discover model/tests/
+# python -m unittest model.tests.test_EnviImageFile
+# -----------------------------------------------------------------------------
+class EnviImageFileTestCase(unittest.TestCase):
+
+    CLIP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..',
+                        '..',
+                        'projects',
+                        'aviris_regression_algorithms',
+                        'model',
+                        'tests',
+                        'clip.img')
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # _createTestFile
+    #
+    # This writes a BSQ-shaped cube to disk in the given interleave.
+    # -------------------------------------------------------------------------
+    def _createTestFile(self, bsqCube, interleave):
+
+        imageFile = os.path.join(self.outDir, interleave + '.img')
+
+        if interleave == 'bil':
+            bsqCube.transpose(1, 0, 2).tofile(imageFile)
+
+        elif interleave == 'bip':
+            bsqCube.transpose(1, 2, 0).tofile(imageFile)
+
+        else:
+            bsqCube.tofile(imageFile)
+
+        with open(os.path.join(self.outDir, interleave + '.hdr'), 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = ' + str(bsqCube.shape[2]) + '\n' +
+                    'lines = ' + str(bsqCube.shape[1]) + '\n' +
+                    'bands = ' + str(bsqCube.shape[0]) + '\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = ' + interleave + '\n' +
+                    'byte order = 0\n' +
+                    'map info = {UTM, 1, 1, 583067.28, 7917730.91, ' +
+                    '5.2, 5.2, 4, North, WGS-84}\n')
+
+        return imageFile
+
+    # -------------------------------------------------------------------------
+    # testHeader
+    # -------------------------------------------------------------------------
+    def testHeader(self):
+
+        header = EnviImageFile.readHeader(
+            EnviImageFile.headerName(EnviImageFileTestCase.CLIP))
+
+        self.assertEqual(header['bands'], '425')
+        self.assertEqual(header['interleave'], 'bsq')
+        self.assertTrue(header['map info'].endswith('rotation=42'))
+        self.assertTrue(header['band names'].startswith('376.86 Nanometers'))
+        self.assertTrue(EnviImageFile.isEnvi(EnviImageFileTestCase.CLIP))
+
+        imageFile = EnviImageFile(EnviImageFileTestCase.CLIP)
+        self.assertEqual(imageFile.cube().shape, (425, 5, 5))
+        self.assertEqual(imageFile.cube()[0, 0, 0], -9999.0)
+
+    # -------------------------------------------------------------------------
+    # testReadWindow
+    # -------------------------------------------------------------------------
+    def testReadWindow(self):
+
+        bsqCube = numpy.arange(4 * 5 * 6, dtype=numpy.float32). \
+            reshape((4, 5, 6))
+
+        expected = bsqCube[:, 1:4, 2:5]
+
+        for interleave in EnviImageFile.INTERLEAVES:
+
+            imageFile = \
+                EnviImageFile(self._createTestFile(bsqCube, interleave))
+
+            self.assertEqual(imageFile.interleave(), interleave)
+            window = imageFile.readWindow(2, 1, 3, 3)
+
+            self.assertTrue((window == expected).all())
+            self.assertTrue(numpy.may_share_memory(window, imageFile.cube()))
+
+            window = imageFile.readWindow(2, 1, 3, 3, [0, 2, 3])
+            self.assertTrue((window == expected[[0, 2, 3]]).all())
+
+            out = numpy.zeros((3, 3, 3), numpy.float64)
+            window = imageFile.readWindow(2, 1, 3, 3, [0, 2, 3], out)
+            self.assertTrue(window is out)
+            self.assertTrue((out == expected[[0, 2, 3]]).all())
+
+            out = numpy.zeros((2, 3, 3), numpy.float32)
+            imageFile.readWindow(2, 1, 3, 3, [1, 2], out)
+            self.assertTrue((out == expected[1:3]).all())
+
+    # -------------------------------------------------------------------------
+    # testConvert
+    # -------------------------------------------------------------------------
+    def testConvert(self):
+
+        bsqCube = numpy.arange(4 * 5 * 6, dtype=numpy.float32). \
+            reshape((4, 5, 6))
+
+        imageFile = EnviImageFile(self._createTestFile(bsqCube, 'bip'))
+
+        for interleave in EnviImageFile.INTERLEAVES:
+
+            outFile = os.path.join(self.outDir, 'copy_' + interleave + '.img')
+            copy = imageFile.convert(outFile, interleave, 2)
+
+            self.assertEqual(copy.interleave(), interleave)
+            self.assertEqual(copy.header()['map info'],
+                             imageFile.header()['map info'])
+
+            self.assertTrue((copy.readWindow(0, 0, 6, 5) == bsqCube).all())
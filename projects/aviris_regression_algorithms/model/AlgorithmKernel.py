@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+import numpy
+
+from projects.aviris_regression_algorithms.model.BandMath import BandMath
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class AlgorithmKernel
+#
+# This evaluates a CoefficientModel or BandMath over band stacks in memory.
+# ApplyAlgorithm uses it for each block it reads.  applyAlgorithms() is the
+# same computation for a whole cube that is already in memory, like a subset,
+# a simulation or another sensor's data, without files.
+#
+# kernel = AlgorithmKernel(CoefficientModel.read(coefFile))
+# result, invalid = kernel.applyAlgorithms(cube, ['Avg Chl'])
+#
+# Pixels whose first band is NO_DATA_VALUE and pixels the mask, a
+# one-expression BandMath, selects have no result.  By default, the mask is
+# defaultMask() of a coefficient model's mask bands.
+# -----------------------------------------------------------------------------
+class AlgorithmKernel(object):
+
+    # Intermediates are computed in one of these.  Results are float32.
+    PRECISIONS = ['float32', 'float64']
+
+    # Thresholds for the model's high and low mask bands.
+    MASK_HIGH_VALUE = 0.8
+    MASK_LOW_VALUE = 0.01
+
+    NO_DATA_VALUE = -9999.0
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # The mask is a band math expression, like 'b9 > 0.8 or b245 < 0.01', or
+    # BandMath.
+    # -------------------------------------------------------------------------
+    def __init__(self, model, mask=None, precision='float64'):
+
+        if precision not in AlgorithmKernel.PRECISIONS:
+
+            raise RuntimeError('The precision must be one of ' +
+                               str(AlgorithmKernel.PRECISIONS))
+
+        if mask is None and isinstance(model, CoefficientModel):
+            mask = AlgorithmKernel.defaultMask(model.maskBands())
+
+        if mask is not None and not isinstance(mask, BandMath):
+            mask = BandMath(mask, 'mask')
+
+        if mask and len(mask.algorithmNames()) != 1:
+            raise RuntimeError('The mask must be one expression.')
+
+        self.model = model
+        self.mask = mask
+        self.precision = precision
+
+        # Block-sized working arrays, by name and type, reused from block to
+        # block
+        self._buffers = {}
+
+    # -------------------------------------------------------------------------
+    # applyAlgorithms
+    #
+    # The cube is shaped (bands, rows, cols).  Its bands are the sorted,
+    # 1-based band numbers of its planes, by default 1 through the number of
+    # planes.  It needs at least the bands the algorithms and mask use and
+    # the no-data band.  The default, algorithmNames=None, is every algorithm
+    # in the model.
+    #
+    # This returns the float32 result, shaped (algorithms, rows, cols), and
+    # an array of the same shape that is True where there is no result.
+    # Those results are NO_DATA_VALUE.
+    # -------------------------------------------------------------------------
+    def applyAlgorithms(self, cube, algorithmNames=None, bands=None):
+
+        if algorithmNames is None:
+            algorithmNames = self.model.algorithmNames()
+
+        cube = numpy.asarray(cube)
+
+        if cube.ndim != 3:
+            raise RuntimeError('The cube must be shaped (bands, rows, cols).')
+
+        if not numpy.issubdtype(cube.dtype, numpy.floating):
+            cube = cube.astype(numpy.float32)
+
+        bands = numpy.arange(1, len(cube) + 1) if bands is None \
+            else numpy.asarray(bands)
+
+        if len(bands) != len(cube) or (numpy.diff(bands) <= 0).any():
+
+            raise RuntimeError('There must be one sorted band number per ' +
+                               'plane of the cube.')
+
+        model, requiredBands = self.reduced(algorithmNames)
+        missing = numpy.setdiff1d(requiredBands, bands)
+
+        if missing.size:
+
+            raise RuntimeError('The model requires band ' +
+                               str(missing[0]) +
+                               ', which is not in the cube.')
+
+        result = self.evaluate(cube, model, bands)[0].copy()
+
+        return result, result == AlgorithmKernel.NO_DATA_VALUE
+
+    # -------------------------------------------------------------------------
+    # buffer
+    #
+    # This returns a C-contiguous array of the given shape, reusing the
+    # storage of the buffer of the same name and type when it is large
+    # enough.
+    # -------------------------------------------------------------------------
+    def buffer(self, name, shape, dtype):
+
+        size = int(numpy.prod(shape))
+        key = (name, numpy.dtype(dtype).name)
+        buf = self._buffers.get(key)
+
+        if buf is None or buf.size < size:
+
+            buf = numpy.empty(size, dtype)
+            self._buffers[key] = buf
+
+        return buf[:size].reshape(shape)
+
+    # -------------------------------------------------------------------------
+    # defaultMask
+    #
+    # This returns the mask expression for a coefficient model's mask bands:
+    # its high band over MASK_HIGH_VALUE or its low band under MASK_LOW_VALUE.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def defaultMask(maskBands):
+
+        highBand, lowBand = maskBands
+
+        return 'b' + str(highBand) + ' > ' + \
+            repr(AlgorithmKernel.MASK_HIGH_VALUE) + \
+            ' or b' + str(lowBand) + ' < ' + \
+            repr(AlgorithmKernel.MASK_LOW_VALUE)
+
+    # -------------------------------------------------------------------------
+    # evaluate
+    #
+    # The stack is shaped (bands, rows, cols), holding the sorted, 1-based
+    # bands given.  The model is this kernel's model, reduced.  This returns
+    # the result, shaped (algorithms, rows, cols), and the no-data, mask and
+    # divisor arrays, shaped (rows, cols).  Pixels whose first band is
+    # no-data, pixels the mask selects and pixels with no valid result become
+    # NO_DATA_VALUE.  For BandMath, the divisor is None.
+    #
+    # The work is done in buffers reused from block to block.  The returned
+    # arrays are those buffers, valid until the next block is evaluated.
+    # Intermediates are computed in precision, by default the kernel's.
+    #
+    # Given layers, the block's no-data, mask and divisor arrays, as from
+    # SceneLayers, they are used instead of being computed, and the stack
+    # needs only the bands of reduced(algorithmNames, True).
+    # -------------------------------------------------------------------------
+    def evaluate(self, stack, model, bands, precision=None, layers=None):
+
+        computeType = numpy.dtype(precision or self.precision)
+        numBands, rows, cols = stack.shape
+        pixels = rows * cols
+        stack = stack.reshape(numBands, pixels)
+
+        noData = self.buffer('noData', (pixels,), numpy.bool_)
+        masked = self.buffer('masked', (pixels,), numpy.bool_)
+        invalid = self.buffer('invalid', (pixels,), numpy.bool_)
+
+        if layers:
+
+            noData[...] = layers[0].reshape(pixels)
+            masked[...] = layers[1].reshape(pixels)
+
+        else:
+
+            noDataBand = numpy.searchsorted(bands,
+                                            CoefficientModel.NO_DATA_BAND)
+
+            numpy.equal(stack[noDataBand],
+                        AlgorithmKernel.NO_DATA_VALUE,
+                        noData)
+
+            # The mask is evaluated in the precision of the stack, as read.
+            if self.mask:
+                masked[...] = self.mask.evaluate(stack, bands)[0]
+            else:
+                masked.fill(False)
+
+        numpy.logical_or(noData, masked, invalid)
+
+        result = self.buffer('result',
+                             (len(model.algorithmNames()), rows, cols),
+                             numpy.float32)
+
+        if isinstance(model, BandMath):
+
+            divisor = None
+            outputs = model.evaluate(stack, bands, computeType)
+
+            for output, resultBand in zip(outputs, result):
+
+                resultBand = resultBand.reshape(pixels)
+                resultBand[...] = output
+
+                resultBand[invalid | ~numpy.isfinite(output)] = \
+                    AlgorithmKernel.NO_DATA_VALUE
+
+        else:
+
+            divisor = self._evaluateRegression(
+                stack, model, bands, computeType, invalid,
+                result.reshape(-1, pixels),
+                layers[2].reshape(pixels) if layers else None)
+
+            divisor = divisor.reshape(rows, cols)
+
+        return result, \
+            noData.reshape(rows, cols), \
+            masked.reshape(rows, cols), \
+            divisor
+
+    # -------------------------------------------------------------------------
+    # _evaluateRegression
+    #
+    # This evaluates a CoefficientModel for evaluate() over the stack, shaped
+    # (bands, pixels), writing it to result, shaped (algorithms, pixels).
+    # Pixels that are invalid on entry, and pixels with a zero divisor, become
+    # NO_DATA_VALUE.  This returns the divisor, which is computed unless
+    # given as knownDivisor.
+    # -------------------------------------------------------------------------
+    def _evaluateRegression(self, stack, model, bands, computeType, invalid,
+                            result, knownDivisor=None):
+
+        pixels = stack.shape[1]
+
+        # ---
+        # Compute the square root of the sum of the squares of all band
+        # reflectances between 397nm and 898nm.  Those reflectances
+        # translate to bands 6 - 105.  The squares are summed as the bands
+        # are copied to the compute precision, in one pass.
+        # ---
+        modelBands = numpy.searchsorted(bands, model.bandIndices())
+        inDivisor = model.divisorMask()
+
+        if knownDivisor is not None:
+            inDivisor = numpy.zeros(len(modelBands), numpy.bool_)
+
+        values = self.buffer('values', (len(modelBands), pixels),
+                             computeType)
+
+        divisor = self.buffer('divisor', (pixels,), computeType)
+        square = self.buffer('square', (pixels,), computeType)
+        zero = self.buffer('zero', (pixels,), numpy.bool_)
+        divisor.fill(0.0)
+
+        for i in range(len(modelBands)):
+
+            values[i] = stack[modelBands[i]]
+
+            if inDivisor[i]:
+
+                numpy.multiply(values[i], values[i], square)
+                divisor += square
+
+        if knownDivisor is not None:
+            divisor[...] = knownDivisor
+        else:
+            numpy.sqrt(divisor, divisor)
+        numpy.greater(divisor, 0.0, zero)
+        numpy.logical_not(zero, zero)
+        invalid |= zero
+
+        # Compute the result, normalizing pixel values by the divisor.
+        algorithmNames = model.algorithmNames()
+        intercepts = model.intercepts(algorithmNames).astype(computeType)
+
+        coefs = numpy.ascontiguousarray(
+            model.coefficientMatrix(algorithmNames).T, computeType)
+
+        p = self.buffer('p', (len(algorithmNames), pixels), computeType)
+        numpy.dot(coefs, values, p)
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            p /= divisor
+
+        p += intercepts[:, None]
+        numpy.copyto(p, AlgorithmKernel.NO_DATA_VALUE, where=invalid)
+        result[...] = p
+
+        return divisor
+
+    # -------------------------------------------------------------------------
+    # reduced
+    #
+    # This reduces the model to the algorithms and the bands affecting them,
+    # and returns it with the sorted, 1-based bands needed:  those of the
+    # model and the mask, and the no-data band.  With layers, the no-data,
+    # mask and divisor come from SceneLayers, so only the bands the
+    # algorithms weight are needed.  This ensures the names are valid.
+    # -------------------------------------------------------------------------
+    def reduced(self, algorithmNames, layers=False):
+
+        if layers and isinstance(self.model, CoefficientModel):
+
+            model = self.model.reduced(algorithmNames, False)
+            return model, numpy.unique(model.bandIndices())
+
+        model = self.model.reduced(algorithmNames)
+
+        if layers:
+            return model, numpy.unique(model.bandIndices())
+
+        bands = numpy.union1d(model.bandIndices(),
+                              [CoefficientModel.NO_DATA_BAND])
+
+        if self.mask:
+            bands = numpy.union1d(bands, self.mask.bandIndices())
+
+        return model, bands
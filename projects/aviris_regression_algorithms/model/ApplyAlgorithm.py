@@ -1,32 +1,167 @@
 # -*- coding: utf-8 -*-
 
-import csv
-import math
+import json
+import multiprocessing
 import os
-import re
-import struct
+import resource
+import sys
+import time
+
+import numpy
 
 from osgeo import gdal
 from osgeo import gdalconst
 
-from model.BaseFile import BaseFile
+from model.EnviImageFile import EnviImageFile
 from model.GeospatialImageFile import GeospatialImageFile
 
+from projects.aviris_regression_algorithms.model.AlgorithmKernel \
+    import AlgorithmKernel
+from projects.aviris_regression_algorithms.model.AreaOfInterest \
+    import AreaOfInterest
+from projects.aviris_regression_algorithms.model.BandMath import BandMath
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+from projects.aviris_regression_algorithms.model.GeoTiffOptions \
+    import GeoTiffOptions
+from projects.aviris_regression_algorithms.model.OutputStatistics \
+    import OutputStatistics
+from projects.aviris_regression_algorithms.model.PipelineStage \
+    import PipelineStage
+from projects.aviris_regression_algorithms.model.SceneLayers \
+    import SceneLayers
+from projects.aviris_regression_algorithms.model.TileJournal \
+    import TileJournal
+from projects.aviris_regression_algorithms.model.ValidityIndex \
+    import ValidityIndex
+
 
 # -----------------------------------------------------------------------------
 # class ApplyAlgorithm
 #
 # gdallocationinfo -b 10
 #     projects/aviris_regression_algorithms/model/tests/clip.img 0 0
+#
+# The scene is processed in blocks of full-width row strips.  Each block's
+# band stack is read with one call, the mask, divisor and coefficient dot
+# product are computed as array operations over the whole block, by an
+# AlgorithmKernel, and the result is written with one call.  The model may
+# instead be BandMath, whose expressions are evaluated the same way, block by
+# block.
+#
+# Pixels selected by the mask, a one-expression BandMath, have no result.
+# By default, it is AlgorithmKernel.defaultMask() of the coefficient model's
+# mask bands.  The number of rows in a block is chosen so the block stays
+# within maxBlockBytes, unless tileSize gives the block shape as (columns,
+# rows).
+#
+# After clip(), only the blocks of the area of interest's window are read and
+# computed.  The outputs are cropped to the window, or the size of the image,
+# and pixels outside the area have no result.
+#
+# Raw ENVI images are read through a memory map, other formats through GDAL.
+# Outputs are written as outputOptions, a GeoTiffOptions, describes.
+#
+# Blocks follow the source interleave.  In BSQ, each band of a full-width
+# strip is one contiguous run, so only the bands needed are read.  In BIL and
+# BIP, a strip is one contiguous run of whole lines or whole pixels, and
+# every band in it is paged in, so strips are sized for every band.  When
+# several runs will read the same scene, cacheInterleave makes a one-time
+# copy of it in that interleave, in outDir, which later runs reuse.
+#
+# With numWorkers > 1, blocks are computed in a local process pool, each
+# worker within its own maxBlockBytes, and written to the output in order.
+# Results match serial mode exactly.
+#
+# Every checkpointSeconds, the outputs are flushed and the last block
+# written is recorded in a TileJournal beside the first output.  A run
+# interrupted after a checkpoint continues from the block after it.  When
+# checkpointSeconds is None, there is no journal.
+#
+# With skipEmpty, a ValidityIndex of the no-data band is built once and kept
+# in outDir.  Blocks without a valid pixel are written as no-data, without
+# reading or computing them.  Without a tile size, strips are split at the
+# index's cells, so the fill beside a rotated flight line is skipped too.
+#
+# With layerDir, the no-data and mask flags and the divisor are kept there as
+# SceneLayers, written during the first full run over the scene.  Later runs,
+# even with other coefficients, read them instead of the no-data, mask and
+# divisor bands, and read only the bands the algorithms weight.
+#
+# Each output band's statistics, accumulated as its blocks are written, are
+# recorded in its metadata and, by algorithm, in an OutputStatistics JSON
+# file beside the output, without reading the output again.
+#
+# With prefetchDepth > 0, reading, computing and writing overlap.  A reader
+# thread reads up to prefetchDepth blocks ahead of the computation, and a
+# writer thread writes the results while the next blocks are computed, with
+# up to prefetchDepth results waiting for it.  As many as 2 * prefetchDepth
+# + 1 blocks are in flight, so the strips are sized for maxBlockBytes shared
+# among them.  Tiles of tileSize are not, so each takes its own memory.  The
+# seconds each stage waits for the others are reported.
+#
+# trace() follows chosen pixels through a run.  Their intermediates are
+# picked out of each block's arrays as it is evaluated.
 # -----------------------------------------------------------------------------
 class ApplyAlgorithm(object):
 
-    NO_DATA_VALUE = -9999.0
+    # Intermediates are computed in one of these.  The stack read and the
+    # results written are always float32.
+    PRECISIONS = AlgorithmKernel.PRECISIONS
+
+    DEFAULT_CHECKPOINT_SECONDS = 60
+    DEFAULT_MAX_BLOCK_BYTES = 256 * 1024 * 1024
+
+    NO_DATA_VALUE = AlgorithmKernel.NO_DATA_VALUE
+
+    GDAL_INTERLEAVES = {'BAND': 'bsq', 'LINE': 'bil', 'PIXEL': 'bip'}
+
+    # Reasons a pixel has no result
+    MASK_REASON = 'Mask'
+    NO_DATA_REASON = 'No data'
+    OUTSIDE_AREA_REASON = 'Outside area'
+    OUTSIDE_REASON = 'Outside image'
+    ZERO_DIVISOR_REASON = 'Zero divisor'
+
+    # How a run uses its scene layers
+    BUILD_LAYERS = 'built'
+    READ_LAYERS = 'read'
+
+    # Fields of comparePrecision's report for each algorithm
+    ACCURACY_FIELDS = ['Pixels compared',
+                       'Validity mismatches',
+                       'Max abs error',
+                       'Mean abs error',
+                       'RMS error',
+                       'Max rel error']
+
+    # Point queries read the bounding window of their points in each tile.
+    POINT_FIELDS = ['row', 'col', 'x', 'y', 'Mask reason', 'Divisor']
+    QUERY_TILE_SIZE = 64
 
     # -------------------------------------------------------------------------
     # __init__
+    #
+    # coefFile is a coefficient CSV, a compiled CoefficientModel sidecar, a
+    # CoefficientModel or BandMath.  The mask is a band math expression, like
+    # 'b9 > 0.8 or b245 < 0.01', or BandMath.
     # -------------------------------------------------------------------------
-    def __init__(self, coefFile, avirisImage, outDir, logger=None):
+    def __init__(self,
+                 coefFile,
+                 avirisImage,
+                 outDir,
+                 logger=None,
+                 maxBlockBytes=DEFAULT_MAX_BLOCK_BYTES,
+                 numWorkers=1,
+                 tileSize=None,
+                 outputOptions=None,
+                 cacheInterleave=None,
+                 precision='float64',
+                 checkpointSeconds=DEFAULT_CHECKPOINT_SECONDS,
+                 mask=None,
+                 skipEmpty=False,
+                 layerDir=None,
+                 prefetchDepth=0):
 
         if not outDir:
             raise RuntimeError('An output directory must be provided.')
@@ -34,219 +169,1464 @@ class ApplyAlgorithm(object):
         if not os.path.exists(outDir) or not os.path.isdir(outDir):
             raise RuntimeError(str(outDir) + ' is not an existing directory.')
 
+        if maxBlockBytes <= 0:
+            raise RuntimeError('The block memory budget must be positive.')
+
+        if numWorkers < 1:
+            raise RuntimeError('There must be at least one worker.')
+
+        if tileSize and (len(tileSize) != 2 or min(tileSize) < 1):
+
+            raise RuntimeError('The tile size must be a positive number ' +
+                               'of columns and rows.')
+
+        if prefetchDepth < 0:
+            raise RuntimeError('The prefetch depth cannot be negative.')
+
         self.logger = logger
         self.outDir = outDir
-        self.coefFile = BaseFile(coefFile, '.csv')
-        self.imageFile = GeospatialImageFile(avirisImage, None, None)
-        self.coefs = []
+        self.maxBlockBytes = maxBlockBytes
+        self.numWorkers = numWorkers
+        self.tileSize = tileSize
+        self.outputOptions = outputOptions or GeoTiffOptions()
+        self.precision = precision
+        self.checkpointSeconds = checkpointSeconds
+        self.skipEmpty = skipEmpty
+        self.layerDir = layerDir
+        self.prefetchDepth = prefetchDepth
+
+        if EnviImageFile.isEnvi(avirisImage):
+            self.imageFile = EnviImageFile(avirisImage)
+        else:
+            self.imageFile = GeospatialImageFile(avirisImage, None, None)
 
-        with open(self.coefFile.fileName()) as csvFile:
+        # Band stacks are read from cubeFile, the image or its cached copy.
+        self.cubeFile = self.imageFile
 
-            reader = csv.DictReader(csvFile)
+        if cacheInterleave:
+            self.cubeFile = self._cachedCopy(cacheInterleave)
 
-            for row in reader:
-                self.coefs.append(row)
+        model = coefFile \
+            if isinstance(coefFile, (CoefficientModel, BandMath)) \
+            else CoefficientModel.read(coefFile)
 
-        # Set up debugging.
-        self.debugRow = None
-        self.debugCol = None
-        self.debugDict = None   # {'Band': [0, value]}
+        self.kernel = AlgorithmKernel(model, mask, precision)
+        self.model = self.kernel.model
+        self.mask = self.kernel.mask
+
+        # Measurements of the last run, like the I/O saved, by name.
+        self.report = {}
+
+        # The scene layers of a run and whether they are being read or built
+        self._layers = None
+        self._layerMode = None
+
+        # The time of a run's last checkpoint
+        self._lastCheckpoint = None
+
+        # The area of interest, set by clip()
+        self.area = None
+        self.cropToArea = True
+
+        # The pixels traced, as rows of (row, col), and their traces
+        self.tracePixels = None
+        self.traces = None      # {(row, col): trace}
 
     # -------------------------------------------------------------------------
     # applyAlgorithm
     #
     # P = a0 + a1b1 + a2b2 …
+    #
+    # This writes <algorithmName>.tif to the output directory.
     # -------------------------------------------------------------------------
     def applyAlgorithm(self, algorithmName):
 
-        # Ensure the algorithm name is valid.
-        if algorithmName not in self.coefs[0]:
+        return self.applyAlgorithms([algorithmName], True)[0]
+
+    # -------------------------------------------------------------------------
+    # applyAlgorithms
+    #
+    # This evaluates several algorithms in one pass over the cube, reading
+    # each block once and applying a matrix of coefficients with one column
+    # per algorithm.  The default, algorithmNames=None, is every algorithm in
+    # the model.  Results go to one file per algorithm, <algorithmName>.tif,
+    # or to one multi-band GeoTIFF named for the image, whose bands are in
+    # the order of algorithmNames.  This returns the output paths.
+    # -------------------------------------------------------------------------
+    def applyAlgorithms(self, algorithmNames=None, separateFiles=False):
 
-            raise RuntimeError('Algorithm ' +
-                               str(algorithmName) +
-                               ' not in coeffient file, ' +
-                               self.coefFile)
+        if algorithmNames is None:
+            algorithmNames = self.model.algorithmNames()
 
-        # Create the output raster.
-        outName = os.path.join(self.outDir, algorithmName + '.tif')
-        driver = gdal.GetDriverByName('GTiff')
+        if not algorithmNames:
+            raise RuntimeError('At least one algorithm must be specified.')
 
-        outDs = driver.Create(outName,
-                              self.imageFile._getDataset().RasterXSize,
-                              self.imageFile._getDataset().RasterYSize,
-                              1,
-                              gdalconst.GDT_Float32)
+        outPaths = [os.path.join(self.outDir, outName) for outName in
+                    ApplyAlgorithm.outputNames(self.imageFile.fileName(),
+                                               algorithmNames,
+                                               separateFiles)]
 
-        outDs.SetProjection(self.imageFile._getDataset().GetProjection())
-        outDs.SetGeoTransform(self.imageFile._getDataset().GetGeoTransform())
+        imagePath = os.path.realpath(self.imageFile.fileName())
 
-        # ---
-        # Iterate through the raster, pixel by pixel.
-        # ---
-        for row in range(self.imageFile._getDataset().RasterYSize):
-            for col in range(self.imageFile._getDataset().RasterXSize):
+        if imagePath in [os.path.realpath(outPath) for outPath in outPaths]:
 
-                # Read the stack of pixels at this col, row location.
-                pixelStack = self._readStack(col, row)
+            raise RuntimeError('The output ' +
+                               imagePath +
+                               ' would overwrite the image.  Use another ' +
+                               'output directory.')
 
-                # Check for no-data in the first pixel of the stack.
-                if pixelStack[0] == ApplyAlgorithm.NO_DATA_VALUE:
+        self.report = {}
 
-                    hexValue = struct.pack('f', ApplyAlgorithm.NO_DATA_VALUE)
-                    outDs.WriteRaster(col, row, 1, 1, hexValue)
+        # Layers are not used while tracing, which reports every band.
+        self._layers = self._sceneLayers() \
+            if self.layerDir and self.tracePixels is None else None
 
-                    if self.debugRow == row and self.debugCol == col:
-                        self.debugDict[0] = 'No data'
+        if self.tracePixels is not None:
+            self.traces = {}
 
-                    continue
+        self._layerMode = \
+            ApplyAlgorithm.READ_LAYERS \
+            if self._layers and self._layers.exists() else None
+
+        model, bands = self._reducedModel(algorithmNames, self._layerMode)
+
+        blocks = list(self._blocks(len(bands), len(algorithmNames)))
+        journal = self._journal(outPaths, model, blocks)
+        firstBlock = journal.start() if journal else 0
+
+        if firstBlock:
+
+            outDss, outBands = self._openOutputs(outPaths)
+
+            if self.logger:
+
+                self.logger.info('Resuming at block ' +
+                                 str(firstBlock) +
+                                 ' of ' +
+                                 str(len(blocks)) +
+                                 ' from ' +
+                                 journal.path())
+
+        else:
+
+            outDss, outBands = self._createOutputs(outPaths, algorithmNames)
+
+        # A failed run removes the scene layers it was building, which are
+        # as large as the scene.
+        try:
+
+            # Layers are built only by a run over every block of the scene.
+            if self._layers and not self._layerMode and \
+               not firstBlock and not self.area:
+
+                self._layerMode = ApplyAlgorithm.BUILD_LAYERS
+                self._layers.create()
+
+            self.report['Scene layers'] = self._layerMode
+            self.report['Blocks resumed'] = firstBlock
+            pending = blocks[firstBlock:]
+            empty = self._emptyBlocks(pending)
+            toCompute = [block for block in pending if block not in empty]
+            self.report['Blocks skipped'] = len(empty)
+
+            self.report['Pixels skipped'] = \
+                sum(xSize * ySize for xOff, yOff, xSize, ySize in empty)
+
+            if self.numWorkers > 1:
+
+                results = self._computeBlocksInParallel(toCompute,
+                                                        model,
+                                                        bands)
+
+            else:
+
+                results = self._computeBlocks(toCompute, model, bands)
+
+            if empty:
+
+                results = self._fillEmptyBlocks(pending,
+                                                empty,
+                                                results,
+                                                len(algorithmNames))
+
+            # Write the results, block by block, in order, accumulating
+            # their statistics.  Those of blocks written before a resumption
+            # are read back.
+            self._lastCheckpoint = time.time()
+            outXOff, outYOff = self._outputWindow()[:2]
+            statistics = [OutputStatistics() for i in range(len(outBands))]
+
+            for xOff, yOff, xSize, ySize in blocks[:firstBlock]:
+
+                for i in range(len(outBands)):
+
+                    statistics[i].add(outBands[i].ReadAsArray(xOff - outXOff,
+                                                              yOff - outYOff,
+                                                              xSize,
+                                                              ySize),
+                                      ApplyAlgorithm.NO_DATA_VALUE)
+
+            if self.prefetchDepth:
+
+                self._writeBlocksInThread(results, firstBlock, outDss,
+                                          outBands, statistics, journal,
+                                          len(blocks))
+
+            else:
+
+                for index, (window, result, blockLayers) in \
+                        enumerate(results, firstBlock):
+
+                    self._writeBlock(index, window, result, blockLayers,
+                                     outDss, outBands, statistics, journal,
+                                     len(blocks))
+
+            # Outside an area of interest, the outputs are no-data, though
+            # no blocks are written there, so the output's size is the pixel
+            # count.
+            outXSize, outYSize = self._outputWindow()[2:]
+
+            for i in range(len(outBands)):
+
+                statistics[i].pixels = outXSize * outYSize
+                statistics[i].writeMetadata(outBands[i])
+
+            self._writeStatistics(outPaths, algorithmNames, statistics)
+            outBands = None
+
+            # Each dataset must be closed before its temporary file is
+            # removed.
+            for i in range(len(outDss)):
+
+                self.outputOptions.finish(outDss[i], outPaths[i])
+                outDss[i] = None
+                self.outputOptions.removeTemporary(outPaths[i])
+
+            if journal:
+                journal.remove()
+
+            if self._layerMode == ApplyAlgorithm.BUILD_LAYERS:
+                self._layers.finish()
+
+        except BaseException:
+
+            if self._layerMode == ApplyAlgorithm.BUILD_LAYERS:
+                self._layers.abandon()
+
+            raise
+
+        self._layers = None
+        self._layerMode = None
+
+        if self.tracePixels is not None:
+            self._writeTraces()
+
+        self._reportIo(len(bands))
+        self._reportMemory()
+
+        return outPaths
+
+    # -------------------------------------------------------------------------
+    # _blocks
+    #
+    # This yields (xOff, yOff, xSize, ySize) windows in row-major order,
+    # which is the order of the lines on disk, covering the area of interest's
+    # window or the whole image.  Without a tile size, they are full-width
+    # row strips sized to fit maxBlockBytes.  In BSQ, the strip
+    # holds numBands bands; in BIL and BIP, it holds every band, as reading
+    # any band of a line or pixel reads them all.  There is always at least
+    # one row per block.  With prefetchDepth, the budget is shared by the
+    # blocks in flight.
+    #
+    # A rotated flight line leaves few whole strips empty, so, with
+    # skipEmpty, strips are at most one ValidityIndex cell tall and are split
+    # into their empty and valid runs of cells, so their empty ends are
+    # skipped.
+    # -------------------------------------------------------------------------
+    def _blocks(self, numBands, numOutputs=1):
+
+        dataset = self.imageFile._getDataset()
+        index = None
+
+        xStart, yStart, width, height = self.area.window() if self.area \
+            else (0, 0, dataset.RasterXSize, dataset.RasterYSize)
+
+        if self.tileSize:
+
+            colsPerBlock, rowsPerBlock = self.tileSize
+
+        else:
+
+            if self.interleave() != 'bsq':
+                numBands = dataset.RasterCount
+
+            bytesPerRow = width * \
+                (numBands + numOutputs) * \
+                self.bytesPerSample()
+
+            # The block being computed, those read ahead and the results
+            # waiting to be written
+            blocksInFlight = 2 * self.prefetchDepth + 1
+            colsPerBlock = width
+
+            rowsPerBlock = \
+                max(1, min(height,
+                           self.maxBlockBytes // blocksInFlight //
+                           bytesPerRow))
+
+            if self.skipEmpty:
+
+                index = self._validityIndex()
+                rowsPerBlock = min(rowsPerBlock, index.cellSize)
+
+        for yOff in range(0, height, rowsPerBlock):
+            for xOff in range(0, width, colsPerBlock):
+
+                window = (xStart + xOff,
+                          yStart + yOff,
+                          min(colsPerBlock, width - xOff),
+                          min(rowsPerBlock, height - yOff))
+
+                if index:
+
+                    for block in index.splitColumns(*window):
+                        yield block
+
+                else:
+                    yield window
+
+    # -------------------------------------------------------------------------
+    # bytesPerSample
+    #
+    # This returns the bytes of working memory needed per band-pixel:  the
+    # float32 stack and its copy in the compute precision.  Outputs need the
+    # same per pixel.
+    # -------------------------------------------------------------------------
+    def bytesPerSample(self):
+
+        return 4 + numpy.dtype(self.precision).itemsize
+
+    # -------------------------------------------------------------------------
+    # _cachedCopy
+    #
+    # This returns the copy of the image in the given interleave, in the
+    # output directory, making it unless it and its header exist and are
+    # newer than the image.  An image already in that interleave is its own
+    # copy.
+    # -------------------------------------------------------------------------
+    def _cachedCopy(self, interleave):
 
-                # ---
-                # Associate the pixel values in the stack with the band
-                # and coefficient information.
-                # {bandNumber: (coefficient, pixel value)}
-                # ---
-                bandCoefValueDict = \
-                    self._associateValuesWithCoefs(pixelStack, algorithmName)
+        if not isinstance(self.imageFile, EnviImageFile):
 
-                # Apply masks.
-                if bandCoefValueDict[9][1] > 0.8 or \
-                   bandCoefValueDict[245][1] < 0.01:
+            raise RuntimeError('Only ENVI images can be cached in another ' +
+                               'interleave.')
 
-                    hexValue = struct.pack('f', ApplyAlgorithm.NO_DATA_VALUE)
-                    outDs.WriteRaster(col, row, 1, 1, hexValue)
+        if self.imageFile.interleave() == interleave:
+            return self.imageFile
 
-                    if self.debugRow == row and self.debugCol == col:
+        imagePath = self.imageFile.fileName()
+        baseName = os.path.splitext(os.path.basename(imagePath))[0]
 
-                        self.debugDict[0] = 'Mask'
-                        self.debugDict[10] = bandCoefValueDict[9][1]
-                        self.debugDict[246] = bandCoefValueDict[245][1]
+        cachePath = os.path.join(self.outDir,
+                                 baseName + '_' + interleave + '.img')
 
+        cacheHdr = os.path.splitext(cachePath)[0] + '.hdr'
+
+        inputTime = max(os.path.getmtime(imagePath),
+                        os.path.getmtime(EnviImageFile.headerName(imagePath)))
+
+        if os.path.exists(cacheHdr) and os.path.exists(cachePath) and \
+           os.path.getmtime(cachePath) >= inputTime and \
+           os.path.getmtime(cacheHdr) >= inputTime:
+
+            return EnviImageFile(cachePath)
+
+        if self.logger:
+
+            self.logger.info('Caching ' +
+                             imagePath +
+                             ' in ' +
+                             interleave +
+                             ' as ' +
+                             cachePath)
+
+        return self.imageFile.convert(cachePath, interleave)
+
+    # -------------------------------------------------------------------------
+    # clip
+    #
+    # This limits applyAlgorithms() and comparePrecision() to an area of
+    # interest, an Envelope or OGR polygon in any SRS.  With crop, the
+    # outputs cover only its window; otherwise, they cover the image, and
+    # are NO_DATA_VALUE outside it.
+    # -------------------------------------------------------------------------
+    def clip(self, geometry, crop=True):
+
+        self.area = AreaOfInterest(geometry, self.imageFile)
+        self.cropToArea = crop
+
+    # -------------------------------------------------------------------------
+    # _clipBlock
+    #
+    # This sets the results of a block outside the area of interest to
+    # NO_DATA_VALUE and returns the pixels outside it, or None when there is
+    # no area.
+    # -------------------------------------------------------------------------
+    def _clipBlock(self, result, xOff, yOff):
+
+        if not self.area:
+            return None
+
+        outside = self.area.outside(xOff,
+                                    yOff,
+                                    result.shape[2],
+                                    result.shape[1])
+
+        if outside.any():
+            result[:, outside] = ApplyAlgorithm.NO_DATA_VALUE
+
+        return outside
+
+    # -------------------------------------------------------------------------
+    # comparePrecision
+    #
+    # This evaluates the algorithms over the image in float32 and in float64,
+    # writing nothing, and returns a report on the float32 results for each
+    # algorithm, by name.  The report is a dictionary of ACCURACY_FIELDS:
+    # the number of pixels valid in both, the number valid in only one, and
+    # the errors of the float32 output relative to the float64 output.
+    # -------------------------------------------------------------------------
+    def comparePrecision(self, algorithmNames=None):
+
+        if algorithmNames is None:
+            algorithmNames = self.model.algorithmNames()
+
+        model, bands = self._reducedModel(algorithmNames)
+        numAlgs = len(algorithmNames)
+        pixels = numpy.zeros(numAlgs, numpy.int64)
+        mismatches = numpy.zeros(numAlgs, numpy.int64)
+        sumAbs = numpy.zeros(numAlgs)
+        sumSquares = numpy.zeros(numAlgs)
+        maxAbs = numpy.zeros(numAlgs)
+        maxRel = numpy.zeros(numAlgs)
+
+        blocks = list(self._blocks(len(bands), 2 * numAlgs))
+        empty = self._emptyBlocks(blocks)
+
+        for xOff, yOff, xSize, ySize in blocks:
+
+            if (xOff, yOff, xSize, ySize) in empty:
+                continue
+
+            stack = self._readBlock(xOff, yOff, xSize, ySize, bands)
+
+            single = \
+                self.kernel.evaluate(stack, model, bands, 'float32')[0].copy()
+
+            double = self.kernel.evaluate(stack, model, bands, 'float64')[0]
+            self._clipBlock(single, xOff, yOff)
+            self._clipBlock(double, xOff, yOff)
+
+            for i in range(numAlgs):
+
+                singleValid = single[i] != ApplyAlgorithm.NO_DATA_VALUE
+                doubleValid = double[i] != ApplyAlgorithm.NO_DATA_VALUE
+                both = singleValid & doubleValid
+                mismatches[i] += (singleValid != doubleValid).sum()
+
+                reference = double[i][both].astype(numpy.float64)
+                error = numpy.abs(single[i][both] - reference)
+
+                if not error.size:
                     continue
 
-                # ---
-                # Compute the square root of the sum of the squares of all band
-                # reflectances between 397nm and 898nm.  Those reflectances
-                # translate to bands 6 - 105.
-                # ---
-                divisor = self._computeDivisor(bandCoefValueDict)
+                pixels[i] += error.size
+                sumAbs[i] += error.sum()
+                sumSquares[i] += (error ** 2).sum()
+                maxAbs[i] = max(maxAbs[i], error.max())
+                nonZero = reference != 0
+
+                if nonZero.any():
+
+                    maxRel[i] = max(maxRel[i],
+                                    (error[nonZero] /
+                                     numpy.abs(reference[nonZero])).max())
+
+        report = {}
+
+        for i in range(numAlgs):
+
+            count = max(pixels[i], 1)
+
+            report[algorithmNames[i]] = dict(zip(
+                ApplyAlgorithm.ACCURACY_FIELDS,
+                [int(pixels[i]),
+                 int(mismatches[i]),
+                 float(maxAbs[i]),
+                 float(sumAbs[i] / count),
+                 float(numpy.sqrt(sumSquares[i] / count)),
+                 float(maxRel[i])]))
+
+        return report
 
-                if debugKey:
+    # -------------------------------------------------------------------------
+    # _computeBlock
+    #
+    # This evaluates a block and records the traces of its pixels.  See
+    # AlgorithmKernel.evaluate.  It returns the result and, while the scene
+    # layers are being built, the block's no-data, mask and divisor arrays.
+    # -------------------------------------------------------------------------
+    def _computeBlock(self, stack, model, bands, xOff, yOff):
 
-                    for band in bandCoefValueDict.iterkeys():
+        layers = None
 
-                        value = bandCoefValueDict[band][1]
-                        self._addDebugDictItem(band, debugKey, value)
+        if self._layerMode == ApplyAlgorithm.READ_LAYERS:
 
-                    if self.debugRow == row and self.debugCol == col:
-                        self.debugDict['Divisor'] = divisor
+            layers = self._layers.read(xOff,
+                                       yOff,
+                                       stack.shape[2],
+                                       stack.shape[1])
 
-                # Compute the result, normalizing pixel values as we go.
-                p = 0.0
+        result, noData, masked, divisor = \
+            self.kernel.evaluate(stack, model, bands, layers=layers)
 
-                for band in bandCoefValueDict.iterkeys():
+        outside = self._clipBlock(result, xOff, yOff)
 
-                    coefValue = bandCoefValueDict[band]
-                    coef = coefValue[0]
-                    normalizedValue = coefValue[1] / divisor
+        self._traceBlock(stack, model, bands, noData, masked, divisor, result,
+                         outside, xOff, yOff)
 
-                    if band == 0:
+        if self._layerMode == ApplyAlgorithm.BUILD_LAYERS:
+            return result, (noData, masked, divisor)
 
-                        p = normalizedValue
+        return result, None
 
-                    else:
+    # -------------------------------------------------------------------------
+    # _emptyBlocks
+    #
+    # This returns the set of blocks without a valid pixel, which is empty
+    # unless skipEmpty is set.
+    # -------------------------------------------------------------------------
+    def _emptyBlocks(self, blocks):
 
-                        p += coef * normalizedValue
+        if not self.skipEmpty:
+            return set()
 
-                hexValue = struct.pack('f', p)
-                outDs.WriteRaster(col, row, 1, 1, hexValue)
+        index = self._validityIndex()
 
-        outDs = None
-        self._writeDebugDict()
+        return set(block for block in blocks if index.isEmpty(*block))
 
     # -------------------------------------------------------------------------
-    # _associateValuesWithCoefs
+    # _computeBlocks
+    #
+    # This yields (window, result, layers) for each window, in order.  See
+    # _computeBlock.
     # -------------------------------------------------------------------------
-    def _associateValuesWithCoefs(self, pixelStack, algorithmName):
+    def _computeBlocks(self, blocks, model, bands):
 
-        bandCoefValueDict = {}
+        stacks = self._readBlocks(blocks, bands)
+        reader = None
 
-        for coefRow in self.coefs:
+        if self.prefetchDepth:
 
-            bandIndex = \
-                int(re.search(r'\d{0,3}$', coefRow['Band Number']).group())
+            reader = PipelineStage(self.prefetchDepth)
+            stacks = reader.read(stacks)
 
-            coef = float(coefRow[algorithmName])
-            value = pixelStack[bandIndex-1] if bandIndex > 0 else 0.0
-            bandCoefValueDict[bandIndex] = (coef, value)
+        for (xOff, yOff, xSize, ySize), stack in stacks:
 
-        return bandCoefValueDict
+            result, layers = \
+                self._computeBlock(stack, model, bands, xOff, yOff)
+
+            yield (xOff, yOff, xSize, ySize), result, layers
+
+        if reader:
+
+            self.report['Read stall seconds'] = reader.threadStall
+
+            self.report['Compute stall seconds'] = \
+                self.report.get('Compute stall seconds', 0.0) + \
+                reader.callerStall
 
     # -------------------------------------------------------------------------
-    # _computeDivisor
+    # _computeBlocksInParallel
+    #
+    # This yields (window, result, layers) for each window, in order,
+    # computing them in a pool of numWorkers processes.  Each worker opens the
+    # image itself.
     # -------------------------------------------------------------------------
-    def _computeDivisor(self, bandCoefValueDict):
+    def _computeBlocksInParallel(self, blocks, model, bands):
+
+        workerArgs = (model,
+                      bands,
+                      self.cubeFile.fileName(),
+                      self.outDir,
+                      self.maxBlockBytes,
+                      self.tracePixels,
+                      self.precision,
+                      self.mask,
+                      self.area,
+                      self._layers,
+                      self._layerMode)
+
+        pool = multiprocessing.Pool(self.numWorkers,
+                                    _initTileWorker,
+                                    workerArgs)
 
-        tally = 0.0
+        try:
 
-        for band in bandCoefValueDict.iterkeys():
-            if band >= 5 and band <= 105:
-                tally += bandCoefValueDict[band][1]**2
+            for window, result, layers, traces in \
+                    pool.imap(_computeTile, blocks):
 
-        return math.sqrt(tally)
+                if traces:
+                    self.traces.update(traces)
+
+                yield window, result, layers
+
+            pool.close()
+
+        finally:
+
+            pool.terminate()
+            pool.join()
+
+    # -------------------------------------------------------------------------
+    # _createOutputs
+    #
+    # This returns the datasets for the output paths, one for every
+    # algorithm or one for all of them, and, for each algorithm, its band.
+    # When only an area of interest is computed, uncropped outputs start as
+    # NO_DATA_VALUE.
+    # -------------------------------------------------------------------------
+    def _createOutputs(self, outPaths, algorithmNames):
+
+        dataset = self.imageFile._getDataset()
+        bandsPerFile = len(algorithmNames) // len(outPaths)
+        xOff, yOff, xSize, ySize = self._outputWindow()
+        xform = list(dataset.GetGeoTransform())
+        xform[0], xform[3] = gdal.ApplyGeoTransform(xform, xOff, yOff)
+        outDss = []
+        outBands = []
+
+        for outPath in outPaths:
+
+            outDs = self.outputOptions.create(outPath,
+                                              xSize,
+                                              ySize,
+                                              bandsPerFile,
+                                              gdalconst.GDT_Float32)
+
+            outDs.SetProjection(dataset.GetProjection())
+            outDs.SetGeoTransform(xform)
+            outDss.append(outDs)
+
+            for bandNum in range(1, bandsPerFile + 1):
+
+                outBand = outDs.GetRasterBand(bandNum)
+                outBand.SetNoDataValue(ApplyAlgorithm.NO_DATA_VALUE)
+
+                if self.area and not self.cropToArea:
+                    outBand.Fill(ApplyAlgorithm.NO_DATA_VALUE)
+
+                outBands.append(outBand)
+
+        for outBand, algorithmName in zip(outBands, algorithmNames):
+            outBand.SetDescription(algorithmName)
+
+        return outDss, outBands
 
     # -------------------------------------------------------------------------
     # debug
+    #
+    # This traces one pixel.  See trace().
     # -------------------------------------------------------------------------
     def debug(self, row, col):
 
-        if row < 0 or row >= self.imageFile._getDataset().RasterYSize:
-            raise RuntimeError('Debug row value is not within the image.')
+        self.trace([(row, col)])
+
+    # -------------------------------------------------------------------------
+    # _fillEmptyBlocks
+    #
+    # This yields (window, result, layers) for each block, in order, taking
+    # results from the computed results, except for empty blocks, whose
+    # results are NO_DATA_VALUE and whose pixels are all no-data.
+    # -------------------------------------------------------------------------
+    def _fillEmptyBlocks(self, blocks, empty, results, numOutputs):
+
+        for window in blocks:
+
+            if window in empty:
+
+                result = self.kernel.buffer('empty',
+                                            (numOutputs, window[3], window[2]),
+                                            numpy.float32)
+
+                result.fill(ApplyAlgorithm.NO_DATA_VALUE)
+                layers = None
+
+                if self._layerMode == ApplyAlgorithm.BUILD_LAYERS:
 
-        if col < 0 or col >= self.imageFile._getDataset().RasterXSize:
-            raise RuntimeError('Debug column value is not within the image.')
+                    shape = (window[3], window[2])
 
-        self.debugRow = row
-        self.debugCol = col
-        self.debugDict = {}
+                    layers = (numpy.ones(shape, numpy.bool_),
+                              numpy.zeros(shape, numpy.bool_),
+                              numpy.zeros(shape, self.precision)
+                              if isinstance(self.model, CoefficientModel)
+                              else None)
+
+                yield window, result, layers
+
+            else:
+
+                yield next(results)
+
+    # -------------------------------------------------------------------------
+    # interleave
+    #
+    # This returns the interleave, bsq, bil or bip, of the file band stacks
+    # are read from.  For formats other than ENVI, it comes from GDAL.
+    # -------------------------------------------------------------------------
+    def interleave(self):
+
+        if isinstance(self.cubeFile, EnviImageFile):
+            return self.cubeFile.interleave()
+
+        gdalInterleave = self.cubeFile._getDataset(). \
+            GetMetadataItem('INTERLEAVE', 'IMAGE_STRUCTURE')
+
+        return ApplyAlgorithm.GDAL_INTERLEAVES.get(gdalInterleave, 'bsq')
 
     # -------------------------------------------------------------------------
-    # _pixelStackToCsv
+    # _journal
+    #
+    # This returns the journal for a run writing outPaths in the given blocks,
+    # or None when checkpoints are off.  A journal is valid only for the same
+    # image, model, precision, output options and blocks, and only while the
+    # files being written exist.
     # -------------------------------------------------------------------------
-    def _pixelStackToCsv(self, key, pixelStack):
+    def _journal(self, outPaths, model, blocks):
+
+        if self.checkpointSeconds is None:
+            return None
+
+        imagePath = os.path.abspath(self.imageFile.fileName())
+
+        header = {'image': imagePath,
+                  'image bytes': os.path.getsize(imagePath),
+                  'image mtime': os.path.getmtime(imagePath),
+                  'model': model.fingerprint(),
+                  'precision': self.precision,
+                  'mask': self.mask.fingerprint() if self.mask else None,
+                  'area': self.area.fingerprint() if self.area else None,
+                  'crop': self.cropToArea,
+                  'outputs': outPaths,
+                  'creation options': self.outputOptions.creationOptions(),
+                  'cog': self.outputOptions.cog,
+                  'blocks': blocks}
 
-        band = -1
+        journal = TileJournal(outPaths[0] + TileJournal.EXTENSION, header)
 
-        for pixel in pixelStack:
+        for outPath in outPaths:
 
-            band += 1
-            self.debugWriter.writerow({'Band': band, key: pixel})
+            if not os.path.exists(self.outputOptions.workingPath(outPath)):
 
-        return writer
+                journal.remove()
+                break
+
+        return journal
 
     # -------------------------------------------------------------------------
-    # _readStack
+    # _maskReason
+    #
+    # This returns why the pixel at (row, col) of a block evaluated by
+    # AlgorithmKernel.evaluate has no result, or '' when it has one.
     # -------------------------------------------------------------------------
-    def _readStack(self, col, row):
+    @staticmethod
+    def _maskReason(noData, masked, divisor, row, col):
+
+        if noData[row, col]:
+            return ApplyAlgorithm.NO_DATA_REASON
+
+        if masked[row, col]:
+            return ApplyAlgorithm.MASK_REASON
 
-        numpyPixels = self.imageFile._getDataset().ReadAsArray(col, row, 1, 1)
-        pixelsAsFloats = [p[0][0] for p in numpyPixels]
+        if divisor is not None and divisor[row, col] <= 0:
+            return ApplyAlgorithm.ZERO_DIVISOR_REASON
 
-        return pixelsAsFloats
+        return ''
 
     # -------------------------------------------------------------------------
-    # _writeDebugDict
+    # _openOutputs
+    #
+    # This reopens the outputs of an interrupted run for update, returning
+    # their datasets and, for each algorithm, its band.
     # -------------------------------------------------------------------------
-    def _writeDebugDict(self):
+    def _openOutputs(self, outPaths):
+
+        outDss = []
+        outBands = []
+
+        for outPath in outPaths:
 
-        fieldNames = ['Band', 'Value']
+            outDs = gdal.Open(self.outputOptions.workingPath(outPath),
+                              gdalconst.GA_Update)
 
-        outFile = \
-            os.path.join(self.outDir,
-                         os.path.basename(self.imageFile.fileName()) + '.csv')
+            if not outDs:
+                raise RuntimeError('Unable to reopen ' + outPath + '.')
+
+            outDss.append(outDs)
+
+            for bandNum in range(1, outDs.RasterCount + 1):
+                outBands.append(outDs.GetRasterBand(bandNum))
+
+        return outDss, outBands
+
+    # -------------------------------------------------------------------------
+    # outputNames
+    #
+    # This returns the base names of the files applyAlgorithms() writes.  The
+    # multi-band output of a GeoTIFF in the output directory would be the
+    # image itself, so applyAlgorithms() refuses to write it.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def outputNames(avirisImage, algorithmNames, separateFiles):
+
+        if separateFiles:
+            return [name + '.tif' for name in algorithmNames]
+
+        baseName = os.path.basename(avirisImage)
+        return [os.path.splitext(baseName)[0] + '.tif']
+
+    # -------------------------------------------------------------------------
+    # _outputWindow
+    #
+    # This returns the window of the image the outputs cover, as (xOff, yOff,
+    # xSize, ySize).
+    # -------------------------------------------------------------------------
+    def _outputWindow(self):
+
+        if self.area and self.cropToArea:
+            return self.area.window()
+
+        dataset = self.imageFile._getDataset()
+        return 0, 0, dataset.RasterXSize, dataset.RasterYSize
+
+    # -------------------------------------------------------------------------
+    # queryPoints
+    #
+    # This evaluates algorithms at specific pixels, given as (row, col), or
+    # map coordinates in the image's SRS, given as (x, y), reading only the
+    # windows around them.  Points are grouped by QUERY_TILE_SIZE tiles, and
+    # each group's bounding window is read once.  The default,
+    # algorithmNames=None, is every algorithm in the model.
+    #
+    # This returns one dictionary per point, in order, keyed by POINT_FIELDS
+    # and the algorithm names.  The mask reason is empty for valid results.
+    # -------------------------------------------------------------------------
+    def queryPoints(self, points, algorithmNames=None, mapCoordinates=False):
+
+        if algorithmNames is None:
+            algorithmNames = self.model.algorithmNames()
+
+        model, bands = self._reducedModel(algorithmNames)
+        dataset = self.imageFile._getDataset()
+        xform = dataset.GetGeoTransform()
+        invXform = gdal.InvGeoTransform(xform)
+        table = []
+        groups = {}
+
+        # Locate the points and group them by tile.
+        for i in range(len(points)):
+
+            if mapCoordinates:
+
+                x, y = points[i]
+                col, row = gdal.ApplyGeoTransform(invXform, x, y)
+                row = int(numpy.floor(row))
+                col = int(numpy.floor(col))
+
+            else:
+
+                row, col = int(points[i][0]), int(points[i][1])
+
+                x, y = gdal.ApplyGeoTransform(xform, col + 0.5, row + 0.5)
+
+            entry = {'row': row,
+                     'col': col,
+                     'x': x,
+                     'y': y,
+                     'Mask reason': ApplyAlgorithm.OUTSIDE_REASON,
+                     'Divisor': None}
+
+            for name in algorithmNames:
+                entry[name] = None
+
+            table.append(entry)
+
+            if row >= 0 and row < dataset.RasterYSize and \
+               col >= 0 and col < dataset.RasterXSize:
+
+                tile = (row // ApplyAlgorithm.QUERY_TILE_SIZE,
+                        col // ApplyAlgorithm.QUERY_TILE_SIZE)
+
+                groups.setdefault(tile, []).append(entry)
+
+        # Read and evaluate each group's window.
+        for tile in sorted(groups):
+
+            entries = groups[tile]
+            yOff = min(e['row'] for e in entries)
+            xOff = min(e['col'] for e in entries)
+            ySize = max(e['row'] for e in entries) - yOff + 1
+            xSize = max(e['col'] for e in entries) - xOff + 1
+            stack = self._readBlock(xOff, yOff, xSize, ySize, bands)
+
+            result, noData, masked, divisor = \
+                self.kernel.evaluate(stack, model, bands)
+
+            for entry in entries:
+
+                r = entry['row'] - yOff
+                c = entry['col'] - xOff
+
+                if divisor is not None:
+                    entry['Divisor'] = float(divisor[r, c])
+
+                entry['Mask reason'] = \
+                    ApplyAlgorithm._maskReason(noData, masked, divisor, r, c)
+
+                for i in range(len(algorithmNames)):
+                    entry[algorithmNames[i]] = float(result[i, r, c])
+
+        return table
+
+    # -------------------------------------------------------------------------
+    # _readBlock
+    #
+    # This returns the stack of the sorted, 1-based bands for a window,
+    # shaped (bands, rows, cols), as float32.  It is read into a buffer
+    # reused from block to block, unless blocks are prefetched, when each
+    # needs its own.
+    # -------------------------------------------------------------------------
+    def _readBlock(self, xOff, yOff, xSize, ySize, bands):
+
+        shape = (len(bands), ySize, xSize)
+
+        if self.prefetchDepth:
+            stack = numpy.empty(shape, numpy.float32)
+
+        else:
+            stack = self.kernel.buffer('stack', shape, numpy.float32)
+
+        return self.cubeFile.readWindow(xOff, yOff, xSize, ySize, bands - 1,
+                                        stack)
+
+    # -------------------------------------------------------------------------
+    # _readBlocks
+    #
+    # This yields (window, stack) for each window, in order.
+    # -------------------------------------------------------------------------
+    def _readBlocks(self, blocks, bands):
+
+        for xOff, yOff, xSize, ySize in blocks:
+
+            yield (xOff, yOff, xSize, ySize), \
+                self._readBlock(xOff, yOff, xSize, ySize, bands)
+
+    # -------------------------------------------------------------------------
+    # _reducedModel
+    #
+    # This reduces the model to the algorithms and the bands affecting them,
+    # so only those bands are read, and returns it with the sorted, 1-based
+    # bands to read.  See AlgorithmKernel.reduced.  This ensures the image has
+    # them.  With layers, the scene layers stand in for the bands only they
+    # need.
+    # -------------------------------------------------------------------------
+    def _reducedModel(self, algorithmNames, layers=False):
+
+        model, bands = self.kernel.reduced(algorithmNames, bool(layers))
+
+        if len(bands) and bands[-1] > self.imageFile._getDataset().RasterCount:
+
+            raise RuntimeError('The model requires band ' +
+                               str(bands[-1]) +
+                               ', which is not in ' +
+                               self.imageFile.fileName())
+
+        return model, bands
+
+    # -------------------------------------------------------------------------
+    # _reportIo
+    #
+    # This records and logs the I/O saved by reading numBands bands, instead
+    # of every band, of only the area of interest's window, if any.
+    # -------------------------------------------------------------------------
+    def _reportIo(self, numBands):
+
+        dataset = self.imageFile._getDataset()
+        pixels = dataset.RasterXSize * dataset.RasterYSize
+        pixelsRead = pixels
+
+        if self.area:
+
+            xSize, ySize = self.area.window()[2:]
+            pixelsRead = xSize * ySize
+
+        pixelsRead -= self.report.get('Pixels skipped', 0)
+
+        bytesPerSample = \
+            gdal.GetDataTypeSize(dataset.GetRasterBand(1).DataType) // 8
+
+        self.report['Bands read'] = numBands
+        self.report['Bands in image'] = dataset.RasterCount
+        self.report['Bytes read'] = pixelsRead * numBands * bytesPerSample
+
+        self.report['Bytes saved'] = \
+            pixels * dataset.RasterCount * bytesPerSample - \
+            self.report['Bytes read']
+
+        if self.logger:
+
+            self.logger.info('Read ' +
+                             str(numBands) +
+                             ' of ' +
+                             str(dataset.RasterCount) +
+                             ' bands, saving ' +
+                             str(self.report['Bytes saved']) +
+                             ' bytes of I/O.')
+
+    # -------------------------------------------------------------------------
+    # _reportMemory
+    #
+    # This records and logs the peak resident set size of this process and,
+    # after a parallel run, of the largest worker it has had.  These are
+    # peaks over the life of the process, including earlier runs in it, like
+    # the other scenes of an AvirisBatch, so a run's own peak is measured
+    # only in a process of its own, as AvirisBenchmark runs each case.
+    # -------------------------------------------------------------------------
+    def _reportMemory(self):
+
+        # ru_maxrss is in kilobytes, except on macOS.
+        scale = 1 if sys.platform == 'darwin' else 1024
+
+        self.report['Process peak RSS bytes'] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+        if self.numWorkers > 1:
+
+            self.report['Process peak worker RSS bytes'] = \
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+        if self.logger:
+
+            self.logger.info('Process peak RSS: ' +
+                             str(self.report['Process peak RSS bytes']) +
+                             ' bytes')
+
+    # -------------------------------------------------------------------------
+    # samplePixels
+    #
+    # This evaluates algorithms at arrays of pixels, like the nearest pixels
+    # of another grid's cells, returning the results shaped (algorithms,
+    # pixels).  Pixels outside the image, and those without a valid result,
+    # are NO_DATA_VALUE.  The bounding window of the pixels is read in
+    # full-width row strips within maxBlockBytes, skipping strips without
+    # any of the pixels.  The default, algorithmNames=None, is every
+    # algorithm in the model.
+    # -------------------------------------------------------------------------
+    def samplePixels(self, rows, cols, algorithmNames=None):
+
+        if algorithmNames is None:
+            algorithmNames = self.model.algorithmNames()
+
+        model, bands = self._reducedModel(algorithmNames)
+        dataset = self.imageFile._getDataset()
+        rows = numpy.asarray(rows, numpy.int64)
+        cols = numpy.asarray(cols, numpy.int64)
+
+        values = numpy.full((len(algorithmNames), len(rows)),
+                            ApplyAlgorithm.NO_DATA_VALUE,
+                            numpy.float32)
+
+        inside = (rows >= 0) & (rows < dataset.RasterYSize) & \
+            (cols >= 0) & (cols < dataset.RasterXSize)
+
+        if not inside.any():
+            return values
+
+        xOff = int(cols[inside].min())
+        xSize = int(cols[inside].max()) - xOff + 1
+        yStart = int(rows[inside].min())
+        yEnd = int(rows[inside].max()) + 1
+
+        numBands = len(bands) if self.interleave() == 'bsq' \
+            else dataset.RasterCount
+
+        bytesPerRow = \
+            xSize * (numBands + len(algorithmNames)) * self.bytesPerSample()
+
+        rowsPerBlock = max(1, self.maxBlockBytes // bytesPerRow)
+
+        for yOff in range(yStart, yEnd, rowsPerBlock):
+
+            ySize = min(rowsPerBlock, yEnd - yOff)
+            select = inside & (rows >= yOff) & (rows < yOff + ySize)
+
+            if not select.any():
+                continue
+
+            stack = self._readBlock(xOff, yOff, xSize, ySize, bands)
+            result = self.kernel.evaluate(stack, model, bands)[0]
+
+            values[:, select] = \
+                result[:, rows[select] - yOff, cols[select] - xOff]
+
+        return values
+
+    # -------------------------------------------------------------------------
+    # _sceneLayers
+    #
+    # This returns the SceneLayers of the image, the mask and, for a
+    # coefficient model, the divisor bands, in layerDir.
+    # -------------------------------------------------------------------------
+    def _sceneLayers(self):
+
+        divisorBands = None
+
+        if isinstance(self.model, CoefficientModel):
+
+            divisorBands = \
+                self.model.bandIndices()[self.model.divisorMask()]
+
+        return SceneLayers(self.layerDir,
+                           self.imageFile,
+                           self.mask.fingerprint() if self.mask else None,
+                           divisorBands,
+                           self.precision)
+
+    # -------------------------------------------------------------------------
+    # trace
+    #
+    # This traces pixels, given as (row, col), through the following runs of
+    # applyAlgorithms().  As each block is evaluated, the intermediates of the
+    # traced pixels in it are picked out of the block's arrays, so tracing
+    # costs little more than a run.  Layers are not used while tracing.
+    #
+    # Each pixel's trace, in traces by (row, col), has its raw stack, by band
+    # read, why it has no result, which is empty when it has one, and its
+    # results, by algorithm.  For a coefficient model, it also has the
+    # divisor, the values of the model's bands normalized by it and, for each
+    # algorithm, each band's contribution to the result, with the intercept as
+    # band 0.  The traces are written to <image>_traces.json in outDir.
+    # Pixels in blocks that are not computed, outside the area of interest's
+    # window or without valid pixels, have no trace.
+    # -------------------------------------------------------------------------
+    def trace(self, pixels):
+
+        dataset = self.imageFile._getDataset()
+
+        for row, col in pixels:
+
+            if row < 0 or row >= dataset.RasterYSize:
+
+                raise RuntimeError('Trace row ' +
+                                   str(row) +
+                                   ' is not within the image.')
+
+            if col < 0 or col >= dataset.RasterXSize:
+
+                raise RuntimeError('Trace column ' +
+                                   str(col) +
+                                   ' is not within the image.')
+
+        self.tracePixels = numpy.array(sorted(set((int(row), int(col))
+                                                  for row, col in pixels)),
+                                       numpy.int64).reshape(-1, 2)
+
+        self.traces = {}
+
+    # -------------------------------------------------------------------------
+    # _traceBlock
+    #
+    # This records the traces of the traced pixels in a block, from the
+    # arrays of its evaluation.  Outside, from _clipBlock, is the block's
+    # pixels outside the area of interest, or None.
+    # -------------------------------------------------------------------------
+    def _traceBlock(self, stack, model, bands, noData, masked, divisor,
+                    result, outside, xOff, yOff):
+
+        if self.tracePixels is None:
+            return
+
+        rows = self.tracePixels[:, 0] - yOff
+        cols = self.tracePixels[:, 1] - xOff
+
+        inBlock = (rows >= 0) & (rows < stack.shape[1]) & \
+            (cols >= 0) & (cols < stack.shape[2])
+
+        if not inBlock.any():
+            return
+
+        rows = rows[inBlock]
+        cols = cols[inBlock]
+        values = stack[:, rows, cols]
+        algorithmNames = model.algorithmNames()
+
+        if divisor is not None:
+
+            computeType = numpy.dtype(self.precision)
+            modelBands = model.bandIndices()
+            divisors = divisor[rows, cols].astype(computeType)
+
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+
+                normalized = \
+                    values[numpy.searchsorted(bands, modelBands)]. \
+                    astype(computeType) / divisors
+
+            # Shaped (algorithms, bands, pixels)
+            contributions = \
+                model.coefficientMatrix(algorithmNames).T. \
+                astype(computeType)[:, :, None] * normalized
+
+            intercepts = model.intercepts(algorithmNames)
+
+        for i in range(len(rows)):
+
+            row, col = rows[i], cols[i]
+
+            trace = {'row': int(row + yOff),
+                     'col': int(col + xOff),
+                     'Mask reason': ApplyAlgorithm._maskReason(noData,
+                                                               masked,
+                                                               divisor,
+                                                               row,
+                                                               col),
+                     'Stack': dict(zip(bands.tolist(),
+                                       values[:, i].tolist())),
+                     'Results': dict(zip(algorithmNames,
+                                         result[:, row, col].tolist()))}
+
+            if outside is not None and outside[row, col]:
+                trace['Mask reason'] = ApplyAlgorithm.OUTSIDE_AREA_REASON
+
+            if divisor is not None:
+
+                trace['Divisor'] = float(divisors[i])
+
+                trace['Normalized'] = dict(zip(modelBands.tolist(),
+                                               normalized[:, i].tolist()))
+
+                trace['Contributions'] = {}
+
+                for j in range(len(algorithmNames)):
+
+                    bandContributions = \
+                        dict(zip(modelBands.tolist(),
+                                 contributions[j, :, i].tolist()))
+
+                    bandContributions[0] = float(intercepts[j])
+
+                    trace['Contributions'][algorithmNames[j]] = \
+                        bandContributions
+
+            self.traces[(trace['row'], trace['col'])] = trace
+
+    # -------------------------------------------------------------------------
+    # _validityIndex
+    #
+    # This returns the image's ValidityIndex, reading it from the output
+    # directory or building it there.
+    # -------------------------------------------------------------------------
+    def _validityIndex(self):
+
+        baseName = os.path.basename(self.imageFile.fileName())
+
+        path = os.path.join(self.outDir,
+                            os.path.splitext(baseName)[0] +
+                            ValidityIndex.EXTENSION)
+
+        index = ValidityIndex.read(path, self.imageFile)
+
+        if not index:
+
+            if self.logger:
+                self.logger.info('Building validity index ' + path)
+
+            index = ValidityIndex.build(self.cubeFile,
+                                        CoefficientModel.NO_DATA_BAND,
+                                        ApplyAlgorithm.NO_DATA_VALUE)
+
+            index.write(path)
+
+        return index
+
+    # -------------------------------------------------------------------------
+    # _writeBlock
+    #
+    # This writes the result of the index'th block to the outputs, adds it to
+    # their statistics, writes its scene layers and, every checkpointSeconds
+    # and after the last block, records it in the journal.
+    # -------------------------------------------------------------------------
+    def _writeBlock(self, index, window, result, layers, outDss, outBands,
+                    statistics, journal, numBlocks):
+
+        xOff, yOff = window[:2]
+        outXOff, outYOff = self._outputWindow()[:2]
+
+        for i in range(len(outBands)):
+
+            outBands[i].WriteArray(result[i], xOff - outXOff, yOff - outYOff)
+            statistics[i].add(result[i], ApplyAlgorithm.NO_DATA_VALUE)
+
+        if layers:
+            self._layers.write(xOff, yOff, *layers)
+
+        if journal and \
+           (time.time() - self._lastCheckpoint >= self.checkpointSeconds or
+                index == numBlocks - 1):
+
+            for i in range(len(outDss)):
+                outDss[i].FlushCache()
+
+            journal.record(index)
+            self._lastCheckpoint = time.time()
+
+    # -------------------------------------------------------------------------
+    # _writeBlocksInThread
+    #
+    # This writes the results with _writeBlock, given the outputs after its
+    # block arguments, in a writer thread, while the next blocks are
+    # computed, with up to prefetchDepth results waiting.  Results are in
+    # buffers reused from block to block, so each is copied for the writer.
+    # -------------------------------------------------------------------------
+    def _writeBlocksInThread(self, results, firstBlock, *outputs):
+
+        writer = PipelineStage(self.prefetchDepth)
+        writer.write(self._writeBlock, *outputs)
+
+        try:
+
+            for index, (window, result, layers) in \
+                    enumerate(results, firstBlock):
+
+                if layers:
+                    layers = tuple(layer.copy() for layer in layers)
+
+                writer.put(index, window, result.copy(), layers)
+
+            writer.finish()
+
+        finally:
+            writer.stop()
+
+        self.report['Write stall seconds'] = writer.threadStall
+
+        self.report['Compute stall seconds'] = \
+            self.report.get('Compute stall seconds', 0.0) + \
+            writer.callerStall
+
+        if self.logger:
+
+            self.logger.info('Stall seconds:  read ' +
+                             str(self.report.get('Read stall seconds')) +
+                             ', compute ' +
+                             str(self.report['Compute stall seconds']) +
+                             ', write ' +
+                             str(self.report['Write stall seconds']))
+
+    # -------------------------------------------------------------------------
+    # _writeStatistics
+    #
+    # This writes each output's statistics, by algorithm, beside it, as
+    # <output>_stats.json, and records their paths.
+    # -------------------------------------------------------------------------
+    def _writeStatistics(self, outPaths, algorithmNames, statistics):
+
+        bandsPerFile = len(algorithmNames) // len(outPaths)
+        self.report['Statistics files'] = []
+
+        for i in range(len(outPaths)):
+
+            first = i * bandsPerFile
+
+            path = os.path.splitext(outPaths[i])[0] + \
+                OutputStatistics.EXTENSION
+
+            OutputStatistics.write(
+                path,
+                dict(zip(algorithmNames[first:first + bandsPerFile],
+                         statistics[first:first + bandsPerFile])))
+
+            self.report['Statistics files'].append(path)
+
+    # -------------------------------------------------------------------------
+    # _writeTraces
+    #
+    # This writes the traces, in order of row and column, to
+    # <image>_traces.json in outDir, and records its path.
+    # -------------------------------------------------------------------------
+    def _writeTraces(self):
+
+        outFile = os.path.join(self.outDir,
+                               os.path.basename(self.imageFile.fileName()) +
+                               '_traces.json')
 
         with open(outFile, 'w') as f:
 
-            writer = csv.writer(f)
+            json.dump([self.traces[pixel] for pixel in sorted(self.traces)],
+                      f,
+                      indent=2,
+                      sort_keys=True)
+
+        self.report['Trace file'] = outFile
+
+
+# -----------------------------------------------------------------------------
+# _initTileWorker
+#
+# This prepares a pool process to compute tiles for
+# ApplyAlgorithm._computeBlocksInParallel.  Pool functions must be defined at
+# module level to be pickled.
+# -----------------------------------------------------------------------------
+_tileWorker = {}
+
+
+def _initTileWorker(model, bands, imagePath, outDir, maxBlockBytes,
+                    tracePixels, precision, mask, area, layers, layerMode):
+
+    aa = ApplyAlgorithm(model,
+                        imagePath,
+                        outDir,
+                        None,
+                        maxBlockBytes,
+                        precision=precision,
+                        mask=mask)
+
+    if tracePixels is not None:
+        aa.trace(tracePixels)
+
+    aa.area = area
+    aa._layers = layers
+    aa._layerMode = layerMode
+    _tileWorker['aa'] = aa
+    _tileWorker['model'] = model
+    _tileWorker['bands'] = bands
+
+
+# -----------------------------------------------------------------------------
+# _computeTile
+#
+# This returns (window, result, layers, traces) for one window, with the
+# traces of its pixels only.
+# -----------------------------------------------------------------------------
+def _computeTile(window):
+
+    aa = _tileWorker['aa']
+
+    if aa.traces:
+        aa.traces.clear()
+
+    window, result, layers = next(aa._computeBlocks([window],
+                                                    _tileWorker['model'],
+                                                    _tileWorker['bands']))
 
-            for bandKey in self.debugDict:
-                writer.writerow([bandKey, self.debugDict[bandKey]])
+    return window, result, layers, aa.traces
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import numpy
+
+from celery import group
+
+from model.CeleryConfiguration import app
+
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+
+
+# -----------------------------------------------------------------------------
+# class ApplyAlgorithmCelery
+#
+# This distributes ApplyAlgorithm's blocks across cluster nodes as Celery
+# tasks of CeleryConfiguration.app.  Each computeTile task opens the scene
+# itself, computes one window and writes it to a directory of the run's own
+# in scratchDir, which every node must share, so runs of the same scene, or
+# of scenes with the same name, do not share tiles.  The coordinator,
+# applyAlgorithms(), assembles the tiles into the outputs, in order, as
+# ApplyAlgorithm writes its own blocks, so checkpoints, skipEmpty and the
+# output options work the same way.
+#
+# Each tile's window, host and seconds are recorded in report['Tiles'].
+# Scene layers and traces are not distributed.
+#
+# aa = ApplyAlgorithmCelery(CoefficientModel.read(coefFile, True),
+#                           image,
+#                           outDir,
+#                           '/att/nobackup/rlgill/scratch')
+# aa.applyAlgorithms(['Avg Chl'])
+# -----------------------------------------------------------------------------
+class ApplyAlgorithmCelery(ApplyAlgorithm):
+
+    TILE_EXTENSION = '.npy'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # See ApplyAlgorithm.__init__.
+    # -------------------------------------------------------------------------
+    def __init__(self,
+                 coefFile,
+                 avirisImage,
+                 outDir,
+                 scratchDir,
+                 logger=None,
+                 maxBlockBytes=ApplyAlgorithm.DEFAULT_MAX_BLOCK_BYTES,
+                 tileSize=None,
+                 outputOptions=None,
+                 cacheInterleave=None,
+                 precision='float64',
+                 checkpointSeconds=ApplyAlgorithm.DEFAULT_CHECKPOINT_SECONDS,
+                 mask=None,
+                 skipEmpty=False):
+
+        if not scratchDir or not os.path.isdir(scratchDir):
+
+            raise RuntimeError(str(scratchDir) +
+                               ' is not an existing directory.')
+
+        # Initialize the base class.
+        super(ApplyAlgorithmCelery, self).__init__(
+            coefFile,
+            avirisImage,
+            outDir,
+            logger,
+            maxBlockBytes,
+            tileSize=tileSize,
+            outputOptions=outputOptions,
+            cacheInterleave=cacheInterleave,
+            precision=precision,
+            checkpointSeconds=checkpointSeconds,
+            mask=mask,
+            skipEmpty=skipEmpty)
+
+        self.scratchDir = scratchDir
+
+    # -------------------------------------------------------------------------
+    # _computeBlocks
+    #
+    # This yields (window, result, layers) for each window, in order, from
+    # computeTile tasks, removing each tile once it is read.  When a task
+    # fails, or the run stops early, the tasks not yet finished are revoked,
+    # terminating those running, and the run's directory is removed with the
+    # tiles not yet read.  A task writing a tile after that fails, as its
+    # directory is gone.
+    # -------------------------------------------------------------------------
+    def _computeBlocks(self, blocks, model, bands):
+
+        self.report['Tiles'] = []
+
+        if not blocks:
+            return
+
+        runDir = tempfile.mkdtemp(dir=self.scratchDir)
+
+        tasks = group(ApplyAlgorithmCelery.computeTile.s(
+            self.cubeFile.fileName(),
+            window,
+            model,
+            bands,
+            runDir,
+            self.precision,
+            self.mask,
+            self.area) for window in blocks)
+
+        results = tasks.apply_async()
+        numRead = 0
+
+        try:
+
+            for asyncResult in results.results:
+
+                tile = asyncResult.get()
+                result = numpy.load(tile['path'])
+                os.remove(tile['path'])
+                numRead += 1
+
+                self.report['Tiles'].append({'window': tile['window'],
+                                             'host': tile['host'],
+                                             'seconds': tile['seconds']})
+
+                if self.logger:
+
+                    self.logger.info('Tile ' +
+                                     str(tile['window']) +
+                                     ' computed on ' +
+                                     tile['host'] +
+                                     ' in ' +
+                                     str(tile['seconds']) +
+                                     ' seconds')
+
+                yield tuple(tile['window']), result, None
+
+        finally:
+
+            if numRead < len(results.results):
+                results.revoke(terminate=True)
+
+            shutil.rmtree(runDir, ignore_errors=True)
+
+    # -------------------------------------------------------------------------
+    # computeTile
+    #
+    # This computes one window of the image, given as (xOff, yOff, xSize,
+    # ySize), with the reduced model and its bands, as from
+    # ApplyAlgorithm._reducedModel.  The result, shaped (algorithms, ySize,
+    # xSize), is written to scratchDir, and this returns its window and path,
+    # the host and the seconds taken.  The tile is renamed into place once
+    # written, so a failed task leaves none.
+    #
+    # Celery tasks' arguments are serialized with Pickle, so the model, mask
+    # and area are sent whole.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    @app.task(serializer='pickle')
+    def computeTile(imagePath, window, model, bands, scratchDir, precision,
+                    mask, area):
+
+        startTime = time.time()
+
+        aa = ApplyAlgorithm(model,
+                            imagePath,
+                            scratchDir,
+                            None,
+                            precision=precision,
+                            mask=mask,
+                            checkpointSeconds=None)
+
+        aa.area = area
+        window = tuple(window)
+        result = next(aa._computeBlocks([window], model, bands))[1]
+
+        baseName = os.path.splitext(os.path.basename(imagePath))[0]
+
+        tilePath = os.path.join(scratchDir,
+                                baseName +
+                                '_' +
+                                '_'.join(str(i) for i in window) +
+                                ApplyAlgorithmCelery.TILE_EXTENSION)
+
+        tempPath = tilePath + '.tmp'
+
+        with open(tempPath, 'wb') as f:
+            numpy.save(f, result)
+
+        os.rename(tempPath, tilePath)
+
+        return {'window': window,
+                'path': tilePath,
+                'host': socket.gethostname(),
+                'seconds': time.time() - startTime}
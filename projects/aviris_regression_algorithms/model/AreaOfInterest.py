@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+import numpy
+
+from osgeo import gdal
+from osgeo import osr
+
+from model.Envelope import Envelope
+
+
+# -----------------------------------------------------------------------------
+# class AreaOfInterest
+#
+# This is an Envelope or polygon, in any SRS, located on an image.  Its rings
+# are reprojected to the image's SRS and mapped through the inverse of the
+# image's geotransform, so they are in pixel coordinates, (col, row), whatever
+# the pixel size or rotation.  window() is the part of the image they cover,
+# and outside() is, for any block, which pixels' centers they do not contain.
+#
+# Only arrays are kept, so an AreaOfInterest can be sent to worker processes.
+# -----------------------------------------------------------------------------
+class AreaOfInterest(object):
+
+    # Edges are followed with this many points each when reprojected, as a
+    # straight edge in one SRS can curve in another.
+    POINTS_PER_EDGE = 16
+
+    EPSILON = 1e-6
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # The geometry is an Envelope, or an OGR polygon or multipolygon.  Without
+    # a spatial reference, it is taken to be in the image's.
+    # -------------------------------------------------------------------------
+    def __init__(self, geometry, imageFile):
+
+        dataset = imageFile._getDataset()
+        invXform = gdal.InvGeoTransform(dataset.GetGeoTransform())
+        srs = geometry.GetSpatialReference()
+        transform = None
+
+        if srs and not srs.IsSame(imageFile.srs()):
+
+            transform = osr.CoordinateTransformation(
+                AreaOfInterest._traditionalOrder(srs),
+                AreaOfInterest._traditionalOrder(imageFile.srs()))
+
+        pointsPerEdge = AreaOfInterest.POINTS_PER_EDGE if transform else 1
+        self._rings = []
+
+        for ring in AreaOfInterest._mapRings(geometry):
+
+            pixels = []
+
+            for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+
+                for i in range(pointsPerEdge):
+
+                    t = float(i) / pointsPerEdge
+                    x = x0 + t * (x1 - x0)
+                    y = y0 + t * (y1 - y0)
+
+                    if transform:
+                        x, y = transform.TransformPoint(x, y)[:2]
+
+                    pixels.append(gdal.ApplyGeoTransform(invXform, x, y))
+
+            self._rings.append(numpy.array(pixels, dtype=numpy.float64))
+
+        # The window is every pixel the rings touch, within the image.  Pixel
+        # coordinates within EPSILON of an edge are taken to be on it.
+        allPixels = numpy.vstack(self._rings)
+
+        xMin, yMin = \
+            numpy.floor(allPixels.min(axis=0) + AreaOfInterest.EPSILON). \
+            astype(int)
+
+        xMax, yMax = \
+            numpy.ceil(allPixels.max(axis=0) - AreaOfInterest.EPSILON). \
+            astype(int)
+
+        xMin, xMax = max(xMin, 0), min(xMax, dataset.RasterXSize)
+        yMin, yMax = max(yMin, 0), min(yMax, dataset.RasterYSize)
+
+        if xMin >= xMax or yMin >= yMax:
+
+            raise RuntimeError('The area of interest does not intersect ' +
+                               imageFile.fileName())
+
+        self._window = (int(xMin),
+                        int(yMin),
+                        int(xMax - xMin),
+                        int(yMax - yMin))
+
+    # -------------------------------------------------------------------------
+    # fingerprint
+    # -------------------------------------------------------------------------
+    def fingerprint(self):
+
+        digest = hashlib.sha1(repr(self._window).encode('utf-8'))
+
+        for ring in self._rings:
+            digest.update(ring.tobytes())
+
+        return digest.hexdigest()
+
+    # -------------------------------------------------------------------------
+    # _mapRings
+    #
+    # This returns the geometry's rings as lists of (x, y), in its own SRS.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _mapRings(geometry):
+
+        if isinstance(geometry, Envelope):
+
+            return [[(geometry.ulx(), geometry.uly()),
+                     (geometry.lrx(), geometry.uly()),
+                     (geometry.lrx(), geometry.lry()),
+                     (geometry.ulx(), geometry.lry())]]
+
+        if geometry.GetGeometryCount():
+
+            rings = []
+
+            for i in range(geometry.GetGeometryCount()):
+                rings += AreaOfInterest._mapRings(geometry.GetGeometryRef(i))
+
+            return rings
+
+        if geometry.GetPointCount() < 3:
+
+            raise RuntimeError('The area of interest must be an Envelope ' +
+                               'or a polygon.')
+
+        return [[geometry.GetPoint(i)[:2]
+                 for i in range(geometry.GetPointCount())]]
+
+    # -------------------------------------------------------------------------
+    # outside
+    #
+    # This returns an array shaped (ySize, xSize) that is True for each pixel
+    # of the window whose center is outside the area.  The rows are scanned:
+    # a pixel is inside when an odd number of edges cross its row to its left,
+    # so holes and separate parts are handled.
+    # -------------------------------------------------------------------------
+    def outside(self, xOff, yOff, xSize, ySize):
+
+        rowCenters = (yOff + numpy.arange(ySize) + 0.5)[:, None]
+        colCenters = xOff + numpy.arange(xSize) + 0.5
+        crossings = []
+
+        for ring in self._rings:
+
+            x0, y0 = ring[:, 0], ring[:, 1]
+            x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+
+            # Each edge includes its lower end, so a vertex is crossed once.
+            crosses = (y0 <= rowCenters) != (y1 <= rowCenters)
+
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                x = x0 + (rowCenters - y0) * (x1 - x0) / (y1 - y0)
+
+            crossings.append(numpy.where(crosses, x, numpy.inf))
+
+        crossings = numpy.sort(numpy.hstack(crossings), axis=1)
+        outside = numpy.empty((ySize, xSize), numpy.bool_)
+
+        for row in range(ySize):
+
+            outside[row] = \
+                numpy.searchsorted(crossings[row], colCenters) % 2 == 0
+
+        return outside
+
+    # -------------------------------------------------------------------------
+    # _traditionalOrder
+    #
+    # GDAL 3 otherwise orders geographic coordinates latitude first.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _traditionalOrder(srs):
+
+        srs = srs.Clone()
+
+        if hasattr(srs, 'SetAxisMappingStrategy'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        return srs
+
+    # -------------------------------------------------------------------------
+    # window
+    #
+    # This returns the image window the area covers, as (xOff, yOff, xSize,
+    # ySize).
+    # -------------------------------------------------------------------------
+    def window(self):
+
+        return self._window
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from osgeo import ogr
+from osgeo import osr
+
+from model.EnviImageFile import EnviImageFile
+
+from projects.aviris_regression_algorithms.model.AlgorithmKernel \
+    import AlgorithmKernel
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.AreaOfInterest \
+    import AreaOfInterest
+from projects.aviris_regression_algorithms.model.TileJournal \
+    import TileJournal
+
+
+# -----------------------------------------------------------------------------
+# class AvirisBatch
+#
+# This applies a coefficient model to many AVIRIS scenes in one process,
+# paying interpreter, GDAL and coefficient startup once.  Scenes are
+# scheduled over a pool of numWorkers processes.  Each scene's outputs go to
+# a subdirectory of outDir named for the scene.  A scene is skipped when all
+# of its outputs are newer than its image and header and were made with the
+# same model, algorithms, mask, precision and area of interest, which are
+# recorded in SETTINGS_FILE in its subdirectory.  A scene interrupted part
+# way resumes from its last checkpoint.
+#
+# Given an area of interest, an Envelope or OGR polygon, each scene is
+# clipped to it, as by ApplyAlgorithm.clip(), and scenes it does not
+# intersect are skipped.
+#
+# batch = AvirisBatch(model, AvirisBatch.findImages('/data/*/*_img'), outDir)
+# batch.run()
+# print (batch.summary())
+# -----------------------------------------------------------------------------
+class AvirisBatch(object):
+
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    # The settings of a scene's outputs are kept in this, in its directory.
+    SETTINGS_FILE = 'batch_settings.json'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self,
+                 model,
+                 images,
+                 outDir,
+                 algorithmNames=None,
+                 separateFiles=False,
+                 numWorkers=1,
+                 maxBlockBytes=ApplyAlgorithm.DEFAULT_MAX_BLOCK_BYTES,
+                 logger=None,
+                 outputOptions=None,
+                 precision='float64',
+                 mask=None,
+                 skipEmpty=False,
+                 layerDir=None,
+                 prefetchDepth=0,
+                 area=None,
+                 cropToArea=True):
+
+        if not images:
+            raise RuntimeError('There are no images to process.')
+
+        if not os.path.isdir(outDir):
+            raise RuntimeError(str(outDir) + ' is not an existing directory.')
+
+        if numWorkers < 1:
+            raise RuntimeError('There must be at least one worker.')
+
+        self._model = model
+        self._images = list(images)
+        self._outDir = outDir
+        self._numWorkers = numWorkers
+        self._maxBlockBytes = maxBlockBytes
+        self._logger = logger
+        self._outputOptions = outputOptions
+        self._precision = precision
+        self._mask = mask
+        self._skipEmpty = skipEmpty
+        self._layerDir = layerDir
+        self._prefetchDepth = prefetchDepth
+        self._area = area
+        self._cropToArea = cropToArea
+
+        self._algorithmNames = algorithmNames or model.algorithmNames()
+        self._separateFiles = separateFiles
+        self._results = []
+
+    # -------------------------------------------------------------------------
+    # findImages
+    #
+    # This returns the images matching a glob pattern or, when given a file
+    # that is not itself an image, the images listed in it, one per line.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def findImages(globOrListFile):
+
+        if os.path.isfile(globOrListFile) and \
+           not EnviImageFile.isEnvi(globOrListFile):
+
+            with open(globOrListFile) as f:
+
+                return [line.strip() for line in f
+                        if line.strip() and not line.startswith('#')]
+
+        return sorted(glob.glob(globOrListFile))
+
+    # -------------------------------------------------------------------------
+    # isDone
+    #
+    # A scene is done when every output exists and is newer than the image
+    # and its header, and no run writing them was interrupted.  Given the
+    # settings of a run, from settings(), the outputs must also have been
+    # made with them.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def isDone(avirisImage, sceneDir, outNames, settings=None):
+
+        if settings is not None:
+
+            settingsPath = os.path.join(sceneDir, AvirisBatch.SETTINGS_FILE)
+
+            if not os.path.exists(settingsPath):
+                return False
+
+            with open(settingsPath) as f:
+
+                if json.load(f) != json.loads(json.dumps(settings)):
+                    return False
+
+        inputs = [avirisImage]
+        hdrFile = EnviImageFile.headerName(avirisImage)
+
+        if hdrFile:
+            inputs.append(hdrFile)
+
+        inputTime = max(os.path.getmtime(i) for i in inputs)
+
+        for outName in outNames:
+
+            outPath = os.path.join(sceneDir, outName)
+
+            if not os.path.exists(outPath) or \
+               os.path.exists(outPath + TileJournal.EXTENSION) or \
+               os.path.getmtime(outPath) < inputTime:
+
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    # results
+    #
+    # This returns a dictionary per scene, in the order of the images, with
+    # the scene's image, status, seconds, pixels, bytes read and error.
+    # -------------------------------------------------------------------------
+    def results(self):
+
+        return list(self._results)
+
+    # -------------------------------------------------------------------------
+    # run
+    # -------------------------------------------------------------------------
+    def run(self):
+
+        # OGR geometries cannot be pickled, so the area is sent to the
+        # scenes as its rings and the WKT of its SRS.
+        area = None
+
+        if self._area:
+
+            srs = self._area.GetSpatialReference()
+
+            area = (AreaOfInterest._mapRings(self._area),
+                    srs.ExportToWkt() if srs else None,
+                    self._cropToArea)
+
+        scenes = [(self._model,
+                   image,
+                   self.sceneDir(image),
+                   self._algorithmNames,
+                   self._separateFiles,
+                   self._maxBlockBytes,
+                   self._outputOptions,
+                   self._precision,
+                   self._mask,
+                   self._skipEmpty,
+                   self._layerDir,
+                   self._prefetchDepth,
+                   area) for image in self._images]
+
+        self._results = []
+
+        if self._numWorkers == 1:
+
+            for result in map(_processScene, scenes):
+                self._addResult(result)
+
+        else:
+
+            pool = multiprocessing.Pool(self._numWorkers)
+
+            try:
+
+                for result in pool.imap(_processScene, scenes):
+                    self._addResult(result)
+
+                pool.close()
+
+            finally:
+
+                pool.terminate()
+                pool.join()
+
+        return self.results()
+
+    # -------------------------------------------------------------------------
+    # _addResult
+    # -------------------------------------------------------------------------
+    def _addResult(self, result):
+
+        self._results.append(result)
+
+        if self._logger:
+
+            self._logger.info(result['image'] +
+                              ': ' +
+                              result['status'] +
+                              (' ' + result['error'] if result['error']
+                               else ''))
+
+    # -------------------------------------------------------------------------
+    # sceneDir
+    # -------------------------------------------------------------------------
+    def sceneDir(self, avirisImage):
+
+        sceneName = os.path.splitext(os.path.basename(avirisImage))[0]
+        return os.path.join(self._outDir, sceneName)
+
+    # -------------------------------------------------------------------------
+    # settings
+    #
+    # This returns the settings affecting a scene's results:  the fingerprints
+    # of the model and of the mask, or the model's default mask, the
+    # algorithms, in the order of the outputs' bands, the precision and the
+    # area of interest, as (rings, SRS WKT, crop).
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def settings(model, algorithmNames, mask, precision, area=None):
+
+        mask = AlgorithmKernel(model, mask, precision).mask
+
+        return {'model': model.fingerprint(),
+                'algorithms': list(algorithmNames),
+                'mask': mask.fingerprint() if mask else None,
+                'precision': precision,
+                'area': area}
+
+    # -------------------------------------------------------------------------
+    # summary
+    #
+    # This returns a printable table of each scene's status, time and
+    # throughput, followed by the totals.
+    # -------------------------------------------------------------------------
+    def summary(self):
+
+        lines = ['%-40s %-8s %10s %12s %10s' %
+                 ('Scene', 'Status', 'Seconds', 'Pixels/sec', 'MB/sec')]
+
+        totalSeconds = 0.0
+        totalPixels = 0
+        totalBytes = 0
+        counts = {AvirisBatch.DONE: 0,
+                  AvirisBatch.FAILED: 0,
+                  AvirisBatch.SKIPPED: 0}
+
+        for result in self._results:
+
+            counts[result['status']] += 1
+            totalSeconds += result['seconds']
+            totalPixels += result['pixels']
+            totalBytes += result['bytes read']
+
+            lines.append('%-40s %-8s %10.2f %12.0f %10.2f' %
+                         (os.path.basename(result['image'])[-40:],
+                          result['status'],
+                          result['seconds'],
+                          AvirisBatch._rate(result['pixels'],
+                                            result['seconds']),
+                          AvirisBatch._rate(result['bytes read'] / 1.0e6,
+                                            result['seconds'])))
+
+        lines.append('%-40s %-8s %10.2f %12.0f %10.2f' %
+                     ('Total',
+                      '',
+                      totalSeconds,
+                      AvirisBatch._rate(totalPixels, totalSeconds),
+                      AvirisBatch._rate(totalBytes / 1.0e6, totalSeconds)))
+
+        lines.append(str(counts[AvirisBatch.DONE]) + ' done, ' +
+                     str(counts[AvirisBatch.SKIPPED]) + ' skipped, ' +
+                     str(counts[AvirisBatch.FAILED]) + ' failed')
+
+        return '\n'.join(lines)
+
+    # -------------------------------------------------------------------------
+    # _rate
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _rate(amount, seconds):
+
+        return amount / seconds if seconds > 0 else 0.0
+
+
+# -----------------------------------------------------------------------------
+# _processScene
+#
+# This processes one scene for AvirisBatch.run, returning its result.  Pool
+# functions must be defined at module level to be pickled.  Failures are
+# returned, not raised, so one bad scene does not end the batch.
+# -----------------------------------------------------------------------------
+def _processScene(args):
+
+    model, image, sceneDir, algorithmNames, separateFiles, maxBlockBytes, \
+        outputOptions, precision, mask, skipEmpty, layerDir, prefetchDepth, \
+        area = args
+
+    result = {'image': image,
+              'status': AvirisBatch.SKIPPED,
+              'seconds': 0.0,
+              'pixels': 0,
+              'bytes read': 0,
+              'error': None}
+
+    outNames = ApplyAlgorithm.outputNames(image, algorithmNames, separateFiles)
+    settingsPath = os.path.join(sceneDir, AvirisBatch.SETTINGS_FILE)
+
+    try:
+
+        settings = AvirisBatch.settings(model,
+                                        algorithmNames,
+                                        mask,
+                                        precision,
+                                        area)
+
+        if os.path.exists(sceneDir) and \
+           AvirisBatch.isDone(image, sceneDir, outNames, settings):
+
+            return result
+
+        if not os.path.exists(sceneDir):
+            os.mkdir(sceneDir)
+
+        # The settings are recorded again only once the outputs are made.
+        if os.path.exists(settingsPath):
+            os.remove(settingsPath)
+
+        startTime = time.time()
+
+        aa = ApplyAlgorithm(model,
+                            image,
+                            sceneDir,
+                            None,
+                            maxBlockBytes,
+                            outputOptions=outputOptions,
+                            precision=precision,
+                            mask=mask,
+                            skipEmpty=skipEmpty,
+                            layerDir=layerDir,
+                            prefetchDepth=prefetchDepth)
+
+        if area:
+
+            rings, srsWkt, cropToArea = area
+
+            try:
+                aa.clip(_areaPolygon(rings, srsWkt), cropToArea)
+
+            except RuntimeError:
+
+                # The scene does not intersect the area of interest.
+                if not os.listdir(sceneDir):
+                    os.rmdir(sceneDir)
+
+                return result
+
+        aa.applyAlgorithms(algorithmNames, separateFiles)
+
+        with open(settingsPath, 'w') as f:
+            json.dump(settings, f, indent=2, sort_keys=True)
+
+        dataset = aa.imageFile._getDataset()
+        result['status'] = AvirisBatch.DONE
+        result['seconds'] = time.time() - startTime
+        result['pixels'] = dataset.RasterXSize * dataset.RasterYSize
+        result['bytes read'] = aa.report['Bytes read']
+
+    except Exception:
+
+        result['status'] = AvirisBatch.FAILED
+        result['error'] = traceback.format_exc().strip().split('\n')[-1]
+
+    return result
+
+
+# -----------------------------------------------------------------------------
+# _areaPolygon
+#
+# This returns an OGR polygon of rings of (x, y), in the SRS given by its WKT,
+# or without one, for _processScene.
+# -----------------------------------------------------------------------------
+def _areaPolygon(rings, srsWkt):
+
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+
+    for ring in rings:
+
+        ogrRing = ogr.Geometry(ogr.wkbLinearRing)
+
+        for x, y in ring:
+            ogrRing.AddPoint_2D(x, y)
+
+        if tuple(ring[0]) != tuple(ring[-1]):
+            ogrRing.AddPoint_2D(*ring[0])
+
+        polygon.AddGeometry(ogrRing)
+
+    if srsWkt:
+
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(srsWkt)
+        polygon.AssignSpatialReference(srs)
+
+    return polygon
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import traceback
+
+import numpy
+
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.AvirisBatch \
+    import AvirisBatch
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class AvirisBenchmark
+#
+# This times ApplyAlgorithm end to end on synthetic ENVI cubes of plausible
+# reflectances, for every combination of size, band count, interleave and
+# no-data fraction.  Cubes are made once, in workDir, and reused by later
+# benchmarks.  Each case runs in its own process, so its peak resident set
+# size is its own, and the best of its repeats is kept.
+#
+# Without a model, each cube gets a synthetic regression over all of its
+# bands, with AVIRIS-NG's divisor and mask bands where it has them.  The
+# options are ApplyAlgorithm's keyword arguments, like numWorkers or
+# prefetchDepth.
+#
+# The results, with the commit, host and options, are written as JSON, so
+# compare() can measure one commit against another.
+#
+# benchmark = AvirisBenchmark('/att/nobackup/rlgill/benchmark')
+# results = benchmark.run(AvirisBenchmark.cases([(1024, 1024)], [425],
+#                                               ['bil'], [0.0, 0.5]),
+#                         'results.json')
+# -----------------------------------------------------------------------------
+class AvirisBenchmark(object):
+
+    # (samples, lines) of the default scales
+    DEFAULT_SIZES = [(256, 256), (1024, 1024), (1024, 4096)]
+
+    DEFAULT_BANDS = [425]
+    DEFAULT_INTERLEAVES = ['bsq', 'bil', 'bip']
+    DEFAULT_NO_DATA_FRACTIONS = [0.0, 0.5]
+
+    # Fields of each case
+    CASE_FIELDS = ['samples', 'lines', 'bands', 'interleave', 'no data']
+
+    # Cubes are written in strips of this many lines.
+    LINES_PER_STRIP = 64
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self,
+                 workDir,
+                 model=None,
+                 algorithmNames=None,
+                 repeats=1,
+                 logger=None,
+                 options=None):
+
+        if not os.path.isdir(workDir):
+
+            raise RuntimeError(str(workDir) +
+                               ' is not an existing directory.')
+
+        if repeats < 1:
+            raise RuntimeError('Each case must run at least once.')
+
+        self._workDir = workDir
+        self._model = model
+        self._algorithmNames = algorithmNames
+        self._repeats = repeats
+        self._logger = logger
+        self._options = options or {}
+
+    # -------------------------------------------------------------------------
+    # _caseModel
+    #
+    # This returns the model for a case, checking that its cube has every
+    # band the model reads.
+    # -------------------------------------------------------------------------
+    def _caseModel(self, case):
+
+        model = self._model or AvirisBenchmark.syntheticModel(case['bands'])
+
+        if isinstance(model, CoefficientModel) and \
+           model.requiredBands().max() > case['bands']:
+
+            raise RuntimeError('The model reads band ' +
+                               str(model.requiredBands().max()) +
+                               ', but case ' +
+                               AvirisBenchmark.caseName(case) +
+                               ' has only ' +
+                               str(case['bands']) +
+                               ' bands.')
+
+        return model
+
+    # -------------------------------------------------------------------------
+    # caseName
+    #
+    # This names a case, like 1024x1024x425_bil_0.5.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def caseName(case):
+
+        return str(case['samples']) + 'x' + \
+            str(case['lines']) + 'x' + \
+            str(case['bands']) + '_' + \
+            case['interleave'] + '_' + \
+            str(case['no data'])
+
+    # -------------------------------------------------------------------------
+    # cases
+    #
+    # This returns every combination of the sizes, as (samples, lines), band
+    # counts, interleaves and no-data fractions.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cases(sizes=DEFAULT_SIZES,
+              bandCounts=DEFAULT_BANDS,
+              interleaves=DEFAULT_INTERLEAVES,
+              noDataFractions=DEFAULT_NO_DATA_FRACTIONS):
+
+        return [dict(zip(AvirisBenchmark.CASE_FIELDS,
+                         (samples, lines, bands, interleave, noData)))
+                for (samples, lines), bands, interleave, noData in
+                itertools.product(sizes,
+                                  bandCounts,
+                                  interleaves,
+                                  noDataFractions)]
+
+    # -------------------------------------------------------------------------
+    # _commit
+    #
+    # This returns the commit of the working tree, or None outside a
+    # repository.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _commit():
+
+        try:
+
+            with open(os.devnull, 'w') as devnull:
+
+                commit = subprocess.check_output(
+                    ['git', 'rev-parse', 'HEAD'],
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    stderr=devnull)
+
+            return commit.decode('ascii').strip()
+
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    # -------------------------------------------------------------------------
+    # compare
+    #
+    # This returns, for each case in both results, its case, seconds in each
+    # and speedup, the baseline's seconds over the results'.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def compare(baseline, results):
+
+        baselineSeconds = dict(
+            (AvirisBenchmark.caseName(case), case['seconds'])
+            for case in baseline['results'])
+
+        comparison = []
+
+        for case in results['results']:
+
+            name = AvirisBenchmark.caseName(case)
+
+            if name not in baselineSeconds:
+                continue
+
+            comparison.append({'case': name,
+                               'baseline seconds': baselineSeconds[name],
+                               'seconds': case['seconds'],
+                               'speedup': AvirisBatch._rate(
+                                   baselineSeconds[name],
+                                   case['seconds'])})
+
+        return comparison
+
+    # -------------------------------------------------------------------------
+    # createCube
+    #
+    # This writes an ENVI cube of float32 reflectances, uniform between 0.02
+    # and 0.5, with the given fraction of its pixels no-data in every band.
+    # It is written in strips, so a large cube needs little memory.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def createCube(imageFile, samples, lines, bands, interleave, noData,
+                   seed=0):
+
+        shapes = {'bsq': (bands, lines, samples),
+                  'bil': (lines, bands, samples),
+                  'bip': (lines, samples, bands)}
+
+        if interleave not in shapes:
+            raise RuntimeError('Invalid interleave: ' + str(interleave))
+
+        if not 0.0 <= noData <= 1.0:
+
+            raise RuntimeError('The no-data fraction must be between 0 ' +
+                               'and 1.')
+
+        random = numpy.random.RandomState(seed)
+
+        cube = numpy.memmap(imageFile,
+                            numpy.float32,
+                            'w+',
+                            shape=shapes[interleave])
+
+        for first in range(0, lines, AvirisBenchmark.LINES_PER_STRIP):
+
+            last = min(first + AvirisBenchmark.LINES_PER_STRIP, lines)
+
+            shape = (last - first, samples)
+
+            strip = random.uniform(0.02, 0.5, (bands,) + shape). \
+                astype(numpy.float32)
+
+            strip[:, random.random_sample(shape) < noData] = \
+                ApplyAlgorithm.NO_DATA_VALUE
+
+            if interleave == 'bil':
+                cube[first:last] = strip.transpose(1, 0, 2)
+
+            elif interleave == 'bip':
+                cube[first:last] = strip.transpose(1, 2, 0)
+
+            else:
+                cube[:, first:last] = strip
+
+        cube.flush()
+        del cube
+
+        with open(os.path.splitext(imageFile)[0] + '.hdr', 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = ' + str(samples) + '\n' +
+                    'lines = ' + str(lines) + '\n' +
+                    'bands = ' + str(bands) + '\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = ' + interleave + '\n' +
+                    'byte order = 0\n' +
+                    'map info = {UTM, 1, 1, 583067.28, 7917730.91, ' +
+                    '5.2, 5.2, 4, North, WGS-84}\n')
+
+    # -------------------------------------------------------------------------
+    # _cube
+    #
+    # This returns the path of a case's cube, making it if it does not exist.
+    # -------------------------------------------------------------------------
+    def _cube(self, case):
+
+        cubeDir = os.path.join(self._workDir, 'cubes')
+
+        if not os.path.exists(cubeDir):
+            os.mkdir(cubeDir)
+
+        imageFile = os.path.join(cubeDir,
+                                 AvirisBenchmark.caseName(case) + '.img')
+
+        if not os.path.exists(imageFile):
+
+            if self._logger:
+                self._logger.info('Creating ' + imageFile)
+
+            # The cube is renamed into place once written.  Its temporary
+            # name is unique, so benchmarks sharing the directory do not
+            # write over each other's.
+            handle, tempFile = tempfile.mkstemp('.img', dir=cubeDir)
+            os.close(handle)
+            tempHeader = os.path.splitext(tempFile)[0] + '.hdr'
+
+            try:
+
+                AvirisBenchmark.createCube(tempFile,
+                                           case['samples'],
+                                           case['lines'],
+                                           case['bands'],
+                                           case['interleave'],
+                                           case['no data'])
+
+            except Exception:
+
+                for path in [tempFile, tempHeader]:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+                raise
+
+            os.rename(tempHeader, os.path.splitext(imageFile)[0] + '.hdr')
+            os.rename(tempFile, imageFile)
+
+        return imageFile
+
+    # -------------------------------------------------------------------------
+    # run
+    #
+    # This runs each case and returns the results, with the commit, host,
+    # time and options.  Given a path, the results are also written there as
+    # JSON.
+    # -------------------------------------------------------------------------
+    def run(self, cases, resultsPath=None):
+
+        results = {'commit': AvirisBenchmark._commit(),
+                   'host': socket.gethostname(),
+                   'python': platform.python_version(),
+                   'numpy': numpy.__version__,
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'repeats': self._repeats,
+                   'options': self._options,
+                   'results': []}
+
+        for case in cases:
+
+            caseResult = self._runCase(case)
+            results['results'].append(caseResult)
+
+            if self._logger:
+
+                self._logger.info(AvirisBenchmark.caseName(case) +
+                                  ': ' +
+                                  str(caseResult['seconds']) +
+                                  ' seconds, ' +
+                                  str(caseResult['pixels per second']) +
+                                  ' pixels/sec, ' +
+                                  str(caseResult['MB per second']) +
+                                  ' MB/sec, ' +
+                                  str(caseResult['peak RSS bytes']) +
+                                  ' peak RSS bytes')
+
+        if resultsPath:
+
+            tempPath = resultsPath + '.tmp'
+
+            with open(tempPath, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+            os.rename(tempPath, resultsPath)
+
+        return results
+
+    # -------------------------------------------------------------------------
+    # _runCase
+    #
+    # This returns a case's result:  its fields, the seconds of each repeat
+    # and the best, pixels and MB read per second and the peak resident set
+    # size, at the best, of any repeat's process and its workers.
+    # -------------------------------------------------------------------------
+    def _runCase(self, case):
+
+        imageFile = self._cube(case)
+        model = self._caseModel(case)
+        result = dict(case)
+        result['all seconds'] = []
+        result['peak RSS bytes'] = 0
+
+        for i in range(self._repeats):
+
+            outDir = tempfile.mkdtemp(dir=self._workDir)
+
+            try:
+
+                receiver, sender = multiprocessing.Pipe(False)
+
+                # A pool's daemon processes could not have workers.
+                process = multiprocessing.Process(
+                    target=_timeCase,
+                    args=(model,
+                          imageFile,
+                          outDir,
+                          self._algorithmNames,
+                          self._options,
+                          sender))
+
+                process.start()
+
+                # Without the parent's copy of the sending end, recv() ends
+                # when the process does, even if it sends nothing.
+                sender.close()
+
+                try:
+                    report = receiver.recv()
+
+                except EOFError:
+                    report = None
+
+                process.join()
+
+                if report is None:
+
+                    report = {'error': 'its process exited with code ' +
+                                       str(process.exitcode)}
+
+            finally:
+                shutil.rmtree(outDir)
+
+            if 'error' in report:
+
+                raise RuntimeError('Case ' +
+                                   AvirisBenchmark.caseName(case) +
+                                   ' failed: ' +
+                                   report['error'])
+
+            result['all seconds'].append(report['seconds'])
+
+            result['peak RSS bytes'] = \
+                max(result['peak RSS bytes'],
+                    report['Process peak RSS bytes'],
+                    report.get('Process peak worker RSS bytes', 0))
+
+        result['seconds'] = min(result['all seconds'])
+        result['pixels'] = case['samples'] * case['lines']
+        result['bytes read'] = report['Bytes read']
+
+        result['pixels per second'] = \
+            AvirisBatch._rate(result['pixels'], result['seconds'])
+
+        result['MB per second'] = \
+            AvirisBatch._rate(result['bytes read'] / 1.0e6, result['seconds'])
+
+        return result
+
+    # -------------------------------------------------------------------------
+    # summary
+    #
+    # This returns a table of results from run().
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def summary(results):
+
+        lines = ['%-32s %10s %12s %10s %10s' %
+                 ('Case', 'Seconds', 'Pixels/sec', 'MB/sec', 'Peak MB')]
+
+        for result in results['results']:
+
+            lines.append('%-32s %10.2f %12.0f %10.2f %10.1f' %
+                         (AvirisBenchmark.caseName(result),
+                          result['seconds'],
+                          result['pixels per second'],
+                          result['MB per second'],
+                          result['peak RSS bytes'] / 1.0e6))
+
+        return '\n'.join(lines)
+
+    # -------------------------------------------------------------------------
+    # syntheticModel
+    #
+    # This returns a regression of one algorithm, 'Synthetic', over every
+    # band of a cube, normalized by AVIRIS-NG's divisor bands and masked by
+    # its mask bands, or the last band where the cube has fewer.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def syntheticModel(bands):
+
+        random = numpy.random.RandomState(bands)
+
+        return CoefficientModel(
+            ['Synthetic'],
+            [random.uniform(-10.0, 10.0)],
+            numpy.arange(1, bands + 1),
+            random.uniform(-100.0, 100.0, (bands, 1)),
+            [min(b, bands) for b in CoefficientModel.DIVISOR_RANGE],
+            [min(b, bands) for b in CoefficientModel.MASK_BANDS])
+
+
+# -----------------------------------------------------------------------------
+# _timeCase
+#
+# This runs one case of AvirisBenchmark in its own process and sends
+# ApplyAlgorithm's report, with the seconds taken, or the error, through the
+# connection.  Process targets must be defined at module level to be
+# pickled.
+# -----------------------------------------------------------------------------
+def _timeCase(model, imageFile, outDir, algorithmNames, options, connection):
+
+    options = dict(options)
+    options.setdefault('checkpointSeconds', None)
+
+    try:
+
+        startTime = time.time()
+        aa = ApplyAlgorithm(model, imageFile, outDir, **options)
+
+        aa.applyAlgorithms(algorithmNames)
+        report = aa.report
+        report['seconds'] = time.time() - startTime
+
+    except Exception:
+        report = {'error': traceback.format_exc().strip().split('\n')[-1]}
+
+    connection.send(report)
+    connection.close()
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+
+import ast
+import hashlib
+import re
+
+import numpy
+
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class BandMath
+#
+# This is a program of named band-math expressions.  ApplyAlgorithm writes
+# each as an output, as it does an algorithm of a CoefficientModel.
+#
+# red = b35
+# nir = b60
+# ndvi = (nir - red) / (nir + red)
+# ratio = nir / red
+#
+# Bands are referenced as b<N> or B<N>, numbered from 1 like the coefficient
+# CSV.  Expressions use numbers, + - * / **, comparisons, and, or, not and the
+# functions in FUNCTIONS.  Statements are separated by new lines or semicolons,
+# and a statement that is only an expression is named defaultName.
+#
+# The program is parsed once into a graph of operations.  Constant operations
+# are folded, and repeated subexpressions become one operation.  Evaluating
+# some outputs runs only the operations they depend on, over whole blocks as
+# array operations, releasing each intermediate after its last use.
+# -----------------------------------------------------------------------------
+class BandMath(object):
+
+    BAND_PATTERN = re.compile(r'^[bB](\d+)$')
+
+    # Function name:  number of arguments
+    FUNCTIONS = {'abs': 1,
+                 'exp': 1,
+                 'log': 1,
+                 'log10': 1,
+                 'max': 2,
+                 'min': 2,
+                 'sqrt': 1,
+                 'where': 3}
+
+    # Operations whose arguments may be reordered
+    COMMUTATIVE = ['add', 'and', 'eq', 'max', 'min', 'mul', 'ne', 'or']
+
+    OPERATIONS = {'abs': numpy.abs,
+                  'add': numpy.add,
+                  'and': numpy.logical_and,
+                  'div': numpy.true_divide,
+                  'eq': numpy.equal,
+                  'exp': numpy.exp,
+                  'ge': numpy.greater_equal,
+                  'gt': numpy.greater,
+                  'le': numpy.less_equal,
+                  'log': numpy.log,
+                  'log10': numpy.log10,
+                  'lt': numpy.less,
+                  'max': numpy.maximum,
+                  'min': numpy.minimum,
+                  'mul': numpy.multiply,
+                  'ne': numpy.not_equal,
+                  'neg': numpy.negative,
+                  'not': numpy.logical_not,
+                  'or': numpy.logical_or,
+                  'pow': numpy.power,
+                  'sqrt': numpy.sqrt,
+                  'sub': numpy.subtract,
+                  'where': numpy.where}
+
+    AST_OPERATIONS = {ast.Add: 'add',
+                      ast.And: 'and',
+                      ast.BitAnd: 'and',
+                      ast.BitOr: 'or',
+                      ast.Div: 'div',
+                      ast.Eq: 'eq',
+                      ast.Gt: 'gt',
+                      ast.GtE: 'ge',
+                      ast.Invert: 'not',
+                      ast.Lt: 'lt',
+                      ast.LtE: 'le',
+                      ast.Mult: 'mul',
+                      ast.Not: 'not',
+                      ast.NotEq: 'ne',
+                      ast.Or: 'or',
+                      ast.Pow: 'pow',
+                      ast.Sub: 'sub',
+                      ast.USub: 'neg'}
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, program, defaultName='result'):
+
+        # Each node is a tuple of an operation and its arguments, which are
+        # the indices of earlier nodes, except for 'band' and 'const' nodes.
+        self._nodes = []
+        self._nodeIndex = {}
+        self._definitions = {}
+        self._algorithmNames = []
+
+        try:
+            statements = ast.parse(program.strip()).body
+
+        except SyntaxError as e:
+
+            raise RuntimeError('Invalid band math, ' +
+                               repr(program) +
+                               ': ' +
+                               str(e))
+
+        for statement in statements:
+
+            if isinstance(statement, ast.Assign) and \
+               len(statement.targets) == 1 and \
+               isinstance(statement.targets[0], ast.Name):
+
+                name = statement.targets[0].id
+                value = statement.value
+
+            elif isinstance(statement, ast.Expr):
+
+                name = defaultName
+                value = statement.value
+
+            else:
+
+                raise RuntimeError('Band math statements must be ' +
+                                   '"name = expression" or an expression.')
+
+            if BandMath.BAND_PATTERN.match(name) or \
+               name in BandMath.FUNCTIONS:
+
+                raise RuntimeError(name + ' cannot be used as a name.')
+
+            if name in self._definitions:
+                raise RuntimeError(name + ' is defined more than once.')
+
+            self._definitions[name] = self._compile(value)
+            self._algorithmNames.append(name)
+
+        if not self._algorithmNames:
+            raise RuntimeError('The band math program is empty.')
+
+        self._program = program
+
+    # -------------------------------------------------------------------------
+    # algorithmNames
+    # -------------------------------------------------------------------------
+    def algorithmNames(self):
+
+        return list(self._algorithmNames)
+
+    # -------------------------------------------------------------------------
+    # bandIndices
+    #
+    # This returns the sorted, 1-based bands the outputs reference.
+    # -------------------------------------------------------------------------
+    def bandIndices(self):
+
+        return numpy.array(sorted(self._nodes[i][1] for i in self._schedule()
+                                  if self._nodes[i][0] == 'band'),
+                           dtype=numpy.int64)
+
+    # -------------------------------------------------------------------------
+    # _compile
+    #
+    # This adds the nodes for an expression and returns the index of its
+    # result.
+    # -------------------------------------------------------------------------
+    def _compile(self, node):
+
+        number = BandMath._number(node)
+
+        if number is not None:
+            return self._node(('const', number))
+
+        if isinstance(node, ast.Name):
+
+            match = BandMath.BAND_PATTERN.match(node.id)
+
+            if match:
+
+                if int(match.group(1)) < 1:
+                    raise RuntimeError('Bands are numbered from 1.')
+
+                return self._node(('band', int(match.group(1))))
+
+            if node.id not in self._definitions:
+                raise RuntimeError(node.id + ' is not defined.')
+
+            return self._definitions[node.id]
+
+        if isinstance(node, ast.BinOp) or isinstance(node, ast.UnaryOp):
+
+            operation = BandMath.AST_OPERATIONS.get(type(node.op))
+
+            if isinstance(node.op, ast.UAdd):
+                return self._compile(node.operand)
+
+            if not operation:
+
+                raise RuntimeError('Unsupported operator ' +
+                                   type(node.op).__name__)
+
+            if isinstance(node, ast.UnaryOp):
+                return self._node((operation, self._compile(node.operand)))
+
+            return self._node((operation,
+                               self._compile(node.left),
+                               self._compile(node.right)))
+
+        if isinstance(node, ast.BoolOp):
+
+            operation = BandMath.AST_OPERATIONS[type(node.op)]
+            result = self._compile(node.values[0])
+
+            for value in node.values[1:]:
+                result = self._node((operation, result, self._compile(value)))
+
+            return result
+
+        if isinstance(node, ast.Compare):
+
+            # a < b < c is a < b and b < c.
+            result = None
+            left = self._compile(node.left)
+
+            for op, comparator in zip(node.ops, node.comparators):
+
+                if type(op) not in BandMath.AST_OPERATIONS:
+
+                    raise RuntimeError('Unsupported comparison ' +
+                                       type(op).__name__)
+
+                right = self._compile(comparator)
+                operation = BandMath.AST_OPERATIONS[type(op)]
+                comparison = self._node((operation, left, right))
+
+                result = comparison if result is None \
+                    else self._node(('and', result, comparison))
+
+                left = right
+
+            return result
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+           node.func.id in BandMath.FUNCTIONS and not node.keywords:
+
+            if len(node.args) != BandMath.FUNCTIONS[node.func.id]:
+
+                raise RuntimeError(node.func.id +
+                                   ' takes ' +
+                                   str(BandMath.FUNCTIONS[node.func.id]) +
+                                   ' arguments.')
+
+            return self._node(tuple([node.func.id] +
+                                    [self._compile(a) for a in node.args]))
+
+        raise RuntimeError('Unsupported band math:  ' + type(node).__name__)
+
+    # -------------------------------------------------------------------------
+    # evaluate
+    #
+    # The stack is shaped (bands, ...), holding the sorted, 1-based bands
+    # given.  This returns a list with each output's array.  Bands are
+    # converted to computeType, when given, before they are used.
+    # -------------------------------------------------------------------------
+    def evaluate(self, stack, bands, computeType=None):
+
+        schedule = self._schedule()
+        outputs = set(self._definitions[n] for n in self._algorithmNames)
+        lastUse = {}
+
+        for i in schedule:
+            for arg in self._arguments(i):
+                lastUse[arg] = i
+
+        values = {}
+
+        with numpy.errstate(all='ignore'):
+
+            for i in schedule:
+
+                node = self._nodes[i]
+
+                if node[0] == 'band':
+
+                    value = stack[numpy.searchsorted(bands, node[1])]
+
+                    if computeType is not None:
+                        value = value.astype(computeType, copy=False)
+
+                elif node[0] == 'const':
+
+                    value = node[1]
+
+                else:
+
+                    value = BandMath.OPERATIONS[node[0]](
+                        *[values[arg] for arg in node[1:]])
+
+                values[i] = value
+
+                for arg in set(self._arguments(i)):
+
+                    if lastUse[arg] == i and arg not in outputs:
+                        del values[arg]
+
+        return [values[self._definitions[name]]
+                for name in self._algorithmNames]
+
+    # -------------------------------------------------------------------------
+    # fingerprint
+    # -------------------------------------------------------------------------
+    def fingerprint(self):
+
+        digest = hashlib.sha1()
+
+        for name in self._algorithmNames:
+            digest.update((name + '\n').encode('utf-8'))
+
+        for i in self._schedule():
+            digest.update((repr(self._nodes[i]) + '\n').encode('utf-8'))
+
+        return digest.hexdigest()
+
+    # -------------------------------------------------------------------------
+    # reduced
+    #
+    # This returns the program with only the given outputs.  Operations the
+    # other outputs alone need are dropped.
+    # -------------------------------------------------------------------------
+    def reduced(self, algorithmNames):
+
+        for name in algorithmNames:
+
+            if name not in self._definitions:
+
+                raise RuntimeError(name +
+                                   ' is not in band math program ' +
+                                   repr(self._program))
+
+        reduced = BandMath.__new__(BandMath)
+        reduced.__dict__.update(self.__dict__)
+        reduced._algorithmNames = list(algorithmNames)
+
+        return reduced
+
+    # -------------------------------------------------------------------------
+    # requiredBands
+    #
+    # This returns the sorted, 1-based bands to read:  those referenced and
+    # the no-data band.
+    # -------------------------------------------------------------------------
+    def requiredBands(self):
+
+        return numpy.union1d(self.bandIndices(),
+                             [CoefficientModel.NO_DATA_BAND])
+
+    # -------------------------------------------------------------------------
+    # _arguments
+    # -------------------------------------------------------------------------
+    def _arguments(self, i):
+
+        node = self._nodes[i]
+        return [] if node[0] in ['band', 'const'] else node[1:]
+
+    # -------------------------------------------------------------------------
+    # _node
+    #
+    # This returns the index of a node, adding it unless an identical one
+    # exists.  Operations of constants are computed here.
+    # -------------------------------------------------------------------------
+    def _node(self, node):
+
+        operation, args = node[0], list(node[1:])
+
+        if operation not in ['band', 'const']:
+
+            if all(self._nodes[a][0] == 'const' for a in args):
+
+                with numpy.errstate(all='ignore'):
+
+                    value = BandMath.OPERATIONS[operation](
+                        *[self._nodes[a][1] for a in args])
+
+                return self._node(('const', numpy.asarray(value).item()))
+
+            if operation in BandMath.COMMUTATIVE:
+                args.sort()
+
+            node = tuple([operation] + args)
+
+        if node not in self._nodeIndex:
+
+            self._nodeIndex[node] = len(self._nodes)
+            self._nodes.append(node)
+
+        return self._nodeIndex[node]
+
+    # -------------------------------------------------------------------------
+    # _number
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _number(node):
+
+        if hasattr(ast, 'Constant') and isinstance(node, ast.Constant):
+
+            if isinstance(node.value, (int, float)):
+                return node.value
+
+        elif hasattr(ast, 'Num') and isinstance(node, ast.Num):
+
+            return node.n
+
+        return None
+
+    # -------------------------------------------------------------------------
+    # _schedule
+    #
+    # This returns, in order, the indices of the nodes the outputs need.
+    # Nodes only refer to earlier nodes, so index order is a valid order.
+    # -------------------------------------------------------------------------
+    def _schedule(self):
+
+        needed = set()
+        pending = [self._definitions[n] for n in self._algorithmNames]
+
+        while pending:
+
+            i = pending.pop()
+
+            if i not in needed:
+
+                needed.add(i)
+                pending.extend(self._arguments(i))
+
+        return sorted(needed)
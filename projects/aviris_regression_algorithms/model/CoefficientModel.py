@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import hashlib
+import os
+import re
+
+import numpy
+
+from model.BaseFile import BaseFile
+
+
+# -----------------------------------------------------------------------------
+# class CoefficientModel
+#
+# This is a coefficient CSV compiled into arrays.  Bands are 1-based, as in
+# the 'Band Number' column, with B0 being the intercept.  The CSV is parsed
+# once; the compiled model can be saved to a binary sidecar, so later runs
+# skip parsing.
+#
+# model = CoefficientModel.read('Chl_Coeff_input.csv')
+# model.coefficients('Avg Chl')
+# -----------------------------------------------------------------------------
+class CoefficientModel(object):
+
+    BAND_KEY = 'Band Number'
+    NON_ALGORITHM_KEYS = [BAND_KEY, 'Wavelength']
+    SIDECAR_EXTENSION = '.npz'
+
+    # Bands, 1-based, whose L2 norm normalizes each pixel.
+    DIVISOR_RANGE = (5, 105)
+
+    # Bands, 1-based, tested by the high and low masks.
+    MASK_BANDS = (9, 245)
+
+    # The band, 1-based, tested for no-data.
+    NO_DATA_BAND = 1
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # coefs is shaped (number of bands, number of algorithms).
+    # -------------------------------------------------------------------------
+    def __init__(self,
+                 algorithmNames,
+                 intercepts,
+                 bandIndices,
+                 coefs,
+                 divisorRange=DIVISOR_RANGE,
+                 maskBands=MASK_BANDS):
+
+        self._algorithmNames = list(algorithmNames)
+        self._intercepts = numpy.asarray(intercepts, dtype=numpy.float64)
+        self._bandIndices = numpy.asarray(bandIndices, dtype=numpy.int64)
+        self._coefs = numpy.asarray(coefs, dtype=numpy.float64)
+        self._divisorRange = tuple(int(b) for b in divisorRange)
+        self._maskBands = tuple(int(b) for b in maskBands)
+
+        if not self._algorithmNames:
+            raise RuntimeError('A coefficient model needs an algorithm.')
+
+        if self._coefs.shape != (len(self._bandIndices),
+                                 len(self._algorithmNames)) or \
+           self._intercepts.shape != (len(self._algorithmNames),):
+
+            raise RuntimeError('Coefficients must be shaped (bands, ' +
+                               'algorithms) with one intercept per ' +
+                               'algorithm.')
+
+        if (self._bandIndices < 1).any():
+            raise RuntimeError('Band indices must be 1-based.')
+
+        self._divisorMask = \
+            (self._bandIndices >= self._divisorRange[0]) & \
+            (self._bandIndices <= self._divisorRange[1])
+
+    # -------------------------------------------------------------------------
+    # algorithmNames
+    # -------------------------------------------------------------------------
+    def algorithmNames(self):
+
+        return list(self._algorithmNames)
+
+    # -------------------------------------------------------------------------
+    # _algorithmIndex
+    # -------------------------------------------------------------------------
+    def _algorithmIndex(self, algorithmName):
+
+        if algorithmName not in self._algorithmNames:
+
+            raise RuntimeError('Algorithm ' +
+                               str(algorithmName) +
+                               ' not in coefficient model.')
+
+        return self._algorithmNames.index(algorithmName)
+
+    # -------------------------------------------------------------------------
+    # bandIndices
+    # -------------------------------------------------------------------------
+    def bandIndices(self):
+
+        return self._bandIndices
+
+    # -------------------------------------------------------------------------
+    # coefficientMatrix
+    #
+    # This returns the coefficients shaped (bands, algorithms), one column per
+    # algorithm, in the order of algorithmNames.
+    # -------------------------------------------------------------------------
+    def coefficientMatrix(self, algorithmNames):
+
+        return self._coefs[:, [self._algorithmIndex(n) for n in algorithmNames]]
+
+    # -------------------------------------------------------------------------
+    # coefficients
+    # -------------------------------------------------------------------------
+    def coefficients(self, algorithmName):
+
+        return self._coefs[:, self._algorithmIndex(algorithmName)]
+
+    # -------------------------------------------------------------------------
+    # divisorMask
+    #
+    # This is a boolean array selecting the entries of bandIndices() within
+    # the divisor range.
+    # -------------------------------------------------------------------------
+    def divisorMask(self):
+
+        return self._divisorMask
+
+    # -------------------------------------------------------------------------
+    # divisorRange
+    # -------------------------------------------------------------------------
+    def divisorRange(self):
+
+        return self._divisorRange
+
+    # -------------------------------------------------------------------------
+    # fingerprint
+    #
+    # This returns a digest of the model, which changes when anything
+    # affecting its results does.
+    # -------------------------------------------------------------------------
+    def fingerprint(self):
+
+        digest = hashlib.sha1()
+        digest.update('\n'.join(self._algorithmNames).encode('utf-8'))
+
+        for array in [self._intercepts,
+                      self._bandIndices,
+                      self._coefs,
+                      numpy.array(self._divisorRange + self._maskBands)]:
+
+            digest.update(numpy.ascontiguousarray(array).tobytes())
+
+        return digest.hexdigest()
+
+    # -------------------------------------------------------------------------
+    # fromCsv
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def fromCsv(coefFile):
+
+        coefFile = BaseFile(coefFile, '.csv').fileName()
+
+        with open(coefFile) as csvFile:
+
+            reader = csv.DictReader(csvFile)
+
+            algorithmNames = \
+                [name for name in reader.fieldnames
+                 if name and name not in CoefficientModel.NON_ALGORITHM_KEYS]
+
+            if CoefficientModel.BAND_KEY not in reader.fieldnames or \
+               not algorithmNames:
+
+                raise RuntimeError(coefFile +
+                                   ' must have a ' +
+                                   CoefficientModel.BAND_KEY +
+                                   ' column and at least one algorithm.')
+
+            intercepts = numpy.zeros(len(algorithmNames))
+            bandIndices = []
+            coefs = []
+
+            for row in reader:
+
+                bandIndex = \
+                    int(re.search(r'\d{0,3}$',
+                                  row[CoefficientModel.BAND_KEY]).group())
+
+                rowCoefs = [float(row[name]) for name in algorithmNames]
+
+                if bandIndex == 0:
+
+                    intercepts[:] = rowCoefs
+
+                else:
+
+                    bandIndices.append(bandIndex)
+                    coefs.append(rowCoefs)
+
+        return CoefficientModel(algorithmNames,
+                                intercepts,
+                                bandIndices,
+                                numpy.array(coefs).reshape(
+                                    (len(bandIndices), len(algorithmNames))))
+
+    # -------------------------------------------------------------------------
+    # intercept
+    # -------------------------------------------------------------------------
+    def intercept(self, algorithmName):
+
+        return self._intercepts[self._algorithmIndex(algorithmName)]
+
+    # -------------------------------------------------------------------------
+    # intercepts
+    # -------------------------------------------------------------------------
+    def intercepts(self, algorithmNames):
+
+        return self._intercepts[[self._algorithmIndex(n)
+                                 for n in algorithmNames]]
+
+    # -------------------------------------------------------------------------
+    # load
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def load(sidecarFile):
+
+        sidecarFile = BaseFile(sidecarFile,
+                               CoefficientModel.SIDECAR_EXTENSION).fileName()
+
+        with numpy.load(sidecarFile, allow_pickle=False) as arrays:
+
+            return CoefficientModel([str(n) for n in arrays['algorithmNames']],
+                                    arrays['intercepts'],
+                                    arrays['bandIndices'],
+                                    arrays['coefs'],
+                                    arrays['divisorRange'],
+                                    arrays['maskBands'])
+
+    # -------------------------------------------------------------------------
+    # maskBands
+    # -------------------------------------------------------------------------
+    def maskBands(self):
+
+        return self._maskBands
+
+    # -------------------------------------------------------------------------
+    # reduced
+    #
+    # This returns a model of only the given algorithms and only the bands
+    # that affect them:  those with a nonzero coefficient in any of them and,
+    # unless the divisor is known, those in the divisor range.
+    # -------------------------------------------------------------------------
+    def reduced(self, algorithmNames, keepDivisorBands=True):
+
+        coefs = self.coefficientMatrix(algorithmNames)
+        keep = (coefs != 0).any(axis=1)
+
+        if keepDivisorBands:
+            keep |= self._divisorMask
+
+        return CoefficientModel(algorithmNames,
+                                self.intercepts(algorithmNames),
+                                self._bandIndices[keep],
+                                coefs[keep],
+                                self._divisorRange,
+                                self._maskBands)
+
+    # -------------------------------------------------------------------------
+    # requiredBands
+    #
+    # This returns the sorted, 1-based bands an evaluation of this model must
+    # read:  the model's bands, the mask bands and the no-data band.  Use
+    # reduced() first to drop bands with zero coefficients.
+    # -------------------------------------------------------------------------
+    def requiredBands(self):
+
+        return numpy.union1d(self._bandIndices,
+                             list(self._maskBands) +
+                             [CoefficientModel.NO_DATA_BAND])
+
+    # -------------------------------------------------------------------------
+    # read
+    #
+    # This reads a compiled model from a sidecar or a CSV.  When a sidecar at
+    # least as new as the CSV exists beside it, the sidecar is read instead.
+    # Otherwise, the CSV is compiled and, if writeSidecar, saved beside it.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def read(coefFile, writeSidecar=False):
+
+        if os.path.splitext(coefFile)[1] == CoefficientModel.SIDECAR_EXTENSION:
+            return CoefficientModel.load(coefFile)
+
+        sidecar = CoefficientModel.sidecarName(coefFile)
+
+        if os.path.exists(sidecar) and os.path.exists(coefFile) and \
+           os.path.getmtime(sidecar) >= os.path.getmtime(coefFile):
+
+            return CoefficientModel.load(sidecar)
+
+        model = CoefficientModel.fromCsv(coefFile)
+
+        if writeSidecar:
+            model.save(sidecar)
+
+        return model
+
+    # -------------------------------------------------------------------------
+    # save
+    # -------------------------------------------------------------------------
+    def save(self, sidecarFile):
+
+        # Write to a file object, so numpy does not append its own extension.
+        with open(sidecarFile, 'wb') as f:
+
+            numpy.savez(f,
+                        algorithmNames=numpy.array(self._algorithmNames,
+                                                   dtype=numpy.str_),
+                        intercepts=self._intercepts,
+                        bandIndices=self._bandIndices,
+                        coefs=self._coefs,
+                        divisorRange=numpy.array(self._divisorRange),
+                        maskBands=numpy.array(self._maskBands))
+
+    # -------------------------------------------------------------------------
+    # sidecarName
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def sidecarName(coefFile):
+
+        return os.path.splitext(coefFile)[0] + \
+            CoefficientModel.SIDECAR_EXTENSION
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+from osgeo import gdal
+
+
+# -----------------------------------------------------------------------------
+# class GeoTiffOptions
+#
+# This describes how ApplyAlgorithm writes its GeoTIFFs:  block size,
+# compression, predictor, BigTIFF and overview levels.  With cog, the file
+# is written in cloud-optimized layout, with its overviews and tile index
+# ahead of the full-resolution tiles, without a separate gdal_translate or
+# gdaladdo run.  The layout cannot be written as the blocks arrive, so the
+# full resolution is written to an uncompressed, tiled working file and its
+# overviews built there.  finish() then copies it, compressing each block
+# once, into place.  That copy is an extra pass over the output, and the
+# working file takes the output's uncompressed size on disk until
+# removeTemporary() deletes it.
+#
+# The defaults write a plain, striped, uncompressed GeoTIFF.
+# cloudOptimized() returns options for a compressed, tiled COG.
+# -----------------------------------------------------------------------------
+class GeoTiffOptions(object):
+
+    BIGTIFF_CHOICES = ['YES', 'NO', 'IF_NEEDED', 'IF_SAFER']
+    COMPRESS_CHOICES = ['NONE', 'DEFLATE', 'LZW', 'ZSTD', 'LZMA', 'PACKBITS']
+    PREDICTOR_COMPRESSION = ['DEFLATE', 'LZW', 'ZSTD']
+
+    # COG writes the full resolution to this uncompressed file, then copies
+    # it into place.
+    TEMP_EXTENSION = '.tmp.tif'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # overviewLevels is a list of decimation factors, like [2, 4, 8], or
+    # 'AUTO' to halve the image until it fits in one block.
+    # -------------------------------------------------------------------------
+    def __init__(self,
+                 blockSize=None,
+                 compress=None,
+                 predictor=None,
+                 bigTiff=None,
+                 overviewLevels=None,
+                 cog=False,
+                 resampling='AVERAGE'):
+
+        if blockSize is not None and (blockSize < 16 or blockSize % 16):
+            raise RuntimeError('The block size must be a multiple of 16.')
+
+        if compress and compress.upper() not in \
+           GeoTiffOptions.COMPRESS_CHOICES:
+
+            raise RuntimeError('Compression must be one of ' +
+                               str(GeoTiffOptions.COMPRESS_CHOICES))
+
+        if predictor is not None and predictor not in [1, 2, 3]:
+            raise RuntimeError('The predictor must be 1, 2 or 3.')
+
+        if bigTiff and bigTiff.upper() not in GeoTiffOptions.BIGTIFF_CHOICES:
+
+            raise RuntimeError('BigTIFF must be one of ' +
+                               str(GeoTiffOptions.BIGTIFF_CHOICES))
+
+        if cog and not blockSize:
+            raise RuntimeError('A cloud-optimized GeoTIFF must be tiled.')
+
+        if overviewLevels and overviewLevels != 'AUTO' and \
+           min(overviewLevels) < 2:
+
+            raise RuntimeError('Overview levels must be at least 2.')
+
+        self.blockSize = blockSize
+        self.compress = compress.upper() if compress else None
+        self.predictor = predictor
+        self.bigTiff = bigTiff.upper() if bigTiff else None
+        self.overviewLevels = overviewLevels
+        self.cog = cog
+        self.resampling = resampling
+
+    # -------------------------------------------------------------------------
+    # cloudOptimized
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cloudOptimized(blockSize=512,
+                       compress='DEFLATE',
+                       predictor=3,
+                       bigTiff='IF_SAFER',
+                       overviewLevels='AUTO'):
+
+        return GeoTiffOptions(blockSize,
+                              compress,
+                              predictor,
+                              bigTiff,
+                              overviewLevels,
+                              True)
+
+    # -------------------------------------------------------------------------
+    # create
+    #
+    # This creates the dataset to which the full-resolution image for outPath
+    # is written.  Pass it to finish() when it is complete.  A sparse dataset
+    # stores no blocks that are not written, which read as no-data.
+    # -------------------------------------------------------------------------
+    def create(self, outPath, xSize, ySize, numBands, dataType, sparse=False):
+
+        options = self.workingOptions()
+
+        if sparse:
+            options.append('SPARSE_OK=TRUE')
+
+        return gdal.GetDriverByName('GTiff').Create(self.workingPath(outPath),
+                                                    xSize,
+                                                    ySize,
+                                                    numBands,
+                                                    dataType,
+                                                    options)
+
+    # -------------------------------------------------------------------------
+    # creationOptions
+    # -------------------------------------------------------------------------
+    def creationOptions(self):
+
+        options = []
+
+        if self.blockSize:
+
+            options += ['TILED=YES',
+                        'BLOCKXSIZE=' + str(self.blockSize),
+                        'BLOCKYSIZE=' + str(self.blockSize)]
+
+        if self.compress:
+
+            options.append('COMPRESS=' + self.compress)
+
+            if self.predictor and \
+               self.compress in GeoTiffOptions.PREDICTOR_COMPRESSION:
+
+                options.append('PREDICTOR=' + str(self.predictor))
+
+        if self.bigTiff:
+            options.append('BIGTIFF=' + self.bigTiff)
+
+        return options
+
+    # -------------------------------------------------------------------------
+    # finish
+    #
+    # This builds the overviews for a dataset from create() and, for a COG,
+    # copies it to outPath in cloud-optimized layout.  Close the dataset,
+    # then call removeTemporary().
+    # -------------------------------------------------------------------------
+    def finish(self, outDs, outPath):
+
+        levels = self.levels(outDs.RasterXSize, outDs.RasterYSize)
+
+        if levels:
+            outDs.BuildOverviews(self.resampling, levels)
+
+        outDs.FlushCache()
+
+        if self.cog:
+
+            cogDs = gdal.GetDriverByName('GTiff'). \
+                CreateCopy(outPath,
+                           outDs,
+                           0,
+                           self.creationOptions() + ['COPY_SRC_OVERVIEWS=YES'])
+
+            cogDs = None
+
+    # -------------------------------------------------------------------------
+    # levels
+    #
+    # This returns the overview levels for an image of the given size.
+    # -------------------------------------------------------------------------
+    def levels(self, xSize, ySize):
+
+        if self.overviewLevels != 'AUTO':
+            return list(self.overviewLevels or [])
+
+        levels = []
+        blockSize = self.blockSize or 256
+        level = 2
+
+        while max(xSize, ySize) > blockSize * level // 2:
+
+            levels.append(level)
+            level *= 2
+
+        return levels
+
+    # -------------------------------------------------------------------------
+    # removeTemporary
+    #
+    # This deletes the full-resolution file a COG was copied from.
+    # -------------------------------------------------------------------------
+    def removeTemporary(self, outPath):
+
+        if self.cog:
+
+            gdal.GetDriverByName('GTiff').Delete(self.workingPath(outPath))
+
+    # -------------------------------------------------------------------------
+    # workingOptions
+    #
+    # These are the creation options of the file create() makes.  A COG's
+    # working file is not compressed, as finish() compresses its copy.
+    # -------------------------------------------------------------------------
+    def workingOptions(self):
+
+        options = self.creationOptions()
+
+        if self.cog:
+
+            options = [o for o in options
+                       if not o.startswith('COMPRESS=') and
+                       not o.startswith('PREDICTOR=')]
+
+        return options
+
+    # -------------------------------------------------------------------------
+    # workingPath
+    #
+    # This returns the path of the file create() makes for outPath.
+    # -------------------------------------------------------------------------
+    def workingPath(self, outPath):
+
+        return outPath + GeoTiffOptions.TEMP_EXTENSION if self.cog \
+            else outPath
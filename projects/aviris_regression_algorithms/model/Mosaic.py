@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+
+import math
+import multiprocessing
+import os
+
+import numpy
+
+from osgeo import gdal
+from osgeo import gdalconst
+from osgeo import osr
+
+from model.EnviImageFile import EnviImageFile
+from model.GeospatialImageFile import GeospatialImageFile
+
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.AreaOfInterest \
+    import AreaOfInterest
+from projects.aviris_regression_algorithms.model.GeoTiffOptions \
+    import GeoTiffOptions
+
+
+# -----------------------------------------------------------------------------
+# class Mosaic
+#
+# This applies a model to many overlapping scenes, writing the results
+# straight into one mosaic, instead of a file per scene mosaicked by a
+# separate GDAL pass.  The mosaic is a north-up grid, in the first scene's
+# SRS and pixel size unless others are given, covering every scene, and
+# divided into square tiles of tileSize pixels.
+#
+# Each tile is computed by itself, in a pool of numWorkers processes.  Every
+# scene overlapping the tile is sampled at the nearest pixel to each cell's
+# center, reading only the window of the scene under the tile, and the
+# scenes' results are merged by the rule:
+#
+#     first:  the first scene, in the order given, with a valid result
+#     last:   the last scene with a valid result
+#     mean:   the mean of the valid results
+#     best:   the valid result farthest from its scene's row and column
+#             edges.  This assumes each scene's raster is its swath, like
+#             AVIRIS-NG flight lines orthorectified with a rotated
+#             geotransform, whose columns run across track, so the farthest
+#             is the result nearest nadir.  For a north-up scene padded with
+#             no-data around a rotated swath, the raster's edges are not the
+#             swath's, and this is not the result nearest nadir.
+#
+# The algorithms are evaluated over the whole window of a scene under each
+# tile, then sampled.  In a scene rotated 45 degrees to the grid, the window
+# under a tile is the box around a rotated square, so this is about twice
+# the compute of the pixels sampled, and more along the swath's edges.
+#
+# Only tiles a scene covers are written, to a sparse GeoTIFF, so the rest of
+# the grid takes no space and reads as no-data.  The output has a band per
+# algorithm.  For aligned writes, give outputOptions a block size of
+# tileSize.
+#
+# mosaic = Mosaic(model, AvirisBatch.findImages('/data/*/*_img'), outPath)
+# mosaic.run()
+# -----------------------------------------------------------------------------
+class Mosaic(object):
+
+    BEST = 'best'
+    FIRST = 'first'
+    LAST = 'last'
+    MEAN = 'mean'
+    RULES = [FIRST, LAST, MEAN, BEST]
+
+    DEFAULT_TILE_SIZE = 512
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # The model is a CoefficientModel or BandMath.  The SRS is an
+    # osr.SpatialReference, and the pixel size is in its units.  The default
+    # pixel size, the first scene's, is in that scene's units, so it must be
+    # given when the SRS is another.
+    # -------------------------------------------------------------------------
+    def __init__(self,
+                 model,
+                 images,
+                 outPath,
+                 algorithmNames=None,
+                 rule=LAST,
+                 srs=None,
+                 pixelSize=None,
+                 tileSize=DEFAULT_TILE_SIZE,
+                 numWorkers=1,
+                 maxBlockBytes=ApplyAlgorithm.DEFAULT_MAX_BLOCK_BYTES,
+                 outputOptions=None,
+                 precision='float64',
+                 mask=None,
+                 logger=None):
+
+        if not images:
+            raise RuntimeError('There are no images to mosaic.')
+
+        if rule not in Mosaic.RULES:
+
+            raise RuntimeError('The overlap rule must be one of ' +
+                               str(Mosaic.RULES))
+
+        if tileSize < 1:
+            raise RuntimeError('The tile size must be positive.')
+
+        if pixelSize is not None and pixelSize <= 0:
+            raise RuntimeError('The pixel size must be positive.')
+
+        if numWorkers < 1:
+            raise RuntimeError('There must be at least one worker.')
+
+        self._model = model
+        self._images = list(images)
+        self._outPath = outPath
+        self._algorithmNames = algorithmNames or model.algorithmNames()
+        self._rule = rule
+        self._tileSize = tileSize
+        self._numWorkers = numWorkers
+        self._maxBlockBytes = maxBlockBytes
+        self._outputOptions = outputOptions or GeoTiffOptions()
+        self._precision = precision
+        self._mask = mask
+        self._logger = logger
+
+        # Measurements of the last run, by name
+        self.report = {}
+
+        imageFiles = [Mosaic._openImage(image) for image in self._images]
+        self._srs = srs or imageFiles[0].srs()
+
+        if not pixelSize:
+
+            if not self._srs.IsSame(imageFiles[0].srs()):
+
+                raise RuntimeError('A pixel size, in the units of the ' +
+                                   'mosaic\'s SRS, must be given when it ' +
+                                   'is not the first scene\'s SRS.')
+
+            xform = imageFiles[0]._getDataset().GetGeoTransform()
+            pixelSize = math.hypot(xform[1], xform[4])
+
+        # Each scene's bounds in map coordinates of the mosaic's SRS
+        bounds = [self._bounds(imageFile) for imageFile in imageFiles]
+        west = math.floor(min(b[0] for b in bounds) / pixelSize) * pixelSize
+        north = math.ceil(max(b[3] for b in bounds) / pixelSize) * pixelSize
+        self._xform = (west, pixelSize, 0.0, north, 0.0, -pixelSize)
+
+        self._xSize = int(math.ceil(
+            (max(b[2] for b in bounds) - west) / pixelSize))
+
+        self._ySize = int(math.ceil(
+            (north - min(b[1] for b in bounds)) / pixelSize))
+
+        # Each scene's window of the mosaic, as (xMin, yMin, xMax, yMax)
+        self._windows = [(int(math.floor((b[0] - west) / pixelSize)),
+                          int(math.floor((north - b[3]) / pixelSize)),
+                          int(math.ceil((b[2] - west) / pixelSize)),
+                          int(math.ceil((north - b[1]) / pixelSize)))
+                         for b in bounds]
+
+    # -------------------------------------------------------------------------
+    # _bounds
+    #
+    # This returns the bounds, (xMin, yMin, xMax, yMax), of the image in the
+    # mosaic's SRS, following its edges when it is in another.
+    # -------------------------------------------------------------------------
+    def _bounds(self, imageFile):
+
+        dataset = imageFile._getDataset()
+        xform = dataset.GetGeoTransform()
+        xSize = dataset.RasterXSize
+        ySize = dataset.RasterYSize
+        corners = [(0, 0), (xSize, 0), (xSize, ySize), (0, ySize)]
+        transform = None
+
+        if not imageFile.srs().IsSame(self._srs):
+
+            transform = osr.CoordinateTransformation(
+                AreaOfInterest._traditionalOrder(imageFile.srs()),
+                AreaOfInterest._traditionalOrder(self._srs))
+
+        pointsPerEdge = AreaOfInterest.POINTS_PER_EDGE if transform else 1
+        points = []
+
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+
+            for i in range(pointsPerEdge):
+
+                t = float(i) / pointsPerEdge
+
+                x, y = gdal.ApplyGeoTransform(xform,
+                                              x0 + t * (x1 - x0),
+                                              y0 + t * (y1 - y0))
+
+                if transform:
+                    x, y = transform.TransformPoint(x, y)[:2]
+
+                points.append((x, y))
+
+        xs = [x for x, y in points]
+        ys = [y for x, y in points]
+
+        return min(xs), min(ys), max(xs), max(ys)
+
+    # -------------------------------------------------------------------------
+    # geoTransform
+    # -------------------------------------------------------------------------
+    def geoTransform(self):
+
+        return self._xform
+
+    # -------------------------------------------------------------------------
+    # _openImage
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _openImage(image):
+
+        if EnviImageFile.isEnvi(image):
+            return EnviImageFile(image)
+
+        return GeospatialImageFile(image, None, None)
+
+    # -------------------------------------------------------------------------
+    # run
+    #
+    # This computes and writes every tile a scene overlaps, returning the
+    # report.
+    # -------------------------------------------------------------------------
+    def run(self):
+
+        outDs = self._outputOptions.create(self._outPath,
+                                           self._xSize,
+                                           self._ySize,
+                                           len(self._algorithmNames),
+                                           gdalconst.GDT_Float32,
+                                           sparse=True)
+
+        outDs.SetProjection(self._srs.ExportToWkt())
+        outDs.SetGeoTransform(self._xform)
+
+        for i in range(len(self._algorithmNames)):
+
+            outBand = outDs.GetRasterBand(i + 1)
+            outBand.SetNoDataValue(ApplyAlgorithm.NO_DATA_VALUE)
+            outBand.SetDescription(self._algorithmNames[i])
+
+        tiles = list(self._tiles())
+
+        workerArgs = (self._model,
+                      self._images,
+                      os.path.dirname(os.path.abspath(self._outPath)),
+                      self._algorithmNames,
+                      self._rule,
+                      self._srs.ExportToWkt(),
+                      self._xform,
+                      self._maxBlockBytes,
+                      self._precision,
+                      self._mask)
+
+        self.report = {'Scenes': len(self._images),
+                       'Tiles overlapped': len(tiles),
+                       'Tiles written': 0,
+                       'Mosaic size': (self._xSize, self._ySize)}
+
+        if self._numWorkers == 1:
+
+            _initMosaicWorker(*workerArgs)
+            self._writeTiles(outDs, map(_computeMosaicTile, tiles))
+
+        else:
+
+            pool = multiprocessing.Pool(self._numWorkers,
+                                        _initMosaicWorker,
+                                        workerArgs)
+
+            try:
+
+                self._writeTiles(outDs,
+                                 pool.imap(_computeMosaicTile, tiles))
+
+                pool.close()
+
+            finally:
+
+                pool.terminate()
+                pool.join()
+
+        self._outputOptions.finish(outDs, self._outPath)
+        outDs = None
+        self._outputOptions.removeTemporary(self._outPath)
+
+        if self._logger:
+
+            self._logger.info('Wrote ' +
+                              str(self.report['Tiles written']) +
+                              ' of ' +
+                              str(self.report['Tiles overlapped']) +
+                              ' overlapped tiles to ' +
+                              self._outPath)
+
+        return self.report
+
+    # -------------------------------------------------------------------------
+    # size
+    #
+    # This returns the size of the mosaic, as (columns, rows).
+    # -------------------------------------------------------------------------
+    def size(self):
+
+        return self._xSize, self._ySize
+
+    # -------------------------------------------------------------------------
+    # _tiles
+    #
+    # This yields ((xOff, yOff, xSize, ySize), sceneIndices) for each tile of
+    # the mosaic that scenes overlap, in row-major order, with the indices of
+    # those scenes in order.
+    # -------------------------------------------------------------------------
+    def _tiles(self):
+
+        size = self._tileSize
+
+        for yOff in range(0, self._ySize, size):
+            for xOff in range(0, self._xSize, size):
+
+                xSize = min(size, self._xSize - xOff)
+                ySize = min(size, self._ySize - yOff)
+
+                scenes = [i for i, (xMin, yMin, xMax, yMax)
+                          in enumerate(self._windows)
+                          if xMin < xOff + xSize and xMax > xOff and
+                          yMin < yOff + ySize and yMax > yOff]
+
+                if scenes:
+                    yield (xOff, yOff, xSize, ySize), scenes
+
+    # -------------------------------------------------------------------------
+    # _writeTiles
+    #
+    # This writes the computed tiles, skipping those no scene covers.
+    # -------------------------------------------------------------------------
+    def _writeTiles(self, outDs, results):
+
+        for (xOff, yOff, xSize, ySize), values in results:
+
+            if values is None:
+                continue
+
+            for i in range(len(values)):
+                outDs.GetRasterBand(i + 1).WriteArray(values[i], xOff, yOff)
+
+            self.report['Tiles written'] += 1
+
+
+# -----------------------------------------------------------------------------
+# _initMosaicWorker
+#
+# Pool functions must be defined at module level to be pickled.  Each worker
+# opens each scene once, when it first samples it.
+# -----------------------------------------------------------------------------
+_mosaicWorker = {}
+
+
+def _initMosaicWorker(model, images, outDir, algorithmNames, rule, srsWkt,
+                      xform, maxBlockBytes, precision, mask):
+
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(srsWkt)
+
+    _mosaicWorker.clear()
+    _mosaicWorker['model'] = model
+    _mosaicWorker['images'] = images
+    _mosaicWorker['outDir'] = outDir
+    _mosaicWorker['algorithmNames'] = algorithmNames
+    _mosaicWorker['rule'] = rule
+    _mosaicWorker['srs'] = srs
+    _mosaicWorker['xform'] = xform
+    _mosaicWorker['maxBlockBytes'] = maxBlockBytes
+    _mosaicWorker['precision'] = precision
+    _mosaicWorker['mask'] = mask
+    _mosaicWorker['scenes'] = {}
+
+
+# -----------------------------------------------------------------------------
+# _computeMosaicTile
+#
+# This returns (window, values) for one tile, where values is shaped
+# (algorithms, ySize, xSize), or None when no scene covers the tile.
+# -----------------------------------------------------------------------------
+def _computeMosaicTile(tile):
+
+    (xOff, yOff, xSize, ySize), sceneIndices = tile
+    rule = _mosaicWorker['rule']
+    numOutputs = len(_mosaicWorker['algorithmNames'])
+    shape = (numOutputs, ySize, xSize)
+    values = numpy.full(shape, ApplyAlgorithm.NO_DATA_VALUE, numpy.float32)
+    total = numpy.zeros(shape, numpy.float64) if rule == Mosaic.MEAN else None
+    count = numpy.zeros(shape, numpy.int64) if rule == Mosaic.MEAN else None
+    best = numpy.full(shape, -numpy.inf) if rule == Mosaic.BEST else None
+    covered = False
+
+    # The map coordinates of the cells' centers
+    xform = _mosaicWorker['xform']
+    cols, rows = numpy.meshgrid(xOff + numpy.arange(xSize) + 0.5,
+                                yOff + numpy.arange(ySize) + 0.5)
+
+    x = xform[0] + cols * xform[1] + rows * xform[2]
+    y = xform[3] + cols * xform[4] + rows * xform[5]
+
+    for sceneIndex in sceneIndices:
+
+        aa = _mosaicScene(sceneIndex)
+        dataset = aa.imageFile._getDataset()
+        sceneX, sceneY = _toSceneSrs(aa.imageFile.srs(), x, y)
+        inv = gdal.InvGeoTransform(dataset.GetGeoTransform())
+
+        sceneCols = numpy.floor(inv[0] + sceneX * inv[1] + sceneY * inv[2]). \
+            astype(numpy.int64).ravel()
+
+        sceneRows = numpy.floor(inv[3] + sceneX * inv[4] + sceneY * inv[5]). \
+            astype(numpy.int64).ravel()
+
+        inside = (sceneRows >= 0) & (sceneRows < dataset.RasterYSize) & \
+            (sceneCols >= 0) & (sceneCols < dataset.RasterXSize)
+
+        if not inside.any():
+            continue
+
+        covered = True
+
+        sample = aa.samplePixels(sceneRows,
+                                 sceneCols,
+                                 _mosaicWorker['algorithmNames']). \
+            reshape(shape)
+
+        valid = sample != ApplyAlgorithm.NO_DATA_VALUE
+
+        if rule == Mosaic.FIRST:
+
+            numpy.copyto(values,
+                         sample,
+                         where=valid &
+                         (values == ApplyAlgorithm.NO_DATA_VALUE))
+
+        elif rule == Mosaic.LAST:
+            numpy.copyto(values, sample, where=valid)
+
+        elif rule == Mosaic.MEAN:
+
+            total += numpy.where(valid, sample, 0.0)
+            count += valid
+
+        else:
+
+            # The distance of each cell's pixel from the scene's edges
+            quality = numpy.minimum(
+                numpy.minimum(sceneCols, dataset.RasterXSize - 1 - sceneCols),
+                numpy.minimum(sceneRows, dataset.RasterYSize - 1 - sceneRows))
+
+            better = valid & (quality.reshape(ySize, xSize) > best)
+            numpy.copyto(values, sample, where=better)
+            numpy.copyto(best, quality.reshape(ySize, xSize), where=better)
+
+    if rule == Mosaic.MEAN:
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+
+            values[...] = numpy.where(count > 0,
+                                      total / count,
+                                      ApplyAlgorithm.NO_DATA_VALUE)
+
+    return (xOff, yOff, xSize, ySize), values if covered else None
+
+
+# -----------------------------------------------------------------------------
+# _mosaicScene
+#
+# This returns the ApplyAlgorithm for a scene, creating it when the worker
+# first samples the scene.
+# -----------------------------------------------------------------------------
+def _mosaicScene(sceneIndex):
+
+    scenes = _mosaicWorker['scenes']
+
+    if sceneIndex not in scenes:
+
+        scenes[sceneIndex] = \
+            ApplyAlgorithm(_mosaicWorker['model'],
+                           _mosaicWorker['images'][sceneIndex],
+                           _mosaicWorker['outDir'],
+                           None,
+                           _mosaicWorker['maxBlockBytes'],
+                           precision=_mosaicWorker['precision'],
+                           mask=_mosaicWorker['mask'],
+                           checkpointSeconds=None)
+
+    return scenes[sceneIndex]
+
+
+# -----------------------------------------------------------------------------
+# _toSceneSrs
+#
+# This transforms arrays of map coordinates in the mosaic's SRS to a scene's.
+# -----------------------------------------------------------------------------
+def _toSceneSrs(sceneSrs, x, y):
+
+    if sceneSrs.IsSame(_mosaicWorker['srs']):
+        return x, y
+
+    transform = osr.CoordinateTransformation(
+        AreaOfInterest._traditionalOrder(_mosaicWorker['srs']),
+        AreaOfInterest._traditionalOrder(sceneSrs))
+
+    points = numpy.array(
+        transform.TransformPoints(numpy.column_stack((x.ravel(),
+                                                      y.ravel())).tolist()))
+
+    return points[:, 0].reshape(x.shape), points[:, 1].reshape(y.shape)
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import os
+
+import numpy
+
+
+# -----------------------------------------------------------------------------
+# class OutputStatistics
+#
+# These are the statistics of one output band, accumulated block by block as
+# it is written:  the count, minimum, maximum, mean, standard deviation and a
+# histogram of the valid values.  Accumulators of any blocks, in any order,
+# merge to the statistics of all of them, so the partial statistics of tiles
+# computed in parallel combine exactly, without a second read of the output.
+#
+# The mean and standard deviation are combined by Chan et al.'s pairwise
+# update of the sum of squared deviations.  The histogram has a fixed number
+# of buckets whose width is a power of two and whose start is a multiple of
+# it.  When values fall beyond it, the width doubles and neighboring buckets
+# are added together, so histograms of different ranges merge without
+# approximation.  A block of one value takes its width from the blocks it
+# merges with, so the histogram does not depend on how the image is split.
+#
+# stats = OutputStatistics()
+# stats.add(block, ApplyAlgorithm.NO_DATA_VALUE)
+# stats.merge(otherStats)
+# stats.writeMetadata(outBand)
+# -----------------------------------------------------------------------------
+class OutputStatistics(object):
+
+    BUCKETS = 256
+    EXTENSION = '_stats.json'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, buckets=BUCKETS):
+
+        self.buckets = buckets
+        self.pixels = 0
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.mean = 0.0
+
+        # The sum of squared deviations from the mean
+        self._m2 = 0.0
+
+        # The histogram's bucket counts, start and bucket width
+        self._counts = None
+        self._start = None
+        self._width = None
+
+    # -------------------------------------------------------------------------
+    # add
+    #
+    # This adds an array of values.  Values equal to noDataValue and values
+    # that are not finite are counted as pixels, but not as valid values.
+    # -------------------------------------------------------------------------
+    def add(self, values, noDataValue=None):
+
+        values = numpy.asarray(values).ravel()
+        valid = numpy.isfinite(values)
+
+        if noDataValue is not None:
+            valid &= values != noDataValue
+
+        block = OutputStatistics(self.buckets)
+        block.pixels = values.size
+        values = values[valid].astype(numpy.float64)
+
+        if values.size:
+
+            block.count = values.size
+            block.minimum = float(values.min())
+            block.maximum = float(values.max())
+            block.mean = float(values.mean())
+            block._m2 = float(((values - block.mean) ** 2).sum())
+
+            # A block of one value has no histogram of its own.  Its width
+            # would depend on how the image was split, so merge() chooses it
+            # from the combined range.
+            if block.maximum > block.minimum:
+
+                block._width = OutputStatistics._powerOfTwo(
+                    (block.maximum - block.minimum) / self.buckets)
+
+                block._start, block._width = \
+                    block._fit(block.minimum, block.maximum, block._width)
+
+                block._counts = numpy.bincount(
+                    ((values - block._start) // block._width).
+                    astype(numpy.int64),
+                    minlength=self.buckets)
+
+        self.merge(block)
+
+    # -------------------------------------------------------------------------
+    # _fit
+    #
+    # This returns the start and width of the histogram, of at least the
+    # given width, that covers the values from low to high.
+    # -------------------------------------------------------------------------
+    def _fit(self, low, high, width):
+
+        start = math.floor(low / width) * width
+
+        while high >= start + self.buckets * width:
+
+            width *= 2
+            start = math.floor(low / width) * width
+
+        return start, width
+
+    # -------------------------------------------------------------------------
+    # histogram
+    #
+    # This returns the histogram as (minimum, maximum, counts), where the
+    # counts are of equal buckets between the minimum and maximum, or None
+    # when there are no valid values.
+    # -------------------------------------------------------------------------
+    def histogram(self):
+
+        if not self.count:
+            return None
+
+        if self._width is None:
+
+            width = OutputStatistics._powerOfTwo(
+                abs(self.minimum) / 2 ** 20 or 1.0)
+
+            start = math.floor(self.minimum / width) * width
+
+            return start, \
+                start + self.buckets * width, \
+                [int(c) for c in self._rebinned(start, width)]
+
+        return self._start, \
+            self._start + self.buckets * self._width, \
+            [int(c) for c in self._counts]
+
+    # -------------------------------------------------------------------------
+    # merge
+    #
+    # This adds the statistics of other values, with the same number of
+    # buckets.
+    # -------------------------------------------------------------------------
+    def merge(self, other):
+
+        if other.buckets != self.buckets:
+
+            raise RuntimeError('Statistics with different numbers of ' +
+                               'buckets cannot be merged.')
+
+        self.pixels += other.pixels
+
+        if not other.count:
+            return
+
+        if not self.count:
+
+            self.count = other.count
+            self.minimum = other.minimum
+            self.maximum = other.maximum
+            self.mean = other.mean
+            self._m2 = other._m2
+            self._counts = None if other._counts is None \
+                else other._counts.copy()
+
+            self._start = other._start
+            self._width = other._width
+            return
+
+        # The histograms are rebinned before the count, minimum and maximum
+        # they are drawn from change.
+        minimum = min(self.minimum, other.minimum)
+        maximum = max(self.maximum, other.maximum)
+
+        if maximum > minimum:
+
+            widths = [w for w in (self._width, other._width)
+                      if w is not None]
+
+            start, width = self._fit(
+                minimum,
+                maximum,
+                max(widths) if widths else OutputStatistics._powerOfTwo(
+                    (maximum - minimum) / self.buckets))
+
+            self._counts = self._rebinned(start, width) + \
+                other._rebinned(start, width)
+
+            self._start = start
+            self._width = width
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+
+        self._m2 += other._m2 + \
+            delta * delta * self.count * other.count / count
+
+        self.mean += delta * other.count / count
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+
+    # -------------------------------------------------------------------------
+    # _powerOfTwo
+    #
+    # This returns the smallest power of two that is at least x, which must
+    # be positive.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _powerOfTwo(x):
+
+        mantissa, exponent = math.frexp(x)
+
+        return math.ldexp(1.0, exponent if mantissa > 0.5 else exponent - 1)
+
+    # -------------------------------------------------------------------------
+    # _rebinned
+    #
+    # This returns the histogram's counts in buckets of a wider or equal
+    # width, a power of two, from start, a multiple of it.  Each bucket falls
+    # entirely in one of the new ones.  Empty buckets beyond the maximum may
+    # fall beyond the new histogram, so only those with counts are moved.
+    # Without a histogram, all the values, equal, fall in one bucket.
+    # -------------------------------------------------------------------------
+    def _rebinned(self, start, width):
+
+        if self._width is None:
+
+            index = int(math.floor((self.minimum - start) / width))
+            counts = numpy.zeros(self.buckets, numpy.int64)
+            counts[index] = self.count
+            return counts
+
+        filled = numpy.flatnonzero(self._counts)
+        bucketStarts = self._start + filled * self._width
+
+        index = numpy.floor((bucketStarts - start) / width). \
+            astype(numpy.int64)
+
+        return numpy.bincount(index,
+                              weights=self._counts[filled],
+                              minlength=self.buckets). \
+            astype(numpy.int64)
+
+    # -------------------------------------------------------------------------
+    # stddev
+    #
+    # This is the population standard deviation, as GDAL computes it.
+    # -------------------------------------------------------------------------
+    def stddev(self):
+
+        return math.sqrt(self._m2 / self.count) if self.count else None
+
+    # -------------------------------------------------------------------------
+    # summary
+    #
+    # This returns the statistics as a dictionary that can be written as
+    # JSON.
+    # -------------------------------------------------------------------------
+    def summary(self):
+
+        summary = {'pixels': self.pixels,
+                   'count': self.count,
+                   'minimum': self.minimum,
+                   'maximum': self.maximum,
+                   'mean': self.mean if self.count else None,
+                   'stddev': self.stddev(),
+                   'histogram': None}
+
+        if self.count:
+
+            low, high, counts = self.histogram()
+
+            summary['histogram'] = {'minimum': low,
+                                    'maximum': high,
+                                    'counts': counts}
+
+        return summary
+
+    # -------------------------------------------------------------------------
+    # write
+    #
+    # This writes the summaries of statistics, by band name, to a JSON file.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def write(path, statistics):
+
+        tempPath = path + '.tmp'
+
+        with open(tempPath, 'w') as f:
+
+            json.dump(dict((name, statistics[name].summary())
+                           for name in statistics),
+                      f,
+                      indent=2,
+                      sort_keys=True)
+
+        os.rename(tempPath, path)
+
+    # -------------------------------------------------------------------------
+    # writeMetadata
+    #
+    # This records the statistics in a band's metadata, where gdalinfo and
+    # GDAL's GetStatistics() and GetDefaultHistogram() find them.
+    # -------------------------------------------------------------------------
+    def writeMetadata(self, band):
+
+        if not self.count:
+            return
+
+        band.SetStatistics(self.minimum,
+                           self.maximum,
+                           self.mean,
+                           self.stddev())
+
+        band.SetMetadataItem('STATISTICS_VALID_PERCENT',
+                             repr(100.0 * self.count / self.pixels))
+
+        band.SetDefaultHistogram(*self.histogram())
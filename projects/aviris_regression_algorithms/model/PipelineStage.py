@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+
+except ImportError:
+    import queue
+
+
+# -----------------------------------------------------------------------------
+# class PipelineStage
+#
+# This runs one stage of a block loop in a background thread, joined to the
+# caller's thread by a queue of at most depth items, so the stages overlap
+# while no more than depth blocks wait between them.
+#
+# As a reader, the thread iterates over items, like a generator reading
+# blocks, ahead of the caller, which takes them from read().  As a writer,
+# the thread calls a function with each item the caller put()s, until
+# finish().  An exception in the thread is raised again in the caller.
+#
+# The seconds each side spends blocked, the thread on a full or empty queue
+# and the caller on an empty or full one, are kept in threadStall and
+# callerStall.
+#
+# reader = PipelineStage(2)
+#
+# writer = PipelineStage(2)
+# writer.write(writeBlock, outBand)
+#
+# for window, stack in reader.read(readBlocks()):
+#     writer.put(window, compute(stack))
+#
+# writer.finish()
+# -----------------------------------------------------------------------------
+class PipelineStage(object):
+
+    # A blocked side checks this often whether the other has stopped.
+    POLL_SECONDS = 0.1
+
+    # This follows the last item.
+    _END = object()
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, depth):
+
+        if depth < 1:
+            raise RuntimeError('The queue depth must be at least one.')
+
+        self._queue = queue.Queue(depth)
+        self._stopped = threading.Event()
+        self._error = None
+        self._thread = None
+        self.threadStall = 0.0
+        self.callerStall = 0.0
+
+    # -------------------------------------------------------------------------
+    # finish
+    #
+    # This waits for a writer to drain the queue and raises any exception it
+    # had.
+    # -------------------------------------------------------------------------
+    def finish(self):
+
+        self._put(PipelineStage._END, False)
+        self._thread.join()
+        self._raiseError()
+
+    # -------------------------------------------------------------------------
+    # _get
+    #
+    # This returns the next item and the seconds spent waiting for it, or
+    # _END once the other side has stopped.
+    # -------------------------------------------------------------------------
+    def _get(self):
+
+        if not self._isRunning(False):
+            return PipelineStage._END, 0.0
+
+        try:
+            return self._queue.get_nowait(), 0.0
+
+        except queue.Empty:
+            pass
+
+        startTime = time.time()
+
+        while self._isRunning(False):
+
+            try:
+
+                item = self._queue.get(timeout=PipelineStage.POLL_SECONDS)
+                return item, time.time() - startTime
+
+            except queue.Empty:
+                pass
+
+        return PipelineStage._END, time.time() - startTime
+
+    # -------------------------------------------------------------------------
+    # _isRunning
+    #
+    # This returns whether the thread, or else the caller, is still running.
+    # -------------------------------------------------------------------------
+    def _isRunning(self, thread):
+
+        if thread:
+            return self._thread.is_alive()
+
+        return not self._stopped.is_set()
+
+    # -------------------------------------------------------------------------
+    # put
+    #
+    # This gives the writer an item, as the arguments of its function.
+    # -------------------------------------------------------------------------
+    def put(self, *item):
+
+        self._raiseError()
+        self.callerStall += self._put(item, False)
+        self._raiseError()
+
+    # -------------------------------------------------------------------------
+    # _put
+    #
+    # This queues an item and returns the seconds spent waiting for room.  It
+    # gives up when the caller has stopped or, in the caller, when the writer
+    # has.
+    # -------------------------------------------------------------------------
+    def _put(self, item, inThread):
+
+        try:
+
+            self._queue.put_nowait(item)
+            return 0.0
+
+        except queue.Full:
+            pass
+
+        startTime = time.time()
+
+        while self._isRunning(not inThread):
+
+            try:
+
+                self._queue.put(item, timeout=PipelineStage.POLL_SECONDS)
+                break
+
+            except queue.Full:
+                pass
+
+        return time.time() - startTime
+
+    # -------------------------------------------------------------------------
+    # _raiseError
+    # -------------------------------------------------------------------------
+    def _raiseError(self):
+
+        if self._error:
+            raise self._error[1]
+
+    # -------------------------------------------------------------------------
+    # read
+    #
+    # This yields the items, iterated over by the thread ahead of the
+    # caller.  Closing the generator early stops the thread.
+    # -------------------------------------------------------------------------
+    def read(self, items):
+
+        self._start(self._readItems, items)
+
+        try:
+
+            while True:
+
+                item, seconds = self._get()
+                self.callerStall += seconds
+
+                if item is PipelineStage._END:
+                    break
+
+                yield item
+
+            self._thread.join()
+            self._raiseError()
+
+        finally:
+            self.stop()
+
+    # -------------------------------------------------------------------------
+    # _readItems
+    # -------------------------------------------------------------------------
+    def _readItems(self, items):
+
+        try:
+
+            for item in items:
+
+                self.threadStall += self._put(item, True)
+
+                if self._stopped.is_set():
+                    break
+
+        except BaseException:
+            self._error = sys.exc_info()
+
+        self._put(PipelineStage._END, True)
+
+    # -------------------------------------------------------------------------
+    # _start
+    # -------------------------------------------------------------------------
+    def _start(self, target, *args):
+
+        self._thread = threading.Thread(target=target, args=args)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # -------------------------------------------------------------------------
+    # stop
+    #
+    # This stops the thread, abandoning the items queued, and waits for it.
+    # -------------------------------------------------------------------------
+    def stop(self):
+
+        self._stopped.set()
+
+        if self._thread:
+            self._thread.join()
+
+    # -------------------------------------------------------------------------
+    # write
+    #
+    # This starts the thread writing the items put(), by calling function
+    # with each of them, followed by args.
+    # -------------------------------------------------------------------------
+    def write(self, function, *args):
+
+        self._start(self._writeItems, function, args)
+
+    # -------------------------------------------------------------------------
+    # _writeItems
+    # -------------------------------------------------------------------------
+    def _writeItems(self, function, args):
+
+        try:
+
+            while True:
+
+                item, seconds = self._get()
+                self.threadStall += seconds
+
+                if item is PipelineStage._END:
+                    break
+
+                function(*(item + args))
+
+        except BaseException:
+
+            self._error = sys.exc_info()
+            self._stopped.set()
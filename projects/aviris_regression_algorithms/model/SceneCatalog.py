@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+
+from osgeo import gdal
+from osgeo import ogr
+from osgeo import osr
+
+from model.EnviImageFile import EnviImageFile
+from model.Envelope import Envelope
+
+from projects.aviris_regression_algorithms.model.AreaOfInterest \
+    import AreaOfInterest
+
+
+# -----------------------------------------------------------------------------
+# class SceneCatalog
+#
+# This is a SQLite catalog of ENVI scenes, like the AVIRIS-NG flight lines of
+# the ABoVE archive, so the scenes covering a site are found without opening
+# every image.  Each scene's footprint, SRS, dimensions, band count,
+# interleave and modification time are kept, and its extent in geographic
+# coordinates is indexed in an R*Tree.
+#
+# refresh() reads only scenes that are new or changed since they were
+# catalogued, and drops those whose images are gone.  query() returns the
+# scenes whose footprints intersect an Envelope or polygon, in any SRS, among
+# all of them or the paths given.  The R*Tree finds the scenes whose extents
+# intersect it, then their footprints are tested, as the extent of a rotated
+# flight line covers much more than the line.
+#
+# catalog = SceneCatalog('/att/nobackup/rlgill/AVIRIS/scenes.db')
+# catalog.refresh(AvirisBatch.findImages('/att/pubrepo/.../*_rdn_*/*_img'))
+# images = [scene['path'] for scene in catalog.query(envelope)]
+# -----------------------------------------------------------------------------
+class SceneCatalog(object):
+
+    # Edges are followed with this many points each when reprojected to
+    # geographic coordinates, as a straight edge in UTM curves in them.
+    POINTS_PER_EDGE = AreaOfInterest.POINTS_PER_EDGE
+
+    # Fields of each scene returned by query() and scenes()
+    FIELDS = ['path',
+              'mtime',
+              'samples',
+              'lines',
+              'bands',
+              'interleave',
+              'srs',
+              'footprint',
+              'west',
+              'south',
+              'east',
+              'north']
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # The catalog is created at path if it does not exist.
+    # -------------------------------------------------------------------------
+    def __init__(self, path):
+
+        self._connection = sqlite3.connect(path)
+
+        self._connection.executescript(
+            'CREATE TABLE IF NOT EXISTS scenes (' +
+            'id INTEGER PRIMARY KEY, ' +
+            'path TEXT UNIQUE NOT NULL, ' +
+            'mtime REAL NOT NULL, ' +
+            'samples INTEGER, ' +
+            'lines INTEGER, ' +
+            'bands INTEGER, ' +
+            'interleave TEXT, ' +
+            'srs TEXT, ' +
+            'footprint TEXT);' +
+            'CREATE VIRTUAL TABLE IF NOT EXISTS extents USING rtree(' +
+            'id, west, east, south, north);')
+
+        self._geographic = osr.SpatialReference()
+        self._geographic.ImportFromEPSG(4326)
+
+        self._geographic = \
+            AreaOfInterest._traditionalOrder(self._geographic)
+
+    # -------------------------------------------------------------------------
+    # _addScene
+    #
+    # This reads an image's header and geolocation and records it, replacing
+    # any earlier record of it.
+    # -------------------------------------------------------------------------
+    def _addScene(self, path, mtime):
+
+        imageFile = EnviImageFile(path)
+        dataset = imageFile._getDataset()
+        xform = dataset.GetGeoTransform()
+        xSize = dataset.RasterXSize
+        ySize = dataset.RasterYSize
+        corners = [(0, 0), (xSize, 0), (xSize, ySize), (0, ySize)]
+
+        footprint = 'POLYGON ((' + \
+            ', '.join('%r %r' % gdal.ApplyGeoTransform(xform, x, y)
+                      for x, y in corners + corners[:1]) + \
+            '))'
+
+        srs = imageFile.srs()
+        west, south, east, north = self._extent(corners, srs, xform)
+        self._removeScene(path)
+
+        cursor = self._connection.execute(
+            'INSERT INTO scenes (path, mtime, samples, lines, bands, ' +
+            'interleave, srs, footprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (path,
+             mtime,
+             imageFile.numSamples(),
+             imageFile.numLines(),
+             imageFile.numBands(),
+             imageFile.interleave(),
+             srs.ExportToWkt(),
+             footprint))
+
+        self._connection.execute(
+            'INSERT INTO extents VALUES (?, ?, ?, ?, ?)',
+            (cursor.lastrowid, west, east, south, north))
+
+    # -------------------------------------------------------------------------
+    # close
+    # -------------------------------------------------------------------------
+    def close(self):
+
+        self._connection.close()
+
+    # -------------------------------------------------------------------------
+    # _extent
+    #
+    # This returns the geographic extent, (west, south, east, north), of the
+    # polygon with the given corners, in srs.  Given the geotransform of an
+    # image, the corners are in its pixel coordinates.  Without an SRS, the
+    # corners are taken to be geographic.
+    # -------------------------------------------------------------------------
+    def _extent(self, corners, srs, xform=None):
+
+        transform = None
+
+        if srs and srs.ExportToWkt() and not srs.IsSame(self._geographic):
+
+            transform = osr.CoordinateTransformation(
+                AreaOfInterest._traditionalOrder(srs),
+                self._geographic)
+
+        pointsPerEdge = SceneCatalog.POINTS_PER_EDGE if transform else 1
+        points = []
+
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+
+            for i in range(pointsPerEdge):
+
+                t = float(i) / pointsPerEdge
+                x = x0 + t * (x1 - x0)
+                y = y0 + t * (y1 - y0)
+
+                if xform:
+                    x, y = gdal.ApplyGeoTransform(xform, x, y)
+
+                if transform:
+                    x, y = transform.TransformPoint(x, y)[:2]
+
+                points.append((x, y))
+
+        longitudes = [x for x, y in points]
+        latitudes = [y for x, y in points]
+
+        return min(longitudes), min(latitudes), max(longitudes), max(latitudes)
+
+    # -------------------------------------------------------------------------
+    # _footprintIntersects
+    #
+    # This tests whether a scene's footprint, reprojected to srs, intersects
+    # an OGR polygon in it.  Without an SRS, the polygon is geographic.
+    # -------------------------------------------------------------------------
+    def _footprintIntersects(self, scene, polygon, srs):
+
+        querySrs = AreaOfInterest._traditionalOrder(srs) \
+            if srs and srs.ExportToWkt() else self._geographic
+
+        transform = None
+
+        if scene['srs']:
+
+            sceneSrs = osr.SpatialReference()
+            sceneSrs.ImportFromWkt(scene['srs'])
+
+            if not sceneSrs.IsSame(querySrs):
+
+                transform = osr.CoordinateTransformation(
+                    AreaOfInterest._traditionalOrder(sceneSrs),
+                    querySrs)
+
+        footprint = ogr.CreateGeometryFromWkt(scene['footprint'])
+        ring = footprint.GetGeometryRef(0)
+
+        corners = [ring.GetPoint(i)[:2]
+                   for i in range(ring.GetPointCount() - 1)]
+
+        pointsPerEdge = SceneCatalog.POINTS_PER_EDGE if transform else 1
+        points = []
+
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+
+            for i in range(pointsPerEdge):
+
+                t = float(i) / pointsPerEdge
+                x = x0 + t * (x1 - x0)
+                y = y0 + t * (y1 - y0)
+
+                if transform:
+                    x, y = transform.TransformPoint(x, y)[:2]
+
+                points.append((x, y))
+
+        return SceneCatalog._polygon(points).Intersects(polygon)
+
+    # -------------------------------------------------------------------------
+    # _modificationTime
+    #
+    # This returns the later of the image's and its header's modification
+    # times, or None when the image is gone.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _modificationTime(path):
+
+        hdrFile = EnviImageFile.headerName(path)
+
+        if not os.path.exists(path) or not hdrFile:
+            return None
+
+        return max(os.path.getmtime(path), os.path.getmtime(hdrFile))
+
+    # -------------------------------------------------------------------------
+    # _polygon
+    #
+    # This returns an OGR polygon of one ring of (x, y).
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _polygon(points):
+
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+
+        for x, y in list(points) + list(points[:1]):
+            ring.AddPoint_2D(x, y)
+
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+        polygon.AddGeometry(ring)
+
+        return polygon
+
+    # -------------------------------------------------------------------------
+    # query
+    #
+    # This returns the scenes whose footprints intersect the geometry, sorted
+    # by path.  The geometry is an Envelope or an OGR polygon.  Without a
+    # spatial reference, it is taken to be geographic, longitude first.
+    # Given paths, like the images of a batch, only those scenes are
+    # returned, not others catalogued earlier.
+    # -------------------------------------------------------------------------
+    def query(self, geometry, paths=None):
+
+        xMin, xMax, yMin, yMax = geometry.GetEnvelope()
+
+        west, south, east, north = self._extent(
+            [(xMin, yMin), (xMax, yMin), (xMax, yMax), (xMin, yMax)],
+            geometry.GetSpatialReference())
+
+        rows = self._connection.execute(
+            'SELECT ' + ', '.join(SceneCatalog.FIELDS) + ' FROM scenes ' +
+            'JOIN extents ON scenes.id = extents.id ' +
+            'WHERE west <= ? AND east >= ? AND south <= ? AND north >= ? ' +
+            'ORDER BY path',
+            (east, west, north, south))
+
+        if paths is not None:
+            paths = set(paths)
+
+        scenes = [dict(zip(SceneCatalog.FIELDS, row)) for row in rows
+                  if paths is None or row[0] in paths]
+
+        # An Envelope is a multipoint of its corners.
+        polygon = geometry
+
+        if isinstance(geometry, Envelope):
+
+            polygon = SceneCatalog._polygon(
+                AreaOfInterest._mapRings(geometry)[0])
+
+        srs = geometry.GetSpatialReference()
+
+        return [scene for scene in scenes
+                if self._footprintIntersects(scene, polygon, srs)]
+
+    # -------------------------------------------------------------------------
+    # refresh
+    #
+    # This catalogs the images that are new or changed since they were last
+    # catalogued and removes scenes whose images no longer exist.  Images
+    # that cannot be read are logged and left out.  This returns the number
+    # of scenes added, updated, removed, unchanged and failed, by those
+    # names.
+    # -------------------------------------------------------------------------
+    def refresh(self, images, logger=None):
+
+        counts = {'added': 0,
+                  'updated': 0,
+                  'removed': 0,
+                  'unchanged': 0,
+                  'failed': 0}
+
+        catalogued = dict(self._connection.execute(
+            'SELECT path, mtime FROM scenes'))
+
+        with self._connection:
+
+            for path in catalogued:
+
+                if SceneCatalog._modificationTime(path) is None:
+
+                    self._removeScene(path)
+                    counts['removed'] += 1
+
+            for path in images:
+
+                mtime = SceneCatalog._modificationTime(path)
+
+                if mtime is None:
+
+                    counts['failed'] += 1
+                    continue
+
+                if catalogued.get(path) == mtime:
+
+                    counts['unchanged'] += 1
+                    continue
+
+                try:
+                    self._addScene(path, mtime)
+
+                except Exception as e:
+
+                    if logger:
+                        logger.warning('Unable to catalog ' + path + ': ' +
+                                       str(e))
+
+                    counts['failed'] += 1
+                    continue
+
+                counts['updated' if path in catalogued else 'added'] += 1
+
+        return counts
+
+    # -------------------------------------------------------------------------
+    # _removeScene
+    # -------------------------------------------------------------------------
+    def _removeScene(self, path):
+
+        for row in self._connection.execute(
+                'SELECT id FROM scenes WHERE path = ?', (path,)).fetchall():
+
+            self._connection.execute('DELETE FROM extents WHERE id = ?', row)
+            self._connection.execute('DELETE FROM scenes WHERE id = ?', row)
+
+    # -------------------------------------------------------------------------
+    # scenes
+    #
+    # This returns every scene, sorted by path.
+    # -------------------------------------------------------------------------
+    def scenes(self):
+
+        rows = self._connection.execute(
+            'SELECT ' + ', '.join(SceneCatalog.FIELDS) + ' FROM scenes ' +
+            'JOIN extents ON scenes.id = extents.id ORDER BY path')
+
+        return [dict(zip(SceneCatalog.FIELDS, row)) for row in rows]
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+
+import numpy
+
+from model.EnviImageFile import EnviImageFile
+
+
+# -----------------------------------------------------------------------------
+# class SceneLayers
+#
+# These are the per-pixel layers of a scene that every algorithm shares:  the
+# no-data and mask flags, bit-packed, and the divisor, the L2 norm of the
+# divisor bands.  They are kept in layerDir, as .npy files named for the
+# image, the mask and the divisor bands, so later runs with other
+# coefficients read them instead of the no-data, mask and divisor bands.
+#
+# The flags are one file, shaped (2, rows, bytes per row):  no-data, then
+# mask, with eight pixels to a byte.  The divisor is one file, shaped (rows,
+# cols), in the precision it was computed in.  Layers are valid while they
+# are newer than the image and its header.
+#
+# Layers are written block by block, to temporary files renamed into place
+# by finish(), so an interrupted run leaves none.
+# -----------------------------------------------------------------------------
+class SceneLayers(object):
+
+    EXTENSION = '.npy'
+    TEMP_EXTENSION = '.tmp.npy'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # The mask key identifies the mask, like its fingerprint.  divisorBands
+    # are the 1-based bands of the divisor, or None for no divisor layer.
+    # -------------------------------------------------------------------------
+    def __init__(self,
+                 layerDir,
+                 imageFile,
+                 maskKey,
+                 divisorBands=None,
+                 precision='float64'):
+
+        if not os.path.isdir(layerDir):
+
+            raise RuntimeError(str(layerDir) +
+                               ' is not an existing directory.')
+
+        baseName = os.path.splitext(os.path.basename(imageFile.fileName()))[0]
+        maskDigest = hashlib.sha1(str(maskKey).encode('utf-8')).hexdigest()
+
+        self._flagsPath = os.path.join(layerDir,
+                                       baseName +
+                                       '_mask_' +
+                                       maskDigest[:12] +
+                                       SceneLayers.EXTENSION)
+
+        self._divisorPath = None
+        self._precision = precision
+
+        if divisorBands is not None:
+
+            divisorDigest = hashlib.sha1(
+                numpy.asarray(divisorBands, numpy.int64).tobytes() +
+                precision.encode('utf-8')).hexdigest()
+
+            self._divisorPath = os.path.join(layerDir,
+                                             baseName +
+                                             '_divisor_' +
+                                             divisorDigest[:12] +
+                                             SceneLayers.EXTENSION)
+
+        dataset = imageFile._getDataset()
+        self._xSize = dataset.RasterXSize
+        self._ySize = dataset.RasterYSize
+        self._inputs = [imageFile.fileName()]
+        hdrFile = EnviImageFile.headerName(imageFile.fileName())
+
+        if hdrFile:
+            self._inputs.append(hdrFile)
+
+        # Open arrays, by layer
+        self._arrays = {}
+
+    # -------------------------------------------------------------------------
+    # abandon
+    #
+    # This removes the layers being written.
+    # -------------------------------------------------------------------------
+    def abandon(self):
+
+        self._arrays = {}
+
+        for path in self.paths():
+
+            if os.path.exists(path + SceneLayers.TEMP_EXTENSION):
+                os.remove(path + SceneLayers.TEMP_EXTENSION)
+
+    # -------------------------------------------------------------------------
+    # create
+    #
+    # This starts writing the layers.  Call write() for every pixel, then
+    # finish().
+    # -------------------------------------------------------------------------
+    def create(self):
+
+        self._arrays = {}
+        bytesPerRow = -(-self._xSize // 8)
+
+        self._arrays['flags'] = numpy.lib.format.open_memmap(
+            self._flagsPath + SceneLayers.TEMP_EXTENSION,
+            'w+',
+            numpy.uint8,
+            (2, self._ySize, bytesPerRow))
+
+        if self._divisorPath:
+
+            self._arrays['divisor'] = numpy.lib.format.open_memmap(
+                self._divisorPath + SceneLayers.TEMP_EXTENSION,
+                'w+',
+                self._precision,
+                (self._ySize, self._xSize))
+
+    # -------------------------------------------------------------------------
+    # exists
+    # -------------------------------------------------------------------------
+    def exists(self):
+
+        inputTime = max(os.path.getmtime(i) for i in self._inputs)
+
+        for path in self.paths():
+
+            if not os.path.exists(path) or os.path.getmtime(path) < inputTime:
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    # finish
+    # -------------------------------------------------------------------------
+    def finish(self):
+
+        for array in self._arrays.values():
+            array.flush()
+
+        self._arrays = {}
+
+        for path in self.paths():
+            os.rename(path + SceneLayers.TEMP_EXTENSION, path)
+
+    # -------------------------------------------------------------------------
+    # paths
+    # -------------------------------------------------------------------------
+    def paths(self):
+
+        return [self._flagsPath] + \
+            ([self._divisorPath] if self._divisorPath else [])
+
+    # -------------------------------------------------------------------------
+    # read
+    #
+    # This returns the no-data, mask and divisor arrays of a window, shaped
+    # (ySize, xSize).  Without a divisor layer, the divisor is None.
+    # -------------------------------------------------------------------------
+    def read(self, xOff, yOff, xSize, ySize):
+
+        if 'flags' not in self._arrays:
+
+            self._arrays['flags'] = numpy.load(self._flagsPath, 'r')
+
+            if self._divisorPath:
+
+                self._arrays['divisor'] = \
+                    numpy.load(self._divisorPath, 'r')
+
+        firstByte = xOff // 8
+
+        bits = numpy.unpackbits(
+            self._arrays['flags'][:,
+                                  yOff:yOff + ySize,
+                                  firstByte:-(-(xOff + xSize) // 8)],
+            axis=2)
+
+        firstBit = xOff - firstByte * 8
+        noData = bits[0, :, firstBit:firstBit + xSize].view(numpy.bool_)
+        masked = bits[1, :, firstBit:firstBit + xSize].view(numpy.bool_)
+        divisor = None
+
+        if self._divisorPath:
+
+            divisor = self._arrays['divisor'][yOff:yOff + ySize,
+                                              xOff:xOff + xSize]
+
+        return noData, masked, divisor
+
+    # -------------------------------------------------------------------------
+    # write
+    #
+    # This writes the layers of a window, each shaped (ySize, xSize).
+    # -------------------------------------------------------------------------
+    def write(self, xOff, yOff, noData, masked, divisor):
+
+        ySize, xSize = noData.shape
+        flags = self._arrays['flags']
+        firstByte = xOff // 8
+        lastByte = -(-(xOff + xSize) // 8)
+        firstBit = xOff - firstByte * 8
+        window = (slice(None), slice(yOff, yOff + ySize),
+                  slice(firstByte, lastByte))
+
+        # Pixels sharing a byte with another window keep their bits.
+        bits = numpy.unpackbits(flags[window], axis=2)
+        bits[0, :, firstBit:firstBit + xSize] = noData
+        bits[1, :, firstBit:firstBit + xSize] = masked
+        flags[window] = numpy.packbits(bits, axis=2)
+
+        if self._divisorPath:
+
+            self._arrays['divisor'][yOff:yOff + ySize,
+                                    xOff:xOff + xSize] = divisor
+
+    # -------------------------------------------------------------------------
+    # __getstate__
+    #
+    # Open arrays are not sent to other processes.
+    # -------------------------------------------------------------------------
+    def __getstate__(self):
+
+        state = dict(self.__dict__)
+        state['_arrays'] = {}
+
+        return state
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+
+# -----------------------------------------------------------------------------
+# class TileJournal
+#
+# This records the progress of a run through its blocks, so an interrupted
+# run can continue where it stopped.  The journal is a text file.  Its first
+# line is a JSON header describing the run, like the image, the algorithms
+# and the block windows.  Each later line is the index of a block through
+# which every block is written and flushed to the outputs.
+#
+# A journal is valid for a run only when its header matches the run's.
+#
+# journal = TileJournal(outPath + TileJournal.EXTENSION, header)
+# firstBlock = journal.start()
+# ...
+# journal.record(blockIndex)
+# ...
+# journal.remove()
+# -----------------------------------------------------------------------------
+class TileJournal(object):
+
+    EXTENSION = '.journal'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # The header must be a dictionary that can be written as JSON.
+    # -------------------------------------------------------------------------
+    def __init__(self, path, header):
+
+        self._path = path
+
+        # Round trip the header, so tuples compare equal to lists.
+        self._header = json.loads(json.dumps(header, sort_keys=True))
+
+    # -------------------------------------------------------------------------
+    # completed
+    #
+    # This returns the number of blocks an existing, valid journal records as
+    # complete, or 0.
+    # -------------------------------------------------------------------------
+    def completed(self):
+
+        if not os.path.exists(self._path):
+            return 0
+
+        with open(self._path) as f:
+            lines = f.read().split('\n')
+
+        try:
+
+            if json.loads(lines[0]) != self._header:
+                return 0
+
+        except ValueError:
+
+            return 0
+
+        # An interrupted write can leave a partial last line, without its
+        # newline.
+        completed = 0
+
+        for line in lines[1:-1]:
+
+            if line.strip().isdigit():
+                completed = max(completed, int(line) + 1)
+
+        return completed
+
+    # -------------------------------------------------------------------------
+    # path
+    # -------------------------------------------------------------------------
+    def path(self):
+
+        return self._path
+
+    # -------------------------------------------------------------------------
+    # record
+    #
+    # Call this only after the outputs through blockIndex are flushed.
+    # -------------------------------------------------------------------------
+    def record(self, blockIndex):
+
+        with open(self._path, 'a') as f:
+            f.write(str(blockIndex) + '\n')
+
+    # -------------------------------------------------------------------------
+    # remove
+    # -------------------------------------------------------------------------
+    def remove(self):
+
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    # -------------------------------------------------------------------------
+    # start
+    #
+    # This returns the index of the first block to compute.  When the journal
+    # is not valid for this run, it is started over, and that is 0.
+    # -------------------------------------------------------------------------
+    def start(self):
+
+        completed = self.completed()
+
+        if not completed:
+
+            with open(self._path, 'w') as f:
+                f.write(json.dumps(self._header, sort_keys=True) + '\n')
+
+        return completed
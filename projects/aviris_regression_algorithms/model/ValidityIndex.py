@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy
+
+from model.EnviImageFile import EnviImageFile
+
+
+# -----------------------------------------------------------------------------
+# class ValidityIndex
+#
+# This counts the valid pixels of an image in each square cell of cellSize
+# pixels, from one band, where invalid pixels are noDataValue.  AVIRIS flight
+# lines are rotated strips, so much of a scene is fill, and a block whose
+# cells have no valid pixels can be written as no-data without reading it.
+#
+# Building the index reads the one band.  In BIL and BIP, that pages in the
+# whole image, so the index is saved and reused while it is newer than the
+# image.
+#
+# index = ValidityIndex.read(path, imageFile)
+#
+# if not index:
+#
+#     index = ValidityIndex.build(imageFile, 1, -9999.0)
+#     index.write(path)
+# -----------------------------------------------------------------------------
+class ValidityIndex(object):
+
+    CELL_SIZE = 64
+    EXTENSION = '_validity.npz'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    #
+    # counts is shaped (cell rows, cell columns).
+    # -------------------------------------------------------------------------
+    def __init__(self, counts, cellSize, xSize, ySize):
+
+        self.counts = counts
+        self.cellSize = cellSize
+        self.xSize = xSize
+        self.ySize = ySize
+
+    # -------------------------------------------------------------------------
+    # build
+    #
+    # The band is 1-based.  The image is read a row of cells at a time.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def build(imageFile, band, noDataValue, cellSize=CELL_SIZE):
+
+        dataset = imageFile._getDataset()
+        xSize = dataset.RasterXSize
+        ySize = dataset.RasterYSize
+        cellCols = -(-xSize // cellSize)
+        cellRows = -(-ySize // cellSize)
+        counts = numpy.zeros((cellRows, cellCols), numpy.int64)
+
+        # Rows of cells are padded to whole cells with invalid pixels.
+        valid = numpy.zeros((cellSize, cellCols * cellSize), numpy.bool_)
+
+        for cellRow in range(cellRows):
+
+            yOff = cellRow * cellSize
+            rows = min(cellSize, ySize - yOff)
+
+            strip = imageFile.readWindow(0,
+                                         yOff,
+                                         xSize,
+                                         rows,
+                                         numpy.array([band - 1]))
+
+            valid.fill(False)
+            numpy.not_equal(strip[0], noDataValue, valid[:rows, :xSize])
+
+            counts[cellRow] = valid.reshape(cellSize,
+                                            cellCols,
+                                            cellSize).sum(axis=(0, 2))
+
+        return ValidityIndex(counts, cellSize, xSize, ySize)
+
+    # -------------------------------------------------------------------------
+    # isEmpty
+    #
+    # This returns True when no pixel of the window is valid.  A window
+    # partly covering a cell with valid pixels is not empty.
+    # -------------------------------------------------------------------------
+    def isEmpty(self, xOff, yOff, xSize, ySize):
+
+        cells = self.counts[yOff // self.cellSize:
+                            -(-(yOff + ySize) // self.cellSize),
+                            xOff // self.cellSize:
+                            -(-(xOff + xSize) // self.cellSize)]
+
+        return not cells.any()
+
+    # -------------------------------------------------------------------------
+    # read
+    #
+    # This returns the index saved at path, or None unless it exists, is
+    # newer than the image and its header, and is of the image's size.
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def read(path, imageFile):
+
+        if not os.path.exists(path):
+            return None
+
+        inputs = [imageFile.fileName()]
+        hdrFile = EnviImageFile.headerName(imageFile.fileName())
+
+        if hdrFile:
+            inputs.append(hdrFile)
+
+        if os.path.getmtime(path) < max(os.path.getmtime(i) for i in inputs):
+            return None
+
+        dataset = imageFile._getDataset()
+
+        with numpy.load(path) as saved:
+
+            if int(saved['xSize']) != dataset.RasterXSize or \
+               int(saved['ySize']) != dataset.RasterYSize:
+
+                return None
+
+            return ValidityIndex(saved['counts'],
+                                 int(saved['cellSize']),
+                                 int(saved['xSize']),
+                                 int(saved['ySize']))
+
+    # -------------------------------------------------------------------------
+    # splitColumns
+    #
+    # This splits a window at cell boundaries into runs of columns that are
+    # either empty or not, returning their windows in order.  A strip across
+    # a rotated flight line becomes its empty ends and the valid middle.
+    # -------------------------------------------------------------------------
+    def splitColumns(self, xOff, yOff, xSize, ySize):
+
+        firstCol = xOff // self.cellSize
+        lastCol = -(-(xOff + xSize) // self.cellSize)
+
+        empty = ~self.counts[yOff // self.cellSize:
+                             -(-(yOff + ySize) // self.cellSize),
+                             firstCol:lastCol].any(axis=0)
+
+        windows = []
+        start = xOff
+
+        for i in range(1, len(empty) + 1):
+
+            if i == len(empty) or empty[i] != empty[i - 1]:
+
+                end = min((firstCol + i) * self.cellSize, xOff + xSize)
+                windows.append((start, yOff, end - start, ySize))
+                start = end
+
+        return windows
+
+    # -------------------------------------------------------------------------
+    # validPixels
+    # -------------------------------------------------------------------------
+    def validPixels(self):
+
+        return int(self.counts.sum())
+
+    # -------------------------------------------------------------------------
+    # write
+    #
+    # The index is written beside path and renamed into place, so an
+    # interrupted write leaves no index.
+    # -------------------------------------------------------------------------
+    def write(self, path):
+
+        tempPath = path + '.tmp'
+
+        with open(tempPath, 'wb') as f:
+
+            numpy.savez(f,
+                        counts=self.counts,
+                        cellSize=self.cellSize,
+                        xSize=self.xSize,
+                        ySize=self.ySize)
+
+        os.rename(tempPath, path)
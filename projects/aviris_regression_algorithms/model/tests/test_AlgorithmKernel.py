@@ -0,0 +1,78 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+import numpy
+
+from projects.aviris_regression_algorithms.model.AlgorithmKernel \
+    import AlgorithmKernel
+from projects.aviris_regression_algorithms.model.BandMath import BandMath
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class AlgorithmKernelTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_AlgorithmKernel
+# -----------------------------------------------------------------------------
+class AlgorithmKernelTestCase(unittest.TestCase):
+
+    COEF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'Chl_Coeff_input.csv')
+
+    # -------------------------------------------------------------------------
+    # testApplyAlgorithms
+    # -------------------------------------------------------------------------
+    def testApplyAlgorithms(self):
+
+        cube = numpy.random.RandomState(0). \
+            uniform(0.02, 0.5, (425, 3, 4)).astype(numpy.float32)
+
+        cube[:, 0, 0] = AlgorithmKernel.NO_DATA_VALUE
+        cube[8, 1, 1] = 0.9
+
+        model = CoefficientModel.read(AlgorithmKernelTestCase.COEF_FILE)
+        kernel = AlgorithmKernel(model)
+        result, invalid = kernel.applyAlgorithms(cube, ['Avg Chl'])
+
+        self.assertEqual(result.shape, (1, 3, 4))
+        self.assertEqual(result.dtype, numpy.float32)
+        self.assertEqual(invalid[0].tolist(),
+                         [[True, False, False, False],
+                          [False, True, False, False],
+                          [False, False, False, False]])
+
+        # The reference computation, for one pixel
+        bands = model.bandIndices()
+        values = cube[bands - 1, 2, 3].astype(numpy.float64)
+        divisor = numpy.sqrt((values[model.divisorMask()] ** 2).sum())
+
+        expected = model.intercepts(['Avg Chl'])[0] + \
+            model.coefficientMatrix(['Avg Chl'])[:, 0].dot(values) / divisor
+
+        self.assertAlmostEqual(result[0, 2, 3], expected, 3)
+
+        # Only the bands needed, in float64, give the same result.
+        needed = kernel.reduced(['Avg Chl'])[1]
+
+        subsetResult = kernel.applyAlgorithms(
+            cube[needed - 1].astype(numpy.float64), ['Avg Chl'], needed)[0]
+
+        self.assertTrue((subsetResult == result).all())
+
+        with self.assertRaisesRegexp(RuntimeError, 'requires band 245'):
+            kernel.applyAlgorithms(cube[:200], ['Avg Chl'])
+
+        with self.assertRaisesRegexp(RuntimeError, 'one sorted band'):
+            kernel.applyAlgorithms(cube, ['Avg Chl'], needed)
+
+        # Band math needs no mask.
+        kernel = AlgorithmKernel(BandMath('ratio = b60 / b35'))
+        result, invalid = kernel.applyAlgorithms(cube)
+
+        self.assertEqual(invalid.sum(), 1)
+        self.assertTrue(numpy.allclose(result[0, 2], cube[59, 2] / cube[34, 2]))
@@ -1,14 +1,26 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
 
+import csv
+import json
 import logging
+import math
 import os
+import shutil
 import sys
 import tempfile
 import unittest
 
+import numpy
+
+from osgeo import gdal
+from osgeo import ogr
+
 from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
     import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.BandMath import BandMath
+from projects.aviris_regression_algorithms.model.GeoTiffOptions \
+    import GeoTiffOptions
 
 logger = logging.getLogger()
 logger.level = logging.DEBUG
@@ -26,6 +38,115 @@ logger.level = logging.DEBUG
 # -----------------------------------------------------------------------------
 class ApplyAlgorithmTestCase(unittest.TestCase):
 
+    TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+    COEF_FILE = os.path.join(TEST_DIR, 'Chl_Coeff_input.csv')
+    TEST_IMAGE = os.path.join(TEST_DIR, 'clip.img')
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # _createTestCube
+    #
+    # clip.img is entirely no-data, so this writes a small ENVI cube of
+    # plausible reflectances with one no-data pixel and two masked pixels.
+    # The cube is returned shaped (bands, rows, cols), whatever the interleave.
+    # -------------------------------------------------------------------------
+    def _createTestCube(self, rows=6, cols=7, bands=425, interleave='bsq'):
+
+        cube = numpy.random.RandomState(0). \
+            uniform(0.02, 0.5, (bands, rows, cols)).astype(numpy.float32)
+
+        cube[:, 0, 0] = ApplyAlgorithm.NO_DATA_VALUE
+        cube[8, 1, 1] = 0.9
+        cube[244, 2, 2] = 0.001
+
+        imageFile = os.path.join(self.outDir, 'cube.img')
+
+        if interleave == 'bil':
+            cube.transpose(1, 0, 2).tofile(imageFile)
+
+        elif interleave == 'bip':
+            cube.transpose(1, 2, 0).tofile(imageFile)
+
+        else:
+            cube.tofile(imageFile)
+
+        with open(os.path.join(self.outDir, 'cube.hdr'), 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = ' + str(cols) + '\n' +
+                    'lines = ' + str(rows) + '\n' +
+                    'bands = ' + str(bands) + '\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = ' + interleave + '\n' +
+                    'byte order = 0\n' +
+                    'map info = {UTM, 1, 1, 583067.28, 7917730.91, ' +
+                    '5.2, 5.2, 4, North, WGS-84}\n')
+
+        return imageFile, cube
+
+    # -------------------------------------------------------------------------
+    # _readResult
+    # -------------------------------------------------------------------------
+    def _readResult(self, outDir, algorithmName='Avg Chl'):
+
+        ds = gdal.Open(os.path.join(outDir, algorithmName + '.tif'))
+        return ds.GetRasterBand(1).ReadAsArray()
+
+    # -------------------------------------------------------------------------
+    # _referencePixel
+    #
+    # This is the per-pixel formulation the block engine replaces.
+    # -------------------------------------------------------------------------
+    def _referencePixel(self, pixelStack, algorithmName='Avg Chl'):
+
+        if pixelStack[0] == ApplyAlgorithm.NO_DATA_VALUE:
+            return ApplyAlgorithm.NO_DATA_VALUE
+
+        if pixelStack[8] > 0.8 or pixelStack[244] < 0.01:
+            return ApplyAlgorithm.NO_DATA_VALUE
+
+        with open(ApplyAlgorithmTestCase.COEF_FILE) as csvFile:
+            coefRows = list(csv.DictReader(csvFile))
+
+        p = 0.0
+        tally = 0.0
+
+        for coefRow in coefRows:
+
+            band = int(coefRow['Band Number'][1:])
+
+            if band >= 5 and band <= 105:
+                tally += float(pixelStack[band - 1]) ** 2
+
+        divisor = math.sqrt(tally)
+
+        for coefRow in coefRows:
+
+            band = int(coefRow['Band Number'][1:])
+            coef = float(coefRow[algorithmName])
+
+            if band == 0:
+                p += coef
+            else:
+                p += coef * float(pixelStack[band - 1]) / divisor
+
+        return p
+
     # -------------------------------------------------------------------------
     # test
     # -------------------------------------------------------------------------
@@ -34,11 +155,1023 @@ class ApplyAlgorithmTestCase(unittest.TestCase):
         streamHandler = logging.StreamHandler(sys.stdout)
         logger.addHandler(streamHandler)
 
-        coefFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                'Chl_Coeff_input.csv')
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            ApplyAlgorithmTestCase.TEST_IMAGE,
+                            self.outDir,
+                            logger)
+
+        aa.applyAlgorithm('Avg Chl')
+
+        # The clip is entirely no-data.
+        result = self._readResult(self.outDir)
+        self.assertTrue((result == ApplyAlgorithm.NO_DATA_VALUE).all())
+
+        # Compare a synthetic cube to the per-pixel formulation.
+        imageFile, cube = self._createTestCube()
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        result = self._readResult(self.outDir)
+
+        for row in range(result.shape[0]):
+            for col in range(result.shape[1]):
+
+                expected = self._referencePixel(cube[:, row, col])
+
+                self.assertAlmostEqual(result[row, col],
+                                       expected,
+                                       delta=abs(expected) * 1e-5)
+
+    # -------------------------------------------------------------------------
+    # testApplyAlgorithms
+    # -------------------------------------------------------------------------
+    def testApplyAlgorithms(self):
+
+        # Add a second algorithm, half of the first, to the coefficient file.
+        coefFile = os.path.join(self.outDir, 'coefs.csv')
+
+        with open(ApplyAlgorithmTestCase.COEF_FILE) as inFile, \
+                open(coefFile, 'w') as outFile:
+
+            writer = csv.writer(outFile)
+
+            for row in csv.DictReader(inFile):
+
+                if not outFile.tell():
+
+                    writer.writerow(['Band Number', 'Wavelength', 'Avg Chl',
+                                     'Half Chl'])
+
+                writer.writerow([row['Band Number'],
+                                 row['Wavelength'],
+                                 row['Avg Chl'],
+                                 float(row['Avg Chl']) / 2.0])
+
+        imageFile = self._createTestCube()[0]
+        aa = ApplyAlgorithm(coefFile, imageFile, self.outDir)
+        outNames = aa.applyAlgorithms()
+
+        self.assertEqual(outNames, [os.path.join(self.outDir, 'cube.tif')])
+        ds = gdal.Open(outNames[0])
+        self.assertEqual(ds.RasterCount, 2)
+        self.assertEqual(ds.GetRasterBand(2).GetDescription(), 'Half Chl')
+
+        avgChl = ds.GetRasterBand(1).ReadAsArray()
+        halfChl = ds.GetRasterBand(2).ReadAsArray()
+        valid = avgChl != ApplyAlgorithm.NO_DATA_VALUE
+
+        self.assertTrue(numpy.allclose(halfChl[valid], avgChl[valid] / 2.0))
+
+        # One file per algorithm matches the multi-band file.
+        aa.applyAlgorithms(['Half Chl', 'Avg Chl'], True)
+
+        self.assertTrue((self._readResult(self.outDir, 'Avg Chl') ==
+                         avgChl).all())
+
+        self.assertTrue((self._readResult(self.outDir, 'Half Chl') ==
+                         halfChl).all())
+
+        # The multi-band output of a GeoTIFF in outDir would replace it.
+        aa = ApplyAlgorithm(coefFile, outNames[0], self.outDir)
+
+        with self.assertRaisesRegexp(RuntimeError, 'would overwrite'):
+            aa.applyAlgorithms()
+
+    # -------------------------------------------------------------------------
+    # testAreaOfInterest
+    # -------------------------------------------------------------------------
+    def testAreaOfInterest(self):
+
+        imageFile, cube = self._createTestCube()
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        full = self._readResult(self.outDir)
+        xform = aa.imageFile._getDataset().GetGeoTransform()
+
+        # A triangle from (col, row) (1, 1) to (6, 1) to (1, 5)
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+
+        for col, row in [(1, 1), (6, 1), (1, 5), (1, 1)]:
+            ring.AddPoint(*gdal.ApplyGeoTransform(xform, col, row))
+
+        triangle = ogr.Geometry(ogr.wkbPolygon)
+        triangle.AddGeometry(ring)
+        triangle.AssignSpatialReference(aa.imageFile.srs())
+
+        cols, rows = numpy.meshgrid(numpy.arange(7) + 0.5,
+                                    numpy.arange(6) + 0.5)
+
+        inside = (cols > 1) & (rows > 1) & \
+            ((cols - 1) / 5.0 + (rows - 1) / 4.0 < 1)
+
+        expected = numpy.where(inside, full, ApplyAlgorithm.NO_DATA_VALUE)
+
+        # Cropped, in parallel tiles
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            numWorkers=2,
+                            tileSize=(2, 2))
+
+        aa.clip(triangle)
+        outPath = aa.applyAlgorithm('Avg Chl')
+        ds = gdal.Open(outPath)
+
+        self.assertTrue((ds.ReadAsArray() == expected[1:5, 1:6]).all())
+        self.assertEqual(aa.report['Bytes read'], 20 * 103 * 4)
+
+        self.assertEqual(ds.GetGeoTransform()[0],
+                         gdal.ApplyGeoTransform(xform, 1, 1)[0])
+
+        # Filled
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.clip(triangle, False)
+        outPath = aa.applyAlgorithm('Avg Chl')
+
+        self.assertTrue((self._readResult(self.outDir) == expected).all())
+
+        # The valid percentage is of the whole output.
+        band = gdal.Open(outPath).GetRasterBand(1)
+
+        self.assertAlmostEqual(
+            float(band.GetMetadataItem('STATISTICS_VALID_PERCENT')),
+            100.0 * (expected != ApplyAlgorithm.NO_DATA_VALUE).mean(),
+            12)
+
+    # -------------------------------------------------------------------------
+    # testBandMath
+    # -------------------------------------------------------------------------
+    def testBandMath(self):
+
+        imageFile, cube = self._createTestCube()
+        red, nir = cube[34], cube[59]
+
+        bm = BandMath('red = b35; nir = b60\n' +
+                      'ndvi = (nir - red) / (nir + red)\n' +
+                      'bright = b200 * 2')
+
+        aa = ApplyAlgorithm(bm,
+                            imageFile,
+                            self.outDir,
+                            mask='b9 > 0.8',
+                            maxBlockBytes=1,
+                            numWorkers=2)
+
+        aa.applyAlgorithm('ndvi')
+        ndvi = self._readResult(self.outDir, 'ndvi')
+        expected = ((nir - red) / (nir + red)).astype(numpy.float32)
+
+        # Only the no-data band, the mask band and the ndvi bands are read.
+        self.assertEqual(aa.report['Bands read'], 4)
+        self.assertEqual(ndvi[0, 0], ApplyAlgorithm.NO_DATA_VALUE)
+        self.assertEqual(ndvi[1, 1], ApplyAlgorithm.NO_DATA_VALUE)
+        self.assertAlmostEqual(ndvi[2, 2], expected[2, 2], 6)
+        self.assertTrue(numpy.allclose(ndvi[3:], expected[3:]))
+
+        table = aa.queryPoints([(1, 1), (3, 3)], ['ndvi'])
+        self.assertEqual(table[0]['Mask reason'], ApplyAlgorithm.MASK_REASON)
+        self.assertEqual(table[1]['Divisor'], None)
+
+    # -------------------------------------------------------------------------
+    # testMask
+    # -------------------------------------------------------------------------
+    def testMask(self):
+
+        imageFile, cube = self._createTestCube()
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        self.assertEqual(aa.mask.algorithmNames(), ['mask'])
+        self.assertEqual(list(aa.mask.bandIndices()), [9, 245])
+        aa.applyAlgorithm('Avg Chl')
+        default = self._readResult(self.outDir)
+
+        # Raising the high threshold unmasks (1, 1) only.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            mask='b9 > 0.95 or b245 < 0.01')
+
+        aa.applyAlgorithm('Avg Chl')
+        raised = self._readResult(self.outDir)
+
+        self.assertEqual(default[1, 1], ApplyAlgorithm.NO_DATA_VALUE)
+        self.assertNotEqual(raised[1, 1], ApplyAlgorithm.NO_DATA_VALUE)
+        raised[1, 1] = default[1, 1]
+        self.assertTrue((raised == default).all())
+
+        with self.assertRaisesRegexp(RuntimeError, 'one expression'):
+
+            ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                           imageFile,
+                           self.outDir,
+                           mask='a = b9 > 0.8; b = b245 < 0.01')
+
+    # -------------------------------------------------------------------------
+    # testSkipEmpty
+    # -------------------------------------------------------------------------
+    def testSkipEmpty(self):
+
+        imageFile, cube = self._createTestCube(rows=140)
+        cube[:, 64:, :] = ApplyAlgorithm.NO_DATA_VALUE
+        cube.tofile(imageFile)
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            tileSize=(7, 32))
+
+        aa.applyAlgorithm('Avg Chl')
+        expected = self._readResult(self.outDir)
+        bytesRead = aa.report['Bytes read']
+
+        for numWorkers in [1, 2]:
+
+            aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                                imageFile,
+                                self.outDir,
+                                numWorkers=numWorkers,
+                                tileSize=(7, 32),
+                                skipEmpty=True)
+
+            aa.applyAlgorithm('Avg Chl')
+
+            self.assertTrue((self._readResult(self.outDir) == expected).all())
+            self.assertEqual(aa.report['Blocks skipped'], 3)
+            self.assertEqual(aa.report['Bytes read'], bytesRead * 64 // 140)
+
+        indexPath = os.path.join(self.outDir, 'cube_validity.npz')
+        self.assertTrue(os.path.exists(indexPath))
+
+        # Full-width strips skip the fill beside a diagonal flight line.
+        shutil.rmtree(self.outDir)
+        os.mkdir(self.outDir)
+        imageFile, cube = self._createTestCube(rows=130, cols=200)
+        cube[:, :64, 64:] = ApplyAlgorithm.NO_DATA_VALUE
+        cube[:, 64:, :128] = ApplyAlgorithm.NO_DATA_VALUE
+        cube.tofile(imageFile)
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        expected = self._readResult(self.outDir)
+        self.assertEqual(len(list(aa._blocks(103))), 1)
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            skipEmpty=True)
+
+        aa.applyAlgorithm('Avg Chl')
+
+        self.assertTrue((self._readResult(self.outDir) == expected).all())
+        self.assertEqual(aa.report['Blocks skipped'], 3)
+
+        self.assertEqual(aa.report['Pixels skipped'],
+                         64 * 136 + 66 * 128)
+
+    # -------------------------------------------------------------------------
+    # testSamplePixels
+    # -------------------------------------------------------------------------
+    def testSamplePixels(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        expected = self._readResult(self.outDir)
+
+        # A one-byte budget reads a strip per row, skipping row 3.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1)
+
+        rows = [5, 0, 2, 1, -1, 4, 6]
+        cols = [6, 0, 2, 3, 0, 1, 0]
+        values = aa.samplePixels(rows, cols, ['Avg Chl'])
+
+        self.assertEqual(values.shape, (1, 7))
+        self.assertEqual(values[0, 4], ApplyAlgorithm.NO_DATA_VALUE)
+        self.assertEqual(values[0, 6], ApplyAlgorithm.NO_DATA_VALUE)
+
+        for i in [0, 1, 2, 3, 5]:
+            self.assertEqual(values[0, i], expected[rows[i], cols[i]])
+
+    # -------------------------------------------------------------------------
+    # testSceneLayers
+    # -------------------------------------------------------------------------
+    def testSceneLayers(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        expected = self._readResult(self.outDir)
+        layerDir = os.path.join(self.outDir, 'layers')
+        os.mkdir(layerDir)
+
+        # A failed run removes the layers it was building.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1,
+                            checkpointSeconds=None,
+                            layerDir=layerDir)
+
+        readBlock = aa._readBlock
+
+        def failingRead(xOff, yOff, xSize, ySize, bands):
+
+            if yOff == 3:
+                raise IOError('Unable to read')
+
+            return readBlock(xOff, yOff, xSize, ySize, bands)
+
+        aa._readBlock = failingRead
+
+        with self.assertRaisesRegexp(IOError, 'Unable to read'):
+            aa.applyAlgorithm('Avg Chl')
+
+        self.assertEqual(os.listdir(layerDir), [])
+
+        # The first run builds the layers, the next reads them.
+        for mode in [ApplyAlgorithm.BUILD_LAYERS,
+                     ApplyAlgorithm.READ_LAYERS,
+                     ApplyAlgorithm.READ_LAYERS]:
+
+            aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                                imageFile,
+                                self.outDir,
+                                numWorkers=2,
+                                tileSize=(3, 2),
+                                layerDir=layerDir)
+
+            aa.applyAlgorithm('Avg Chl')
+
+            self.assertEqual(aa.report['Scene layers'], mode)
+            self.assertTrue((self._readResult(self.outDir) == expected).all())
+
+        self.assertEqual(len(os.listdir(layerDir)), 2)
+
+        # Reading the layers, only the 98 bands with nonzero coefficients,
+        # not the no-data, mask or divisor bands, are read.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            layerDir=layerDir)
+
+        aa.applyAlgorithm('Avg Chl')
+
+        self.assertEqual(aa.report['Scene layers'],
+                         ApplyAlgorithm.READ_LAYERS)
+
+        self.assertEqual(aa.report['Bands read'], 98)
+        self.assertTrue((self._readResult(self.outDir) == expected).all())
+
+    # -------------------------------------------------------------------------
+    # testBlockSizeInvariance
+    # -------------------------------------------------------------------------
+    def testBlockSizeInvariance(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        wholeScene = self._readResult(self.outDir)
+
+        # A one-byte budget forces one row per block.
+        rowDir = os.path.join(self.outDir, 'rows')
+        os.mkdir(rowDir)
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            rowDir,
+                            maxBlockBytes=1)
+
+        self.assertEqual(len(list(aa._blocks(1))), 6)
+        aa.applyAlgorithm('Avg Chl')
+
+        self.assertTrue((wholeScene == self._readResult(rowDir)).all())
+
+    # -------------------------------------------------------------------------
+    # testBandSubset
+    # -------------------------------------------------------------------------
+    def testBandSubset(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+
+        # Bands 5 - 105, including mask band 9, band 1 and band 245.
+        self.assertEqual(aa.report['Bands read'], 103)
+        self.assertEqual(aa.report['Bands in image'], 425)
+        self.assertEqual(aa.report['Bytes saved'], 6 * 7 * (425 - 103) * 4)
+
+    # -------------------------------------------------------------------------
+    # testBuffers
+    # -------------------------------------------------------------------------
+    def testBuffers(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1)
+
+        aa.applyAlgorithm('Avg Chl')
+        buffers = dict(aa.kernel._buffers)
+        aa.applyAlgorithm('Avg Chl')
+
+        # Six one-row blocks, over two runs, reuse the same arrays.
+        for name in buffers:
+            self.assertTrue(aa.kernel._buffers[name] is buffers[name])
+
+        self.assertEqual(aa.kernel._buffers[('values', 'float64')].shape,
+                         (101 * 7,))
+        self.assertTrue(aa.report['Process peak RSS bytes'] > 0)
+
+    # -------------------------------------------------------------------------
+    # testPrecision
+    # -------------------------------------------------------------------------
+    def testPrecision(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        double = self._readResult(self.outDir)
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            precision='float32')
+
+        self.assertEqual(aa.bytesPerSample(), 8)
+        aa.applyAlgorithm('Avg Chl')
+        single = self._readResult(self.outDir)
+
+        self.assertEqual(aa.kernel._buffers[('values', 'float32')].dtype,
+                         numpy.float32)
+
+        self.assertTrue(('values', 'float64') not in aa.kernel._buffers)
+        self.assertTrue(((single == ApplyAlgorithm.NO_DATA_VALUE) ==
+                         (double == ApplyAlgorithm.NO_DATA_VALUE)).all())
+
+        report = aa.comparePrecision(['Avg Chl'])['Avg Chl']
+        valid = double != ApplyAlgorithm.NO_DATA_VALUE
+        error = numpy.abs(single[valid].astype(numpy.float64) - double[valid])
+
+        self.assertEqual(report['Pixels compared'], 39)
+        self.assertEqual(report['Validity mismatches'], 0)
+        self.assertAlmostEqual(report['Max abs error'], error.max())
+        self.assertTrue(report['Max rel error'] < 1e-4)
+
+        with self.assertRaisesRegexp(RuntimeError, 'precision'):
+
+            ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                           imageFile,
+                           self.outDir,
+                           precision='float16')
+
+    # -------------------------------------------------------------------------
+    # testQueryPoints
+    # -------------------------------------------------------------------------
+    def testQueryPoints(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        wholeScene = self._readResult(self.outDir)
+
+        table = aa.queryPoints([(0, 0), (1, 1), (3, 4), (5, 6), (6, 0)])
+        self.assertEqual(len(table), 5)
+
+        self.assertEqual([e['Mask reason'] for e in table],
+                         [ApplyAlgorithm.NO_DATA_REASON,
+                          ApplyAlgorithm.MASK_REASON,
+                          '',
+                          '',
+                          ApplyAlgorithm.OUTSIDE_REASON])
+
+        self.assertEqual(table[2]['Avg Chl'], wholeScene[3, 4])
+        self.assertEqual(table[3]['Avg Chl'], wholeScene[5, 6])
+        self.assertTrue(table[2]['Divisor'] > 0)
+        self.assertEqual(table[4]['Avg Chl'], None)
+
+        # Map coordinates of pixel centers find the same pixels.
+        mapTable = aa.queryPoints([(e['x'], e['y']) for e in table[:4]],
+                                  ['Avg Chl'],
+                                  True)
+
+        self.assertEqual([(e['row'], e['col']) for e in mapTable],
+                         [(0, 0), (1, 1), (3, 4), (5, 6)])
+
+        self.assertEqual(mapTable[3]['Avg Chl'], wholeScene[5, 6])
+
+    # -------------------------------------------------------------------------
+    # testParallel
+    # -------------------------------------------------------------------------
+    def testParallel(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        serial = self._readResult(self.outDir)
+
+        parallelDir = os.path.join(self.outDir, 'parallel')
+        os.mkdir(parallelDir)
 
-        testImage = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                 'clip.img')
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            parallelDir,
+                            numWorkers=3,
+                            tileSize=(3, 2))
 
-        aa = ApplyAlgorithm(coefFile, testImage, tempfile.gettempdir(), logger)
+        self.assertEqual(len(list(aa._blocks(1))), 9)
+        aa.debug(3, 3)
         aa.applyAlgorithm('Avg Chl')
+
+        self.assertTrue((serial == self._readResult(parallelDir)).all())
+        self.assertTrue('Divisor' in aa.traces[(3, 3)])
+
+    # -------------------------------------------------------------------------
+    # testPrefetch
+    # -------------------------------------------------------------------------
+    def testPrefetch(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        expected = self._readResult(self.outDir)
+
+        with self.assertRaisesRegexp(RuntimeError, 'cannot be negative'):
+
+            ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                           imageFile,
+                           self.outDir,
+                           prefetchDepth=-1)
+
+        # Six one-row blocks, read and written in threads
+        for numWorkers in [1, 2]:
+
+            aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                                imageFile,
+                                self.outDir,
+                                maxBlockBytes=1,
+                                numWorkers=numWorkers,
+                                prefetchDepth=2)
+
+            aa.applyAlgorithm('Avg Chl')
+
+            self.assertTrue((self._readResult(self.outDir) == expected).all())
+            self.assertTrue(aa.report['Compute stall seconds'] >= 0)
+            self.assertTrue(aa.report['Write stall seconds'] >= 0)
+
+            self.assertEqual('Read stall seconds' in aa.report,
+                             numWorkers == 1)
+
+        # A failed read ends the run.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1,
+                            prefetchDepth=2)
+
+        readBlock = aa._readBlock
+
+        def failingRead(xOff, yOff, xSize, ySize, bands):
+
+            if yOff == 3:
+                raise IOError('Unable to read')
+
+            return readBlock(xOff, yOff, xSize, ySize, bands)
+
+        aa._readBlock = failingRead
+
+        with self.assertRaisesRegexp(IOError, 'Unable to read'):
+            aa.applyAlgorithm('Avg Chl')
+
+    # -------------------------------------------------------------------------
+    # testCloudOptimized
+    # -------------------------------------------------------------------------
+    def testCloudOptimized(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        plain = self._readResult(self.outDir)
+
+        cogDir = os.path.join(self.outDir, 'cog')
+        os.mkdir(cogDir)
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            cogDir,
+                            outputOptions=GeoTiffOptions(16,
+                                                         'DEFLATE',
+                                                         3,
+                                                         overviewLevels=[2],
+                                                         cog=True))
+
+        outPath = aa.applyAlgorithm('Avg Chl')
+
+        self.assertEqual(outPath, os.path.join(cogDir, 'Avg Chl.tif'))
+        self.assertEqual(sorted(os.listdir(cogDir)),
+                         ['Avg Chl.tif', 'Avg Chl_stats.json'])
+        self.assertTrue((plain == self._readResult(cogDir)).all())
+
+        band = gdal.Open(outPath).GetRasterBand(1)
+        self.assertEqual(band.GetOverviewCount(), 1)
+
+    # -------------------------------------------------------------------------
+    # testInterleave
+    # -------------------------------------------------------------------------
+    def testInterleave(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        bsq = self._readResult(self.outDir)
+
+        # BSQ strips are sized for the bands read; BIP strips for every band.
+        budget = 7 * (103 + 1) * aa.bytesPerSample() * 2
+        aa.maxBlockBytes = budget
+        self.assertEqual(len(list(aa._blocks(103))), 3)
+
+        # Prefetching shares the budget among the blocks in flight.
+        aa.prefetchDepth = 1
+        self.assertEqual(len(list(aa._blocks(103))), 6)
+
+        shutil.rmtree(self.outDir)
+        os.mkdir(self.outDir)
+        imageFile = self._createTestCube(interleave='bip')[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=budget)
+
+        self.assertEqual(aa.interleave(), 'bip')
+        self.assertEqual(len(list(aa._blocks(103))), 6)
+        aa.applyAlgorithm('Avg Chl')
+        self.assertTrue((bsq == self._readResult(self.outDir)).all())
+
+        # Cache a BSQ copy, then reuse it.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            cacheInterleave='bsq')
+
+        cachePath = os.path.join(self.outDir, 'cube_bsq.img')
+        self.assertEqual(aa.cubeFile.fileName(), cachePath)
+        self.assertEqual(aa.interleave(), 'bsq')
+        aa.applyAlgorithm('Avg Chl')
+        self.assertTrue((bsq == self._readResult(self.outDir)).all())
+
+        # Mark the copy to see whether it is rewritten.
+        cube = numpy.memmap(cachePath, numpy.float32, 'r+')
+        cube[-1] = 1.0
+        cube.flush()
+        del cube
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            cacheInterleave='bsq')
+
+        self.assertEqual(aa.cubeFile.cube()[-1, -1, -1], 1.0)
+
+        # A stale copy is rewritten.
+        os.utime(cachePath, (0, 0))
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            cacheInterleave='bsq')
+
+        self.assertNotEqual(aa.cubeFile.cube()[-1, -1, -1], 1.0)
+
+        # A copy whose header remains without its image is rewritten.
+        aa = None
+        os.remove(cachePath)
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            cacheInterleave='bsq')
+
+        self.assertTrue((aa.cubeFile.cube() ==
+                         aa.imageFile.cube().transpose(2, 0, 1)).all())
+
+    # -------------------------------------------------------------------------
+    # testResume
+    # -------------------------------------------------------------------------
+    def testResume(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.applyAlgorithm('Avg Chl')
+        expected = self._readResult(self.outDir)
+
+        # Interrupt a run of six one-row blocks after the third.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1,
+                            checkpointSeconds=0)
+
+        computeBlocks = aa._computeBlocks
+
+        def interrupted(blocks, model, bands):
+
+            for i, block in enumerate(computeBlocks(blocks, model, bands)):
+
+                if i == 3:
+                    raise KeyboardInterrupt()
+
+                yield block
+
+        aa._computeBlocks = interrupted
+
+        with self.assertRaises(KeyboardInterrupt):
+            aa.applyAlgorithm('Avg Chl')
+
+        journalFile = os.path.join(self.outDir, 'Avg Chl.tif.journal')
+        self.assertTrue(os.path.exists(journalFile))
+
+        # Resume, reading only the last three blocks.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1,
+                            checkpointSeconds=0)
+
+        readBlock = aa._readBlock
+        windows = []
+
+        def countingRead(xOff, yOff, xSize, ySize, bands):
+
+            windows.append(yOff)
+            return readBlock(xOff, yOff, xSize, ySize, bands)
+
+        aa._readBlock = countingRead
+        aa.applyAlgorithm('Avg Chl')
+
+        self.assertEqual(aa.report['Blocks resumed'], 3)
+        self.assertEqual(windows, [3, 4, 5])
+        self.assertTrue((expected == self._readResult(self.outDir)).all())
+        self.assertFalse(os.path.exists(journalFile))
+
+        # A journal for different blocks is not resumed.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            tileSize=(4, 2),
+                            checkpointSeconds=0)
+
+        aa._computeBlocks = interrupted
+
+        with self.assertRaises(KeyboardInterrupt):
+            aa.applyAlgorithm('Avg Chl')
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1,
+                            checkpointSeconds=0)
+
+        aa.applyAlgorithm('Avg Chl')
+        self.assertEqual(aa.report['Blocks resumed'], 0)
+
+    # -------------------------------------------------------------------------
+    # testStatistics
+    # -------------------------------------------------------------------------
+    def testStatistics(self):
+
+        imageFile = self._createTestCube()[0]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            numWorkers=2,
+                            tileSize=(3, 2))
+
+        aa.applyAlgorithm('Avg Chl')
+
+        result = self._readResult(self.outDir)
+        valid = result[result != ApplyAlgorithm.NO_DATA_VALUE]. \
+            astype(numpy.float64)
+
+        statsFile = os.path.join(self.outDir, 'Avg Chl_stats.json')
+        self.assertEqual(aa.report['Statistics files'], [statsFile])
+
+        with open(statsFile) as f:
+            stats = json.load(f)['Avg Chl']
+
+        self.assertEqual(stats['pixels'], 42)
+        self.assertEqual(stats['count'], valid.size)
+        self.assertEqual(stats['minimum'], valid.min())
+        self.assertEqual(stats['maximum'], valid.max())
+        self.assertAlmostEqual(stats['mean'], valid.mean(), 12)
+        self.assertAlmostEqual(stats['stddev'], valid.std(), 12)
+        self.assertEqual(sum(stats['histogram']['counts']), valid.size)
+
+        band = gdal.Open(os.path.join(self.outDir, 'Avg Chl.tif')). \
+            GetRasterBand(1)
+
+        self.assertAlmostEqual(
+            float(band.GetMetadataItem('STATISTICS_MEAN')),
+            valid.mean(),
+            6)
+
+        # Statistics of a resumed run include the blocks written before it.
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1,
+                            checkpointSeconds=0)
+
+        computeBlocks = aa._computeBlocks
+
+        def interrupted(blocks, model, bands):
+
+            for i, block in enumerate(computeBlocks(blocks, model, bands)):
+
+                if i == 3:
+                    raise KeyboardInterrupt()
+
+                yield block
+
+        aa._computeBlocks = interrupted
+
+        with self.assertRaises(KeyboardInterrupt):
+            aa.applyAlgorithm('Avg Chl')
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir,
+                            maxBlockBytes=1,
+                            checkpointSeconds=0)
+
+        aa.applyAlgorithm('Avg Chl')
+        self.assertEqual(aa.report['Blocks resumed'], 3)
+
+        with open(statsFile) as f:
+            resumed = json.load(f)['Avg Chl']
+
+        self.assertEqual(resumed['count'], stats['count'])
+        self.assertEqual(resumed['histogram'], stats['histogram'])
+        self.assertAlmostEqual(resumed['mean'], stats['mean'], 12)
+
+    # -------------------------------------------------------------------------
+    # testTrace
+    # -------------------------------------------------------------------------
+    def testTrace(self):
+
+        imageFile, cube = self._createTestCube()
+        pixels = [(3, 3), (0, 0), (1, 1), (5, 6)]
+
+        aa = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                            imageFile,
+                            self.outDir)
+
+        aa.trace(pixels)
+        aa.applyAlgorithm('Avg Chl')
+        result = self._readResult(self.outDir)
+
+        self.assertEqual(sorted(aa.traces), sorted(pixels))
+        self.assertEqual(aa.traces[(0, 0)]['Mask reason'], 'No data')
+        self.assertEqual(aa.traces[(1, 1)]['Mask reason'], 'Mask')
+        self.assertEqual(aa.traces[(1, 1)]['Stack'][9], cube[8, 1, 1])
+
+        for row, col in [(3, 3), (5, 6)]:
+
+            trace = aa.traces[(row, col)]
+            self.assertEqual(trace['Mask reason'], '')
+
+            self.assertEqual(trace['Results']['Avg Chl'],
+                             result[row, col])
+
+            self.assertAlmostEqual(trace['Results']['Avg Chl'],
+                                   self._referencePixel(cube[:, row, col]),
+                                   3)
+
+            # The stack holds every band read, the divisor's among them.
+            self.assertEqual(len(trace['Stack']), 103)
+
+            divisor = math.sqrt(sum(float(cube[band - 1, row, col]) ** 2
+                                    for band in trace['Stack']
+                                    if 5 <= band <= 105))
+
+            self.assertAlmostEqual(trace['Divisor'], divisor, 10)
+
+            for band in trace['Normalized']:
+
+                self.assertAlmostEqual(trace['Normalized'][band],
+                                       float(cube[band - 1, row, col]) /
+                                       divisor,
+                                       10)
+
+            # The intercept and the contributions add up to the result.
+            contributions = trace['Contributions']['Avg Chl']
+            self.assertTrue(0 in contributions)
+
+            self.assertAlmostEqual(sum(contributions.values()),
+                                   trace['Results']['Avg Chl'],
+                                   3)
+
+        traceFile = os.path.join(self.outDir, 'cube.img_traces.json')
+        self.assertEqual(aa.report['Trace file'], traceFile)
+
+        with open(traceFile) as f:
+            written = json.load(f)
+
+        self.assertEqual([(t['row'], t['col']) for t in written],
+                         sorted(pixels))
+
+        # Tiles computed in parallel trace the same values.
+        parallelDir = os.path.join(self.outDir, 'parallel')
+        os.mkdir(parallelDir)
+
+        parallel = ApplyAlgorithm(ApplyAlgorithmTestCase.COEF_FILE,
+                                  imageFile,
+                                  parallelDir,
+                                  numWorkers=2,
+                                  tileSize=(3, 2))
+
+        parallel.trace(pixels)
+        parallel.applyAlgorithm('Avg Chl')
+        self.assertEqual(parallel.traces, aa.traces)
+
+        # Band math has no divisor.
+        aa = ApplyAlgorithm(BandMath('ndvi = (b60 - b35) / (b60 + b35)'),
+                            imageFile,
+                            self.outDir,
+                            mask='b245 < 0.01')
+
+        aa.trace([(2, 2)])
+        aa.applyAlgorithms()
+        self.assertEqual(aa.traces[(2, 2)]['Mask reason'], 'Mask')
+        self.assertFalse('Divisor' in aa.traces[(2, 2)])
+
+        with self.assertRaisesRegexp(RuntimeError, 'not within the image'):
+            aa.debug(6, 0)
+
+        with self.assertRaisesRegexp(RuntimeError, 'column 7 is not'):
+            aa.trace([(1, 1), (0, 7)])
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from osgeo import gdal
+
+from model.CeleryConfiguration import app
+
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.ApplyAlgorithmCelery \
+    import ApplyAlgorithmCelery
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class ApplyAlgorithmCeleryTestCase
+#
+# Tasks run eagerly, in this process, so no broker or worker is needed.
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_ApplyAlgorithmCelery
+# -----------------------------------------------------------------------------
+class ApplyAlgorithmCeleryTestCase(unittest.TestCase):
+
+    TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+    COEF_FILE = os.path.join(TEST_DIR, 'Chl_Coeff_input.csv')
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+        self.scratchDir = tempfile.mkdtemp()
+        self.eager = app.conf.task_always_eager
+        self.propagates = app.conf.task_eager_propagates
+        app.conf.task_always_eager = True
+        app.conf.task_eager_propagates = True
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        app.conf.task_always_eager = self.eager
+        app.conf.task_eager_propagates = self.propagates
+        shutil.rmtree(self.outDir)
+        shutil.rmtree(self.scratchDir)
+
+    # -------------------------------------------------------------------------
+    # test
+    # -------------------------------------------------------------------------
+    def test(self):
+
+        cube = numpy.random.RandomState(0). \
+            uniform(0.02, 0.5, (425, 6, 7)).astype(numpy.float32)
+
+        cube[:, 0, 0] = ApplyAlgorithm.NO_DATA_VALUE
+        imageFile = os.path.join(self.outDir, 'cube.img')
+        cube.tofile(imageFile)
+
+        with open(os.path.join(self.outDir, 'cube.hdr'), 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = 7\n' +
+                    'lines = 6\n' +
+                    'bands = 425\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = bsq\n' +
+                    'byte order = 0\n' +
+                    'map info = {UTM, 1, 1, 583067.28, 7917730.91, ' +
+                    '5.2, 5.2, 4, North, WGS-84}\n')
+
+        model = CoefficientModel.read(ApplyAlgorithmCeleryTestCase.COEF_FILE)
+        serialDir = os.path.join(self.outDir, 'serial')
+        os.mkdir(serialDir)
+        aa = ApplyAlgorithm(model, imageFile, serialDir)
+        aa.applyAlgorithm('Avg Chl')
+
+        with self.assertRaisesRegexp(RuntimeError, 'not an existing'):
+            ApplyAlgorithmCelery(model, imageFile, self.outDir, None)
+
+        aa = ApplyAlgorithmCelery(model,
+                                  imageFile,
+                                  self.outDir,
+                                  self.scratchDir,
+                                  tileSize=(3, 4))
+
+        aa.applyAlgorithm('Avg Chl')
+
+        # Every tile is timed, and removed once assembled.
+        self.assertEqual([t['window'] for t in aa.report['Tiles']],
+                         [(0, 0, 3, 4), (3, 0, 3, 4), (6, 0, 1, 4),
+                          (0, 4, 3, 2), (3, 4, 3, 2), (6, 4, 1, 2)])
+
+        self.assertTrue(all(t['seconds'] >= 0 for t in aa.report['Tiles']))
+        self.assertEqual(os.listdir(self.scratchDir), [])
+
+        expected = gdal.Open(os.path.join(serialDir, 'Avg Chl.tif')). \
+            GetRasterBand(1).ReadAsArray()
+
+        result = gdal.Open(os.path.join(self.outDir, 'Avg Chl.tif')). \
+            GetRasterBand(1).ReadAsArray()
+
+        self.assertTrue((result == expected).all())
+
+        # A failed tile leaves none of the others in the scratch directory.
+        app.conf.task_eager_propagates = False
+        save = numpy.save
+        numSaved = []
+
+        def failingSave(f, array):
+
+            numSaved.append(1)
+
+            if len(numSaved) == 2:
+                raise IOError('Unable to write')
+
+            save(f, array)
+
+        numpy.save = failingSave
+
+        try:
+
+            with self.assertRaisesRegexp(IOError, 'Unable to write'):
+                aa.applyAlgorithm('Avg Chl')
+
+        finally:
+            numpy.save = save
+
+        self.assertEqual(len(numSaved), 6)
+        self.assertEqual(os.listdir(self.scratchDir), [])
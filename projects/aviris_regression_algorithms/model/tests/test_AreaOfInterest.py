@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from osgeo import gdal
+from osgeo import ogr
+
+from model.Envelope import Envelope
+from model.EnviImageFile import EnviImageFile
+
+from projects.aviris_regression_algorithms.model.AreaOfInterest \
+    import AreaOfInterest
+
+
+# -----------------------------------------------------------------------------
+# class AreaOfInterestTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_AreaOfInterest
+# -----------------------------------------------------------------------------
+class AreaOfInterestTestCase(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    # setUp
+    #
+    # This writes a 10 x 8 ENVI image whose geotransform is rotated 30
+    # degrees.
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+        imagePath = os.path.join(self.outDir, 'rotated.img')
+        numpy.zeros((1, 8, 10), numpy.float32).tofile(imagePath)
+
+        with open(os.path.join(self.outDir, 'rotated.hdr'), 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = 10\n' +
+                    'lines = 8\n' +
+                    'bands = 1\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = bsq\n' +
+                    'byte order = 0\n' +
+                    'map info = {UTM, 1, 1, 583067.28, 7917730.91, ' +
+                    '5.2, 5.2, 4, North, WGS-84, rotation=30}\n')
+
+        self.imageFile = EnviImageFile(imagePath)
+        self.xform = self.imageFile._getDataset().GetGeoTransform()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # _polygon
+    #
+    # This returns a polygon whose vertices are at the given (col, row) pixel
+    # coordinates.
+    # -------------------------------------------------------------------------
+    def _polygon(self, *rings):
+
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+
+        for ring in rings:
+
+            linearRing = ogr.Geometry(ogr.wkbLinearRing)
+
+            for col, row in ring + ring[:1]:
+
+                x, y = gdal.ApplyGeoTransform(self.xform, col, row)
+                linearRing.AddPoint(x, y)
+
+            polygon.AddGeometry(linearRing)
+
+        polygon.AssignSpatialReference(self.imageFile.srs())
+
+        return polygon
+
+    # -------------------------------------------------------------------------
+    # testOutside
+    # -------------------------------------------------------------------------
+    def testOutside(self):
+
+        # A triangle with a square hole, in the rotated image
+        triangle = [(1, 1), (9.5, 1), (1, 7.5)]
+        hole = [(2, 2), (4, 2), (4, 4), (2, 4)]
+        area = AreaOfInterest(self._polygon(triangle, hole), self.imageFile)
+
+        self.assertEqual(area.window(), (1, 1, 9, 7))
+
+        cols, rows = numpy.meshgrid(numpy.arange(10) + 0.5,
+                                    numpy.arange(8) + 0.5)
+
+        inside = (cols > 1) & (rows > 1) & \
+            ((cols - 1) / 8.5 + (rows - 1) / 6.5 < 1) & \
+            ~((cols > 2) & (cols < 4) & (rows > 2) & (rows < 4))
+
+        self.assertTrue((area.outside(0, 0, 10, 8) == ~inside).all())
+        self.assertTrue((area.outside(3, 2, 5, 4) == ~inside[2:6, 3:8]).all())
+
+        # An envelope past the image is limited to it.
+        envelope = Envelope()
+        ulx, uly = gdal.ApplyGeoTransform(self.xform, 5, -3)
+        lrx, lry = gdal.ApplyGeoTransform(self.xform, 20, 20)
+        envelope.addPoint(ulx, uly, 0, self.imageFile.srs())
+        envelope.addPoint(lrx, lry, 0, self.imageFile.srs())
+        area = AreaOfInterest(envelope, self.imageFile)
+
+        self.assertEqual(area.window()[0], 0)
+        self.assertEqual(area.window()[1:], (0, 10, 8))
+        self.assertTrue(area.outside(0, 0, 10, 8).any())
+
+        with self.assertRaisesRegexp(RuntimeError, 'does not intersect'):
+
+            AreaOfInterest(self._polygon([(11, 0), (12, 0), (12, 1)]),
+                           self.imageFile)
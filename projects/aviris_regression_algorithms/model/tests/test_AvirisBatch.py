@@ -0,0 +1,201 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from osgeo import gdal
+from osgeo import ogr
+
+from projects.aviris_regression_algorithms.model.AvirisBatch \
+    import AvirisBatch
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class AvirisBatchTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_AvirisBatch
+# -----------------------------------------------------------------------------
+class AvirisBatchTestCase(unittest.TestCase):
+
+    COEF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'Chl_Coeff_input.csv')
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.inDir = tempfile.mkdtemp()
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.inDir)
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # _createScene
+    # -------------------------------------------------------------------------
+    def _createScene(self, name, rows=4, cols=3, bands=425):
+
+        cube = numpy.random.RandomState(len(name)). \
+            uniform(0.02, 0.5, (bands, rows, cols)).astype(numpy.float32)
+
+        imageFile = os.path.join(self.inDir, name + '_img')
+        cube.tofile(imageFile)
+
+        with open(imageFile + '.hdr', 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = ' + str(cols) + '\n' +
+                    'lines = ' + str(rows) + '\n' +
+                    'bands = ' + str(bands) + '\n' +
+                    'data type = 4\n' +
+                    'interleave = bsq\n' +
+                    'byte order = 0\n' +
+                    'map info = {UTM, 1, 1, 583067.28, 7917730.91, ' +
+                    '5.2, 5.2, 4, North, WGS-84}\n')
+
+        return imageFile
+
+    # -------------------------------------------------------------------------
+    # testArea
+    # -------------------------------------------------------------------------
+    def testArea(self):
+
+        images = [self._createScene('a'), self._createScene('bb')]
+        model = CoefficientModel.read(AvirisBatchTestCase.COEF_FILE)
+
+        # The first two columns of the scenes
+        area = ogr.CreateGeometryFromWkt(
+            'POLYGON ((583067.28 7917730.91, 583077.68 7917730.91, ' +
+            '583077.68 7917710.11, 583067.28 7917710.11, ' +
+            '583067.28 7917730.91))')
+
+        batch = AvirisBatch(model, images, self.outDir, area=area)
+
+        self.assertEqual([r['status'] for r in batch.run()],
+                         [AvirisBatch.DONE, AvirisBatch.DONE])
+
+        ds = gdal.Open(os.path.join(self.outDir, 'a_img', 'a_img.tif'))
+        self.assertEqual((ds.RasterXSize, ds.RasterYSize), (2, 4))
+        ds = None
+
+        # The whole scenes are another setting.
+        batch = AvirisBatch(model, images, self.outDir, area=area,
+                            cropToArea=False)
+
+        self.assertEqual([r['status'] for r in batch.run()],
+                         [AvirisBatch.DONE, AvirisBatch.DONE])
+
+        ds = gdal.Open(os.path.join(self.outDir, 'a_img', 'a_img.tif'))
+        self.assertEqual((ds.RasterXSize, ds.RasterYSize), (3, 4))
+        self.assertEqual(ds.ReadAsArray()[0, 2], -9999.0)
+        ds = None
+
+        # Scenes outside the area are skipped.
+        farDir = os.path.join(self.outDir, 'far')
+        os.mkdir(farDir)
+
+        far = ogr.CreateGeometryFromWkt(
+            'POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))')
+
+        batch = AvirisBatch(model, images, farDir, area=far)
+
+        self.assertEqual([r['status'] for r in batch.run()],
+                         [AvirisBatch.SKIPPED, AvirisBatch.SKIPPED])
+
+        self.assertEqual(os.listdir(farDir), [])
+
+    # -------------------------------------------------------------------------
+    # testFindImages
+    # -------------------------------------------------------------------------
+    def testFindImages(self):
+
+        images = [self._createScene('b'), self._createScene('a')]
+
+        self.assertEqual(AvirisBatch.findImages(
+                         os.path.join(self.inDir, '*_img')),
+                         sorted(images))
+
+        listFile = os.path.join(self.inDir, 'scenes.txt')
+
+        with open(listFile, 'w') as f:
+            f.write('# Scenes\n' + '\n'.join(images) + '\n\n')
+
+        self.assertEqual(AvirisBatch.findImages(listFile), images)
+
+    # -------------------------------------------------------------------------
+    # testRun
+    # -------------------------------------------------------------------------
+    def testRun(self):
+
+        images = [self._createScene('a'), self._createScene('bb')]
+        model = CoefficientModel.read(AvirisBatchTestCase.COEF_FILE)
+
+        batch = AvirisBatch(model, images, self.outDir, numWorkers=2)
+        results = batch.run()
+
+        self.assertEqual([r['status'] for r in results],
+                         [AvirisBatch.DONE, AvirisBatch.DONE])
+
+        self.assertEqual(results[0]['pixels'], 12)
+
+        self.assertTrue(os.path.exists(os.path.join(self.outDir,
+                                                    'a_img',
+                                                    'a_img.tif')))
+
+        self.assertTrue('2 done, 0 skipped, 0 failed' in batch.summary())
+
+        # Outputs newer than the inputs are skipped.
+        results = batch.run()
+
+        self.assertEqual([r['status'] for r in results],
+                         [AvirisBatch.SKIPPED, AvirisBatch.SKIPPED])
+
+        # Outputs made with another model, mask or precision are made again.
+        coefFile = os.path.join(self.inDir, 'coefs.csv')
+
+        with open(AvirisBatchTestCase.COEF_FILE) as inFile, \
+                open(coefFile, 'w') as outFile:
+
+            outFile.write(inFile.read().replace('7117.4999029', '7000.0'))
+
+        edited = CoefficientModel.read(coefFile)
+        self.assertNotEqual(edited.fingerprint(), model.fingerprint())
+
+        for changed in [AvirisBatch(edited, images, self.outDir),
+                        AvirisBatch(model, images[:1], self.outDir,
+                                    mask='b245 < 0.02'),
+                        AvirisBatch(model, images[:1], self.outDir,
+                                    precision='float32'),
+                        AvirisBatch(model, images, self.outDir)]:
+
+            self.assertEqual(set(r['status'] for r in changed.run()),
+                             set([AvirisBatch.DONE]))
+
+        # An output older than its input is made again.
+        os.utime(os.path.join(self.outDir, 'bb_img', 'bb_img.tif'), (0, 0))
+        results = batch.run()
+
+        self.assertEqual([r['status'] for r in results],
+                         [AvirisBatch.SKIPPED, AvirisBatch.DONE])
+
+        # A bad scene fails without ending the batch.
+        os.remove(images[0] + '.hdr')
+        os.utime(os.path.join(self.outDir, 'a_img', 'a_img.tif'), (0, 0))
+        results = batch.run()
+
+        self.assertEqual(results[0]['status'], AvirisBatch.FAILED)
+        self.assertEqual(results[1]['status'], AvirisBatch.SKIPPED)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from projects.aviris_regression_algorithms.model import AvirisBenchmark \
+    as AvirisBenchmarkModule
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.AvirisBenchmark \
+    import AvirisBenchmark
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class AvirisBenchmarkTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_AvirisBenchmark
+# -----------------------------------------------------------------------------
+class AvirisBenchmarkTestCase(unittest.TestCase):
+
+    TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+    COEF_FILE = os.path.join(TEST_DIR, 'Chl_Coeff_input.csv')
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.workDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.workDir)
+
+    # -------------------------------------------------------------------------
+    # testCreateCube
+    # -------------------------------------------------------------------------
+    def testCreateCube(self):
+
+        cubes = {}
+
+        for interleave in ['bsq', 'bil', 'bip']:
+
+            imageFile = os.path.join(self.workDir, interleave + '.img')
+
+            AvirisBenchmark.createCube(imageFile, 9, 70, 4, interleave, 0.25)
+
+            cube = numpy.fromfile(imageFile, numpy.float32)
+
+            if interleave == 'bil':
+                cube = cube.reshape(70, 4, 9).transpose(1, 0, 2)
+
+            elif interleave == 'bip':
+                cube = cube.reshape(70, 9, 4).transpose(2, 0, 1)
+
+            else:
+                cube = cube.reshape(4, 70, 9)
+
+            cubes[interleave] = cube
+
+            with open(os.path.join(self.workDir,
+                                   interleave + '.hdr')) as f:
+
+                self.assertTrue('interleave = ' + interleave in f.read())
+
+        # The interleaves hold the same cube.
+        self.assertTrue((cubes['bsq'] == cubes['bil']).all())
+        self.assertTrue((cubes['bsq'] == cubes['bip']).all())
+
+        noData = cubes['bsq'] == ApplyAlgorithm.NO_DATA_VALUE
+        self.assertTrue((noData == noData[0]).all())
+        self.assertAlmostEqual(noData[0].mean(), 0.25, 1)
+
+        valid = cubes['bsq'][~noData]
+        self.assertTrue(valid.min() >= 0.02 and valid.max() <= 0.5)
+
+        with self.assertRaisesRegexp(RuntimeError, 'Invalid interleave'):
+            AvirisBenchmark.createCube(imageFile, 9, 7, 4, 'bis', 0.0)
+
+        with self.assertRaisesRegexp(RuntimeError, 'between 0 and 1'):
+            AvirisBenchmark.createCube(imageFile, 9, 7, 4, 'bsq', 2.0)
+
+    # -------------------------------------------------------------------------
+    # testRun
+    # -------------------------------------------------------------------------
+    def testRun(self):
+
+        cases = AvirisBenchmark.cases([(8, 20)], [12], ['bil'], [0.0, 0.5])
+        self.assertEqual(len(cases), 2)
+
+        benchmark = AvirisBenchmark(self.workDir,
+                                    repeats=2,
+                                    options={'maxBlockBytes': 1})
+
+        resultsPath = os.path.join(self.workDir, 'results.json')
+        results = benchmark.run(cases, resultsPath)
+
+        with open(resultsPath) as f:
+            self.assertEqual(json.load(f), json.loads(json.dumps(results)))
+
+        self.assertEqual(results['options'], {'maxBlockBytes': 1})
+        self.assertEqual(len(results['results']), 2)
+
+        for result in results['results']:
+
+            self.assertEqual(len(result['all seconds']), 2)
+            self.assertEqual(result['seconds'], min(result['all seconds']))
+            self.assertEqual(result['pixels'], 160)
+            self.assertEqual(result['bytes read'], 160 * 12 * 4)
+            self.assertTrue(result['pixels per second'] > 0)
+            self.assertTrue(result['MB per second'] > 0)
+            self.assertTrue(result['peak RSS bytes'] > 0)
+
+        # Cubes are kept for later benchmarks.
+        self.assertEqual(sorted(os.listdir(os.path.join(self.workDir,
+                                                        'cubes'))),
+                         ['8x20x12_bil_0.0.hdr',
+                          '8x20x12_bil_0.0.img',
+                          '8x20x12_bil_0.5.hdr',
+                          '8x20x12_bil_0.5.img'])
+
+        comparison = AvirisBenchmark.compare(results, results)
+        self.assertEqual([c['speedup'] for c in comparison], [1.0, 1.0])
+        self.assertTrue('8x20x12_bil_0.5' in AvirisBenchmark.summary(results))
+
+        # The coefficient model reads more bands than the cubes have.
+        benchmark = AvirisBenchmark(
+            self.workDir,
+            CoefficientModel.read(AvirisBenchmarkTestCase.COEF_FILE))
+
+        with self.assertRaisesRegexp(RuntimeError, 'has only 12 bands'):
+            benchmark.run(cases)
+
+        # A case whose process dies without a report fails.
+        timeCase = AvirisBenchmarkModule._timeCase
+        AvirisBenchmarkModule._timeCase = _exitCase
+
+        try:
+
+            with self.assertRaisesRegexp(RuntimeError, 'exited with code 3'):
+                AvirisBenchmark(self.workDir).run(cases[:1])
+
+        finally:
+            AvirisBenchmarkModule._timeCase = timeCase
+
+
+# -----------------------------------------------------------------------------
+# _exitCase
+#
+# This stands in for AvirisBenchmark's _timeCase, ending its process without
+# sending a report.
+# -----------------------------------------------------------------------------
+def _exitCase(model, imageFile, outDir, algorithmNames, options, connection):
+
+    os._exit(3)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy
+
+from projects.aviris_regression_algorithms.model.BandMath import BandMath
+
+
+# -----------------------------------------------------------------------------
+# class BandMathTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_BandMath
+# -----------------------------------------------------------------------------
+class BandMathTestCase(unittest.TestCase):
+
+    PROGRAM = 'red = b35\n' + \
+              'nir = b60\n' + \
+              'ndvi = (nir - red) / (nir + red)\n' + \
+              'ratio = nir / red; scaled = 2 * 0.5 * (b60 - b35)\n' + \
+              'water = b20 < 0.1 and b9 > 0.05'
+
+    # -------------------------------------------------------------------------
+    # testCompile
+    # -------------------------------------------------------------------------
+    def testCompile(self):
+
+        bm = BandMath(BandMathTestCase.PROGRAM)
+
+        self.assertEqual(bm.algorithmNames(),
+                         ['red', 'nir', 'ndvi', 'ratio', 'scaled', 'water'])
+
+        self.assertEqual(list(bm.bandIndices()), [9, 20, 35, 60])
+        self.assertEqual(list(bm.requiredBands()), [1, 9, 20, 35, 60])
+
+        # Only ndvi's operations are kept, and b60 - b35 is computed once.
+        reduced = bm.reduced(['ndvi', 'scaled'])
+        self.assertEqual(list(reduced.bandIndices()), [35, 60])
+
+        operations = [bm._nodes[i][0] for i in reduced._schedule()]
+        self.assertEqual(sorted(operations),
+                         ['add', 'band', 'band', 'const', 'div', 'mul',
+                          'sub'])
+
+        self.assertNotEqual(bm.fingerprint(), reduced.fingerprint())
+
+        with self.assertRaisesRegexp(RuntimeError, 'not in band math'):
+            bm.reduced(['evi'])
+
+        for program, message in [('x = b1 +', 'Invalid'),
+                                 ('x = y + 1', 'not defined'),
+                                 ('b5 = b1', 'cannot be used'),
+                                 ('x = sqrt(b1, b2)', 'takes 1'),
+                                 ('x = b1 % 2', 'Unsupported'),
+                                 ('x = b1; x = b2', 'more than once'),
+                                 ('x = b0', 'numbered from 1')]:
+
+            with self.assertRaisesRegexp(RuntimeError, message):
+                BandMath(program)
+
+    # -------------------------------------------------------------------------
+    # testEvaluate
+    # -------------------------------------------------------------------------
+    def testEvaluate(self):
+
+        bands = numpy.array([1, 9, 20, 35, 60])
+
+        stack = numpy.random.RandomState(0). \
+            uniform(0.02, 0.5, (5, 3, 4)).astype(numpy.float32)
+
+        red, nir = stack[3], stack[4]
+        bm = BandMath(BandMathTestCase.PROGRAM)
+
+        red_, nir_, ndvi, ratio, scaled, water = \
+            bm.evaluate(stack, bands, numpy.float64)
+
+        self.assertEqual(ndvi.dtype, numpy.float64)
+        self.assertTrue(numpy.allclose(ndvi, (nir - red) / (nir + red)))
+        self.assertTrue(numpy.allclose(ratio, nir / red))
+        self.assertTrue(numpy.allclose(scaled, nir - red))
+
+        self.assertTrue((water ==
+                         ((stack[2] < 0.1) & (stack[1] > 0.05))).all())
+
+        ndvi = bm.reduced(['ndvi']).evaluate(stack, bands)[0]
+        self.assertEqual(ndvi.dtype, numpy.float32)
+
+        bm = BandMath('where(b1 > 0.25, max(b1, 0.4), -abs(b1)) ** 2')
+        result = bm.evaluate(stack[:1], bands[:1])[0]
+
+        expected = numpy.where(stack[0] > 0.25,
+                               numpy.maximum(stack[0], 0.4),
+                               -stack[0]) ** 2
+
+        self.assertEqual(bm.algorithmNames(), ['result'])
+        self.assertTrue(numpy.allclose(result, expected))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# class CoefficientModelTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_CoefficientModel
+# -----------------------------------------------------------------------------
+class CoefficientModelTestCase(unittest.TestCase):
+
+    COEF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'Chl_Coeff_input.csv')
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # testFromCsv
+    # -------------------------------------------------------------------------
+    def testFromCsv(self):
+
+        model = CoefficientModel.fromCsv(CoefficientModelTestCase.COEF_FILE)
+
+        self.assertEqual(model.algorithmNames(), ['Avg Chl'])
+        self.assertAlmostEqual(model.intercept('Avg Chl'), 7117.4999029)
+        self.assertEqual(model.bandIndices()[0], 2)
+        self.assertEqual(model.bandIndices()[-1], 425)
+        self.assertEqual(len(model.coefficients('Avg Chl')), 372)
+        self.assertEqual(numpy.count_nonzero(model.coefficients('Avg Chl')),
+                         98)
+
+        self.assertEqual(model.divisorMask().sum(), 101)
+        self.assertEqual(model.maskBands(), (9, 245))
+
+        with self.assertRaisesRegexp(RuntimeError, 'not in coefficient'):
+            model.coefficients('Avg Car')
+
+    # -------------------------------------------------------------------------
+    # testSidecar
+    # -------------------------------------------------------------------------
+    def testSidecar(self):
+
+        coefFile = os.path.join(self.outDir, 'coefs.csv')
+        shutil.copy(CoefficientModelTestCase.COEF_FILE, coefFile)
+        sidecar = CoefficientModel.sidecarName(coefFile)
+
+        # Reading without writeSidecar leaves no sidecar.
+        CoefficientModel.read(coefFile)
+        self.assertFalse(os.path.exists(sidecar))
+
+        model = CoefficientModel.read(coefFile, True)
+        self.assertTrue(os.path.exists(sidecar))
+
+        # Remove the CSV's contents to ensure the sidecar is read.
+        open(coefFile, 'w').close()
+        os.utime(coefFile, (0, 0))
+        loaded = CoefficientModel.read(coefFile)
+
+        self.assertEqual(loaded.algorithmNames(), model.algorithmNames())
+        self.assertEqual(loaded.divisorRange(), model.divisorRange())
+        self.assertEqual(loaded.maskBands(), model.maskBands())
+
+        self.assertTrue((loaded.bandIndices() == model.bandIndices()).all())
+
+        self.assertTrue((loaded.coefficients('Avg Chl') ==
+                         model.coefficients('Avg Chl')).all())
+
+    # -------------------------------------------------------------------------
+    # testCoefficientMatrix
+    # -------------------------------------------------------------------------
+    def testCoefficientMatrix(self):
+
+        model = CoefficientModel(['a', 'b'],
+                                 [1.0, 2.0],
+                                 [5, 9, 245],
+                                 [[1.0, 4.0], [2.0, 5.0], [3.0, 6.0]])
+
+        self.assertEqual(model.coefficientMatrix(['b', 'a']).tolist(),
+                         [[4.0, 1.0], [5.0, 2.0], [6.0, 3.0]])
+
+        self.assertEqual(model.intercepts(['b', 'a']).tolist(), [2.0, 1.0])
+        self.assertEqual(model.divisorMask().tolist(), [True, True, False])
+
+        with self.assertRaisesRegexp(RuntimeError, 'shaped'):
+            CoefficientModel(['a'], [1.0], [5, 9], [[1.0]])
+
+    # -------------------------------------------------------------------------
+    # testRequiredBands
+    # -------------------------------------------------------------------------
+    def testRequiredBands(self):
+
+        model = CoefficientModel(['a', 'b'],
+                                 [1.0, 2.0],
+                                 [3, 5, 105, 106, 200, 300],
+                                 [[0.0, 1.0],
+                                  [0.0, 0.0],
+                                  [0.0, 0.0],
+                                  [1.0, 0.0],
+                                  [0.0, 0.0],
+                                  [0.0, 1.0]])
+
+        reduced = model.reduced(['a'])
+        self.assertEqual(reduced.algorithmNames(), ['a'])
+        self.assertEqual(reduced.bandIndices().tolist(), [5, 105, 106])
+
+        self.assertEqual(reduced.requiredBands().tolist(),
+                         [1, 5, 9, 105, 106, 245])
+
+        self.assertEqual(model.reduced(['b', 'a']).bandIndices().tolist(),
+                         [3, 5, 105, 106, 300])
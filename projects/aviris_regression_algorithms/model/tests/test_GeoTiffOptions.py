@@ -0,0 +1,72 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from projects.aviris_regression_algorithms.model.GeoTiffOptions \
+    import GeoTiffOptions
+
+
+# -----------------------------------------------------------------------------
+# class GeoTiffOptionsTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_GeoTiffOptions
+# -----------------------------------------------------------------------------
+class GeoTiffOptionsTestCase(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    # testCreationOptions
+    # -------------------------------------------------------------------------
+    def testCreationOptions(self):
+
+        self.assertEqual(GeoTiffOptions().creationOptions(), [])
+
+        self.assertEqual(GeoTiffOptions.cloudOptimized().creationOptions(),
+                         ['TILED=YES',
+                          'BLOCKXSIZE=512',
+                          'BLOCKYSIZE=512',
+                          'COMPRESS=DEFLATE',
+                          'PREDICTOR=3',
+                          'BIGTIFF=IF_SAFER'])
+
+        # A COG's working file is compressed only when it is copied.
+        self.assertEqual(GeoTiffOptions.cloudOptimized().workingOptions(),
+                         ['TILED=YES',
+                          'BLOCKXSIZE=512',
+                          'BLOCKYSIZE=512',
+                          'BIGTIFF=IF_SAFER'])
+
+        self.assertEqual(GeoTiffOptions(compress='lzw').workingOptions(),
+                         ['COMPRESS=LZW'])
+
+        # PACKBITS takes no predictor.
+        self.assertEqual(GeoTiffOptions(compress='packbits', predictor=2).
+                         creationOptions(),
+                         ['COMPRESS=PACKBITS'])
+
+        with self.assertRaisesRegexp(RuntimeError, 'multiple of 16'):
+            GeoTiffOptions(blockSize=100)
+
+        with self.assertRaisesRegexp(RuntimeError, 'must be tiled'):
+            GeoTiffOptions(cog=True)
+
+        with self.assertRaisesRegexp(RuntimeError, 'Compression'):
+            GeoTiffOptions(compress='JPEG2000')
+
+    # -------------------------------------------------------------------------
+    # testLevels
+    # -------------------------------------------------------------------------
+    def testLevels(self):
+
+        self.assertEqual(GeoTiffOptions().levels(5000, 3000), [])
+
+        self.assertEqual(GeoTiffOptions(overviewLevels=[2, 4]).
+                         levels(5000, 3000),
+                         [2, 4])
+
+        self.assertEqual(GeoTiffOptions.cloudOptimized().levels(5000, 3000),
+                         [2, 4, 8, 16])
+
+        self.assertEqual(GeoTiffOptions.cloudOptimized().levels(512, 100),
+                         [])
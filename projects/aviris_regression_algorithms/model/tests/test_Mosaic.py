@@ -0,0 +1,173 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from osgeo import gdal
+from osgeo.osr import SpatialReference
+
+from projects.aviris_regression_algorithms.model.AlgorithmKernel \
+    import AlgorithmKernel
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+from projects.aviris_regression_algorithms.model.Mosaic import Mosaic
+
+
+# -----------------------------------------------------------------------------
+# class MosaicTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_Mosaic
+# -----------------------------------------------------------------------------
+class MosaicTestCase(unittest.TestCase):
+
+    TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+    COEF_FILE = os.path.join(TEST_DIR, 'Chl_Coeff_input.csv')
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # _createScene
+    #
+    # This writes a 6 x 7 ENVI cube of 5 m pixels with a no-data pixel and a
+    # masked pixel, returning its path and its Avg Chl result.
+    # -------------------------------------------------------------------------
+    def _createScene(self, name, seed, ulx, uly):
+
+        cube = numpy.random.RandomState(seed). \
+            uniform(0.02, 0.5, (425, 6, 7)).astype(numpy.float32)
+
+        cube[:, 0, 0] = ApplyAlgorithm.NO_DATA_VALUE
+        cube[8, 1, 1] = 0.9
+        imageFile = os.path.join(self.outDir, name + '.img')
+        cube.tofile(imageFile)
+
+        with open(os.path.join(self.outDir, name + '.hdr'), 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = 7\n' +
+                    'lines = 6\n' +
+                    'bands = 425\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = bsq\n' +
+                    'byte order = 0\n' +
+                    'map info = {UTM, 1, 1, ' + str(ulx) + ', ' +
+                    str(uly) + ', 5.0, 5.0, 4, North, WGS-84}\n')
+
+        kernel = AlgorithmKernel(
+            CoefficientModel.read(MosaicTestCase.COEF_FILE))
+
+        return imageFile, kernel.applyAlgorithms(cube, ['Avg Chl'])[0][0]
+
+    # -------------------------------------------------------------------------
+    # test
+    # -------------------------------------------------------------------------
+    def test(self):
+
+        # The second scene is 3 columns east and 2 rows south of the first.
+        first, firstResult = self._createScene('first', 0, 583000, 7917730)
+        second, secondResult = self._createScene('second', 1, 583015, 7917720)
+        model = CoefficientModel.read(MosaicTestCase.COEF_FILE)
+        noData = ApplyAlgorithm.NO_DATA_VALUE
+
+        with self.assertRaisesRegexp(RuntimeError, 'overlap rule'):
+            Mosaic(model, [first, second], 'mosaic.tif', rule='max')
+
+        # The scenes' 5 m pixels are not a size in degrees.
+        geographic = SpatialReference()
+        geographic.ImportFromEPSG(4326)
+
+        with self.assertRaisesRegexp(RuntimeError, 'pixel size'):
+            Mosaic(model, [first, second], 'mosaic.tif', srs=geographic)
+
+        # Each scene's result and validity on the 10 x 8 mosaic grid
+        onGrid = numpy.full((2, 8, 10), noData, numpy.float32)
+        onGrid[0, 0:6, 0:7] = firstResult
+        onGrid[1, 2:8, 3:10] = secondResult
+        valid = onGrid != noData
+
+        # The distance of each scene's pixels from its edges
+        rows, cols = numpy.mgrid[0:6, 0:7]
+
+        distance = numpy.minimum(numpy.minimum(cols, 6 - cols),
+                                 numpy.minimum(rows, 5 - rows))
+
+        quality = numpy.full((2, 8, 10), -1)
+        quality[0, 0:6, 0:7] = distance
+        quality[1, 2:8, 3:10] = distance
+        quality[~valid] = -1
+
+        with numpy.errstate(invalid='ignore'):
+
+            mean = numpy.where(valid.any(axis=0),
+                               numpy.where(valid, onGrid, 0.0).sum(axis=0) /
+                               valid.sum(axis=0),
+                               noData)
+
+        expected = {
+            Mosaic.FIRST: numpy.where(valid[0], onGrid[0], onGrid[1]),
+            Mosaic.LAST: numpy.where(valid[1], onGrid[1], onGrid[0]),
+            Mosaic.MEAN: mean,
+            Mosaic.BEST: numpy.where(quality[1] > quality[0],
+                                     onGrid[1],
+                                     onGrid[0])}
+
+        # The tiles written, all but the two at the unshared corners
+        written = numpy.ones((8, 10), numpy.bool_)
+        written[0:2, 8:10] = False
+        written[6:8, 0:2] = False
+
+        for rule in Mosaic.RULES:
+
+            for numWorkers in [1, 2]:
+
+                outPath = os.path.join(self.outDir, rule + '.tif')
+
+                mosaic = Mosaic(model,
+                                [first, second],
+                                outPath,
+                                rule=rule,
+                                tileSize=2,
+                                numWorkers=numWorkers)
+
+                self.assertEqual(mosaic.size(), (10, 8))
+
+                self.assertEqual(mosaic.geoTransform(),
+                                 (583000.0, 5.0, 0.0, 7917730.0, 0.0, -5.0))
+
+                report = mosaic.run()
+
+                # Of the 20 tiles, the two at the unshared corners are
+                # beyond both scenes.
+                self.assertEqual(report['Tiles overlapped'], 18)
+                self.assertEqual(report['Tiles written'], 18)
+
+                ds = gdal.Open(outPath)
+                band = ds.GetRasterBand(1)
+                self.assertEqual(band.GetDescription(), 'Avg Chl')
+                result = band.ReadAsArray()
+
+                numpy.testing.assert_allclose(result[written],
+                                              expected[rule][written],
+                                              rtol=1e-6)
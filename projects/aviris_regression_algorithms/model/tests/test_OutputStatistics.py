@@ -0,0 +1,185 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from projects.aviris_regression_algorithms.model.OutputStatistics \
+    import OutputStatistics
+
+
+# -----------------------------------------------------------------------------
+# class OutputStatisticsTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_OutputStatistics
+# -----------------------------------------------------------------------------
+class OutputStatisticsTestCase(unittest.TestCase):
+
+    NO_DATA_VALUE = -9999.0
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+        self.values = numpy.random.RandomState(0). \
+            normal(5.0, 2.0, (12, 10)).astype(numpy.float32)
+
+        self.values[0, :3] = OutputStatisticsTestCase.NO_DATA_VALUE
+        self.values[4, 4] = numpy.nan
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # _accumulate
+    #
+    # This returns the statistics of self.values added in strips of the given
+    # numbers of rows.
+    # -------------------------------------------------------------------------
+    def _accumulate(self, rows):
+
+        stats = OutputStatistics()
+
+        for first in range(0, self.values.shape[0], rows):
+
+            stats.add(self.values[first:first + rows],
+                      OutputStatisticsTestCase.NO_DATA_VALUE)
+
+        return stats
+
+    # -------------------------------------------------------------------------
+    # testAdd
+    # -------------------------------------------------------------------------
+    def testAdd(self):
+
+        stats = self._accumulate(self.values.shape[0])
+
+        valid = self.values[numpy.isfinite(self.values) &
+                            (self.values !=
+                             OutputStatisticsTestCase.NO_DATA_VALUE)]. \
+            astype(numpy.float64)
+
+        self.assertEqual(stats.pixels, 120)
+        self.assertEqual(stats.count, 116)
+        self.assertEqual(stats.minimum, valid.min())
+        self.assertEqual(stats.maximum, valid.max())
+        self.assertAlmostEqual(stats.mean, valid.mean(), 12)
+        self.assertAlmostEqual(stats.stddev(), valid.std(), 12)
+
+        start, end, counts = stats.histogram()
+        self.assertEqual(len(counts), OutputStatistics.BUCKETS)
+        self.assertEqual(sum(counts), 116)
+        self.assertTrue(start <= valid.min() and valid.max() < end)
+
+        expected = numpy.histogram(valid, len(counts), (start, end))[0]
+        self.assertEqual(counts, list(expected))
+
+        # Nothing valid
+        empty = OutputStatistics()
+        empty.add(numpy.full((2, 2), OutputStatisticsTestCase.NO_DATA_VALUE),
+                  OutputStatisticsTestCase.NO_DATA_VALUE)
+
+        self.assertEqual(empty.pixels, 4)
+        self.assertEqual(empty.count, 0)
+        self.assertIsNone(empty.histogram())
+        self.assertIsNone(empty.summary()['mean'])
+
+        # A constant
+        constant = OutputStatistics()
+        constant.add(numpy.full((2, 2), 3.0))
+        self.assertEqual(constant.stddev(), 0.0)
+        self.assertEqual(constant.histogram()[2][0], 4)
+
+    # -------------------------------------------------------------------------
+    # testMerge
+    # -------------------------------------------------------------------------
+    def testMerge(self):
+
+        whole = self._accumulate(self.values.shape[0])
+
+        for rows in [1, 3, 5]:
+
+            stats = self._accumulate(rows)
+
+            self.assertEqual(stats.pixels, whole.pixels)
+            self.assertEqual(stats.count, whole.count)
+            self.assertEqual(stats.minimum, whole.minimum)
+            self.assertEqual(stats.maximum, whole.maximum)
+            self.assertAlmostEqual(stats.mean, whole.mean, 12)
+            self.assertAlmostEqual(stats.stddev(), whole.stddev(), 12)
+            self.assertEqual(stats.histogram(), whole.histogram())
+
+        # Partial statistics merge in any order.
+        left = OutputStatistics()
+        left.add(self.values[6:], OutputStatisticsTestCase.NO_DATA_VALUE)
+        right = OutputStatistics()
+        right.add(self.values[:6], OutputStatisticsTestCase.NO_DATA_VALUE)
+        left.merge(right)
+
+        self.assertEqual(left.histogram(), whole.histogram())
+        self.assertAlmostEqual(left.stddev(), whole.stddev(), 12)
+
+        # Blocks of one pixel, alone or merged together first, do not change
+        # the histogram.
+        for pixels in [self.values.ravel(), self.values.ravel()[::-1]]:
+
+            stats = OutputStatistics()
+
+            for pixel in pixels:
+
+                stats.add(numpy.array([pixel]),
+                          OutputStatisticsTestCase.NO_DATA_VALUE)
+
+            self.assertEqual(stats.histogram(), whole.histogram())
+
+        first = OutputStatistics()
+
+        for pixel in self.values[0]:
+
+            first.add(numpy.array([pixel]),
+                      OutputStatisticsTestCase.NO_DATA_VALUE)
+
+        first.add(self.values[1:6], OutputStatisticsTestCase.NO_DATA_VALUE)
+
+        stats = OutputStatistics()
+        stats.add(self.values[6:], OutputStatisticsTestCase.NO_DATA_VALUE)
+        stats.merge(first)
+        self.assertEqual(stats.histogram(), whole.histogram())
+
+        with self.assertRaisesRegexp(RuntimeError, 'different numbers'):
+            left.merge(OutputStatistics(16))
+
+    # -------------------------------------------------------------------------
+    # testWrite
+    # -------------------------------------------------------------------------
+    def testWrite(self):
+
+        stats = self._accumulate(4)
+        path = os.path.join(self.outDir, 'out' + OutputStatistics.EXTENSION)
+        OutputStatistics.write(path, {'Avg Chl': stats})
+
+        with open(path) as f:
+            written = json.load(f)
+
+        self.assertEqual(list(written), ['Avg Chl'])
+        self.assertEqual(written['Avg Chl']['count'], 116)
+        self.assertEqual(written['Avg Chl']['minimum'], stats.minimum)
+
+        self.assertEqual(written['Avg Chl']['histogram']['counts'],
+                         stats.histogram()[2])
+
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
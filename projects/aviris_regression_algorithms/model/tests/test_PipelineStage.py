@@ -0,0 +1,116 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from projects.aviris_regression_algorithms.model.PipelineStage \
+    import PipelineStage
+
+
+# -----------------------------------------------------------------------------
+# class PipelineStageTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_PipelineStage
+# -----------------------------------------------------------------------------
+class PipelineStageTestCase(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    # testRead
+    # -------------------------------------------------------------------------
+    def testRead(self):
+
+        with self.assertRaisesRegexp(RuntimeError, 'at least one'):
+            PipelineStage(0)
+
+        reader = PipelineStage(2)
+        self.assertEqual(list(reader.read(iter(range(10)))), list(range(10)))
+
+        # A slow consumer leaves the reader waiting for room.
+        reader = PipelineStage(1)
+
+        for item in reader.read(iter(range(3))):
+            time.sleep(0.05)
+
+        self.assertTrue(reader.threadStall > 0.05)
+
+        # An exception while reading is raised in the caller.
+        def failing():
+
+            yield 1
+            raise IOError('Unable to read')
+
+        reader = PipelineStage(2)
+
+        with self.assertRaisesRegexp(IOError, 'Unable to read'):
+            list(reader.read(failing()))
+
+        # Abandoning the items stops the reader.
+        read = []
+
+        def counting():
+
+            for i in range(100):
+
+                read.append(i)
+                yield i
+
+        reader = PipelineStage(2)
+        items = reader.read(counting())
+        self.assertEqual(next(items), 0)
+        items.close()
+
+        self.assertFalse(reader._thread.is_alive())
+        self.assertTrue(len(read) < 10)
+
+    # -------------------------------------------------------------------------
+    # testWrite
+    # -------------------------------------------------------------------------
+    def testWrite(self):
+
+        written = []
+
+        def write(index, value, out):
+
+            time.sleep(0.01)
+            out.append((index, value))
+
+        writer = PipelineStage(2)
+        writer.write(write, written)
+
+        for i in range(5):
+            writer.put(i, i * i)
+
+        writer.finish()
+
+        self.assertEqual(written, [(i, i * i) for i in range(5)])
+        self.assertTrue(writer.callerStall > 0)
+
+        # An exception while writing is raised in the caller.
+        def failing(index):
+
+            if index == 1:
+                raise IOError('Unable to write')
+
+        writer = PipelineStage(1)
+        writer.write(failing)
+
+        with self.assertRaisesRegexp(IOError, 'Unable to write'):
+
+            for i in range(10):
+                writer.put(i)
+
+            writer.finish()
+
+        # Stopping abandons the items queued.
+        written = []
+        writer = PipelineStage(5)
+        writer.write(write, written)
+
+        for i in range(5):
+            writer.put(i, i)
+
+        writer.stop()
+        self.assertFalse(writer._thread.is_alive())
+        self.assertTrue(len(written) < 5)
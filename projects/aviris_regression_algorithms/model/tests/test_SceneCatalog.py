@@ -0,0 +1,179 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from osgeo import gdal
+from osgeo.osr import SpatialReference
+
+from model.Envelope import Envelope
+
+from projects.aviris_regression_algorithms.model.SceneCatalog \
+    import SceneCatalog
+
+
+# -----------------------------------------------------------------------------
+# class SceneCatalogTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_SceneCatalog
+# -----------------------------------------------------------------------------
+class SceneCatalogTestCase(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # _createScene
+    #
+    # This writes a geographic, 2-band ENVI scene of 0.01-degree pixels,
+    # rotated by the given degrees.
+    # -------------------------------------------------------------------------
+    def _createScene(self, name, west, north, rows, cols, rotation=0):
+
+        imagePath = os.path.join(self.outDir, name + '_img')
+        numpy.zeros((2, rows, cols), numpy.float32).tofile(imagePath)
+
+        with open(imagePath + '.hdr', 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = ' + str(cols) + '\n' +
+                    'lines = ' + str(rows) + '\n' +
+                    'bands = 2\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = bil\n' +
+                    'byte order = 0\n' +
+                    'map info = {Geographic Lat/Lon, 1, 1, ' +
+                    str(west) + ', ' + str(north) +
+                    ', 0.01, 0.01, WGS-84, rotation=' +
+                    str(rotation) + '}\n')
+
+        return imagePath
+
+    # -------------------------------------------------------------------------
+    # _envelope
+    # -------------------------------------------------------------------------
+    def _envelope(self, west, north, east, south):
+
+        srs = SpatialReference()
+        srs.ImportFromEPSG(4326)
+        envelope = Envelope()
+        envelope.addPoint(west, north, 0, srs)
+        envelope.addPoint(east, south, 0, srs)
+
+        return envelope
+
+    # -------------------------------------------------------------------------
+    # test
+    # -------------------------------------------------------------------------
+    def test(self):
+
+        first = self._createScene('first', -150.0, 65.0, 10, 20)
+        second = self._createScene('second', -149.9, 64.95, 10, 20)
+        catalogPath = os.path.join(self.outDir, 'scenes.db')
+        catalog = SceneCatalog(catalogPath)
+
+        counts = catalog.refresh([first, second])
+        self.assertEqual(counts['added'], 2)
+
+        scene = catalog.scenes()[0]
+        self.assertEqual(scene['path'], first)
+        self.assertEqual(scene['samples'], 20)
+        self.assertEqual(scene['lines'], 10)
+        self.assertEqual(scene['bands'], 2)
+        self.assertEqual(scene['interleave'], 'bil')
+
+        # The R*Tree keeps extents in single precision, rounded outward.
+        self.assertAlmostEqual(scene['east'], -149.8, 4)
+        self.assertAlmostEqual(scene['south'], 64.9, 4)
+
+        # Each scene alone, both, then neither
+        found = catalog.query(self._envelope(-149.99, 64.99, -149.95, 64.96))
+        self.assertEqual([s['path'] for s in found], [first])
+
+        found = catalog.query(self._envelope(-149.75, 64.9, -149.71, 64.86))
+        self.assertEqual([s['path'] for s in found], [second])
+
+        found = catalog.query(self._envelope(-149.85, 64.94, -149.8, 64.9))
+        self.assertEqual([s['path'] for s in found], [first, second])
+
+        found = catalog.query(self._envelope(-140.0, 60.0, -139.0, 59.0))
+        self.assertEqual(found, [])
+
+        # A batch finds only its own scenes, not others catalogued earlier.
+        found = catalog.query(self._envelope(-149.85, 64.94, -149.8, 64.9),
+                              [second])
+
+        self.assertEqual([s['path'] for s in found], [second])
+        catalog.close()
+
+        # Only changed scenes are read again, and missing ones are removed.
+        catalog = SceneCatalog(catalogPath)
+        later = time.time() + 10
+        os.utime(second, (later, later))
+        os.remove(first)
+
+        counts = catalog.refresh([second])
+        self.assertEqual(counts['updated'], 1)
+        self.assertEqual(counts['removed'], 1)
+        self.assertEqual([s['path'] for s in catalog.scenes()], [second])
+
+        counts = catalog.refresh([second])
+        self.assertEqual(counts['unchanged'], 1)
+        self.assertEqual(counts['updated'], 0)
+
+        # A rotated strip is found where its footprint meets the area, not
+        # everywhere in its extent.
+        strip = self._createScene('strip', -140.0, 60.0, 4, 100, 45)
+        catalog.refresh([second, strip])
+        scene = catalog.query(self._envelope(-141.0, 61.0, -139.0, 59.0))[0]
+        self.assertEqual(scene['path'], strip)
+
+        xform = gdal.Open(strip).GetGeoTransform()
+
+        vertices = [gdal.ApplyGeoTransform(xform, x, y)
+                    for x, y in [(0, 0), (100, 0), (100, 4), (0, 4)]]
+
+        # The corner of the extent farthest from the strip
+        x, y = max([(scene['west'], scene['north']),
+                    (scene['east'], scene['north']),
+                    (scene['east'], scene['south']),
+                    (scene['west'], scene['south'])],
+                   key=lambda c: min(math.hypot(c[0] - vx, c[1] - vy)
+                                     for vx, vy in vertices))
+
+        dx = 0.05 if x == scene['west'] else -0.05
+        dy = 0.05 if y == scene['south'] else -0.05
+
+        corner = self._envelope(min(x, x + dx),
+                                max(y, y + dy),
+                                max(x, x + dx),
+                                min(y, y + dy))
+
+        self.assertEqual(catalog.query(corner), [])
+
+        cx = (scene['west'] + scene['east']) / 2.0
+        cy = (scene['south'] + scene['north']) / 2.0
+        center = self._envelope(cx - 0.01, cy + 0.01, cx + 0.01, cy - 0.01)
+
+        self.assertEqual([s['path'] for s in catalog.query(center)], [strip])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from model.EnviImageFile import EnviImageFile
+
+from projects.aviris_regression_algorithms.model.SceneLayers \
+    import SceneLayers
+
+
+# -----------------------------------------------------------------------------
+# class SceneLayersTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_SceneLayers
+# -----------------------------------------------------------------------------
+class SceneLayersTestCase(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # test
+    # -------------------------------------------------------------------------
+    def test(self):
+
+        # A 5 x 13, 1-band image, so rows end mid-byte
+        imagePath = os.path.join(self.outDir, 'scene.img')
+        numpy.zeros((5, 13), numpy.float32).tofile(imagePath)
+
+        with open(os.path.join(self.outDir, 'scene.hdr'), 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = 13\n' +
+                    'lines = 5\n' +
+                    'bands = 1\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = bsq\n' +
+                    'byte order = 0\n')
+
+        imageFile = EnviImageFile(imagePath)
+
+        with self.assertRaisesRegexp(RuntimeError, 'not an existing'):
+            SceneLayers(os.path.join(self.outDir, 'none'), imageFile, 'm')
+
+        layers = SceneLayers(self.outDir, imageFile, 'b1 > 0', [6, 7, 8])
+        self.assertFalse(layers.exists())
+
+        state = numpy.random.RandomState(0)
+        noData = state.rand(5, 13) > 0.5
+        masked = state.rand(5, 13) > 0.5
+        divisor = state.rand(5, 13)
+
+        # Tiles of 5 x 2 share bytes with their neighbors.
+        layers.create()
+
+        for xOff in range(0, 13, 5):
+
+            for yOff in range(0, 5, 2):
+
+                window = (slice(yOff, yOff + 2), slice(xOff, xOff + 5))
+
+                layers.write(xOff,
+                             yOff,
+                             noData[window],
+                             masked[window],
+                             divisor[window])
+
+        self.assertFalse(layers.exists())
+        layers.finish()
+        self.assertTrue(layers.exists())
+
+        read = SceneLayers(self.outDir, imageFile, 'b1 > 0', [6, 7, 8])
+        readNoData, readMasked, readDivisor = read.read(3, 1, 9, 3)
+        self.assertTrue((readNoData == noData[1:4, 3:12]).all())
+        self.assertTrue((readMasked == masked[1:4, 3:12]).all())
+        self.assertTrue((readDivisor == divisor[1:4, 3:12]).all())
+
+        # Another mask has its own flags, and no divisor bands, no divisor.
+        other = SceneLayers(self.outDir, imageFile, 'b1 < 0')
+        self.assertFalse(other.exists())
+        self.assertEqual(len(other.paths()), 1)
+        self.assertNotEqual(other.paths()[0], layers.paths()[0])
+
+        other.create()
+        other.abandon()
+        self.assertEqual(sorted(os.listdir(self.outDir)),
+                         sorted(['scene.img', 'scene.hdr'] +
+                                [os.path.basename(p)
+                                 for p in layers.paths()]))
+
+        # The layers are stale once the image changes.
+        later = time.time() + 10
+        os.utime(imagePath, (later, later))
+        self.assertFalse(layers.exists())
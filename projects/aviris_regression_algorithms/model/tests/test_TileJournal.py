@@ -0,0 +1,64 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from projects.aviris_regression_algorithms.model.TileJournal \
+    import TileJournal
+
+
+# -----------------------------------------------------------------------------
+# class TileJournalTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_TileJournal
+# -----------------------------------------------------------------------------
+class TileJournalTestCase(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.outDir, 'out.tif.journal')
+        self.header = {'image': 'cube.img', 'blocks': [(0, 0, 7, 2)]}
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # test
+    # -------------------------------------------------------------------------
+    def test(self):
+
+        journal = TileJournal(self.path, self.header)
+        self.assertEqual(journal.start(), 0)
+        self.assertEqual(journal.completed(), 0)
+
+        journal.record(0)
+        journal.record(2)
+
+        # A partial last line is ignored.
+        with open(self.path, 'a') as f:
+            f.write('3')
+
+        journal = TileJournal(self.path, self.header)
+        self.assertEqual(journal.completed(), 3)
+        self.assertEqual(journal.start(), 3)
+
+        # A different run starts over.
+        otherRun = TileJournal(self.path, {'image': 'other.img'})
+        self.assertEqual(otherRun.completed(), 0)
+        self.assertEqual(otherRun.start(), 0)
+        self.assertEqual(journal.completed(), 0)
+
+        otherRun.remove()
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from model.EnviImageFile import EnviImageFile
+
+from projects.aviris_regression_algorithms.model.ValidityIndex \
+    import ValidityIndex
+
+
+# -----------------------------------------------------------------------------
+# class ValidityIndexTestCase
+#
+# python -m unittest projects.aviris_regression_algorithms.
+# model.tests.test_ValidityIndex
+# -----------------------------------------------------------------------------
+class ValidityIndexTestCase(unittest.TestCase):
+
+    # -------------------------------------------------------------------------
+    # setUp
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.outDir = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    # tearDown
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.outDir)
+
+    # -------------------------------------------------------------------------
+    # test
+    # -------------------------------------------------------------------------
+    def test(self):
+
+        # A diagonal strip of valid pixels in a 7 x 9, 2-band BIL image
+        cube = numpy.full((2, 7, 9), -9999.0, numpy.float32)
+
+        for row in range(7):
+            cube[:, row, row:row + 2] = 0.5
+
+        imagePath = os.path.join(self.outDir, 'strip.img')
+        cube.transpose(1, 0, 2).tofile(imagePath)
+
+        with open(os.path.join(self.outDir, 'strip.hdr'), 'w') as f:
+
+            f.write('ENVI\n' +
+                    'samples = 9\n' +
+                    'lines = 7\n' +
+                    'bands = 2\n' +
+                    'header offset = 0\n' +
+                    'file type = ENVI Standard\n' +
+                    'data type = 4\n' +
+                    'interleave = bil\n' +
+                    'byte order = 0\n')
+
+        imageFile = EnviImageFile(imagePath)
+        index = ValidityIndex.build(imageFile, 1, -9999.0, 3)
+
+        self.assertEqual(index.counts.tolist(),
+                         [[5, 1, 0], [0, 5, 1], [0, 0, 2]])
+
+        self.assertEqual(index.validPixels(), 14)
+        self.assertTrue(index.isEmpty(6, 0, 3, 3))
+        self.assertTrue(index.isEmpty(0, 3, 3, 4))
+        self.assertFalse(index.isEmpty(5, 0, 3, 3))
+        self.assertFalse(index.isEmpty(0, 2, 3, 2))
+
+        # Strips split into runs of empty and valid cells.
+        self.assertEqual(index.splitColumns(0, 3, 9, 3),
+                         [(0, 3, 3, 3), (3, 3, 6, 3)])
+
+        self.assertEqual(index.splitColumns(1, 6, 8, 1),
+                         [(1, 6, 5, 1), (6, 6, 3, 1)])
+
+        self.assertEqual(index.splitColumns(0, 0, 9, 7), [(0, 0, 9, 7)])
+
+        # The saved index is reused until the image changes.
+        indexPath = os.path.join(self.outDir,
+                                 'strip' + ValidityIndex.EXTENSION)
+        self.assertEqual(ValidityIndex.read(indexPath, imageFile), None)
+        index.write(indexPath)
+
+        read = ValidityIndex.read(indexPath, imageFile)
+        self.assertEqual(read.cellSize, 3)
+        self.assertTrue((read.counts == index.counts).all())
+
+        later = time.time() + 10
+        os.utime(imagePath, (later, later))
+        self.assertEqual(ValidityIndex.read(indexPath, imageFile), None)
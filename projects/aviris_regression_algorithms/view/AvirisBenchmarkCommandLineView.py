@@ -0,0 +1,173 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import sys
+
+from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
+    import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.AvirisBenchmark \
+    import AvirisBenchmark
+from projects.aviris_regression_algorithms.model.BandMath import BandMath
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+
+
+# -----------------------------------------------------------------------------
+# main
+#
+# cd /att/nobackup/rlgill/innovation-lab/
+# export PYTHONPATH=`pwd`
+# projects/aviris_regression_algorithms/view/AvirisBenchmarkCommandLineView.py -o /att/nobackup/rlgill/AVIRIS/benchmark --sizes 1024x1024 --interleaves bil bip -r /att/nobackup/rlgill/AVIRIS/benchmark/new.json --baseline /att/nobackup/rlgill/AVIRIS/benchmark/old.json
+# -----------------------------------------------------------------------------
+def main():
+
+    # Process command-line args.
+    desc = 'This application times the AVIRIS algorithms on synthetic cubes.'
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('-a',
+                        nargs='+',
+                        help='Names of algorithms to apply.  The default ' +
+                             'is every algorithm in the model.')
+
+    parser.add_argument('--bands',
+                        nargs='+',
+                        type=int,
+                        default=AvirisBenchmark.DEFAULT_BANDS,
+                        help='Band counts of the cubes')
+
+    parser.add_argument('--baseline',
+                        help='Results of an earlier benchmark, like one of ' +
+                             'another commit, to compare with')
+
+    modelGroup = parser.add_mutually_exclusive_group()
+
+    modelGroup.add_argument('-c',
+                            help='Path to coefficient CSV file or its ' +
+                                 'compiled sidecar.  The default is a ' +
+                                 'synthetic regression over every band of ' +
+                                 'each cube.')
+
+    modelGroup.add_argument('-e',
+                            help='Band math program, or a file of one, to ' +
+                                 'apply instead of a coefficient file')
+
+    parser.add_argument('--interleaves',
+                        nargs='+',
+                        choices=['bsq', 'bil', 'bip'],
+                        default=AvirisBenchmark.DEFAULT_INTERLEAVES,
+                        help='Interleaves of the cubes')
+
+    parser.add_argument('-m',
+                        type=int,
+                        default=ApplyAlgorithm.DEFAULT_MAX_BLOCK_BYTES //
+                        (1024 * 1024),
+                        help='Memory budget for one block of the band ' +
+                             'stack, in megabytes, per worker')
+
+    parser.add_argument('--no_data',
+                        nargs='+',
+                        type=float,
+                        default=AvirisBenchmark.DEFAULT_NO_DATA_FRACTIONS,
+                        help='Fractions of the cubes\' pixels that are ' +
+                             'no-data')
+
+    parser.add_argument('-o',
+                        default='.',
+                        help='Directory in which cubes are kept for later ' +
+                             'benchmarks and outputs are written')
+
+    parser.add_argument('--precision',
+                        choices=ApplyAlgorithm.PRECISIONS,
+                        default='float64',
+                        help='Precision of the computation')
+
+    parser.add_argument('--prefetch',
+                        type=int,
+                        default=0,
+                        help='Blocks read ahead and results queued for ' +
+                             'writing.  Up to 2 * prefetch + 1 blocks ' +
+                             'share the block memory budget.')
+
+    parser.add_argument('-r',
+                        help='Path to which to write the results as JSON.  ' +
+                             'The default is <-o>/benchmark.json.')
+
+    parser.add_argument('--repeats',
+                        type=int,
+                        default=1,
+                        help='Times to run each case, keeping the fastest')
+
+    parser.add_argument('--sizes',
+                        nargs='+',
+                        default=['x'.join(str(n) for n in size)
+                                 for size in AvirisBenchmark.DEFAULT_SIZES],
+                        help='Sizes of the cubes, as "samplesxlines", like ' +
+                             '"1024x4096"')
+
+    parser.add_argument('--skip_empty',
+                        action='store_true',
+                        help='Skip blocks without valid pixels')
+
+    parser.add_argument('-w',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes')
+
+    args = parser.parse_args()
+
+    model = None
+
+    if args.e:
+
+        model = BandMath(open(args.e).read() if os.path.isfile(args.e)
+                         else args.e)
+
+    elif args.c:
+
+        model = CoefficientModel.read(args.c)
+
+    try:
+        sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes]
+
+    except ValueError:
+        raise RuntimeError('Sizes must be like "1024x4096".')
+
+    options = {'maxBlockBytes': args.m * 1024 * 1024,
+               'numWorkers': args.w,
+               'precision': args.precision,
+               'skipEmpty': args.skip_empty,
+               'prefetchDepth': args.prefetch}
+
+    benchmark = AvirisBenchmark(args.o, model, args.a, args.repeats, None,
+                                options)
+
+    results = benchmark.run(AvirisBenchmark.cases(sizes,
+                                                  args.bands,
+                                                  args.interleaves,
+                                                  args.no_data),
+                            args.r or os.path.join(args.o, 'benchmark.json'))
+
+    print (AvirisBenchmark.summary(results))
+
+    if args.baseline:
+
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        for comparison in AvirisBenchmark.compare(baseline, results):
+
+            print (comparison['case'] +
+                   ': ' +
+                   '%.2f' % comparison['speedup'] +
+                   'x the baseline\'s speed')
+
+
+# ------------------------------------------------------------------------------
+# Invoke the main
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main())
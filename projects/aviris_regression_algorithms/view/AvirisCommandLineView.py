@@ -2,11 +2,32 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import csv
 import glob
+import os
 import sys
 
+from osgeo import ogr
+from osgeo.osr import SpatialReference
+
+from model.Envelope import Envelope
+
+from projects.aviris_regression_algorithms.model.AlgorithmKernel \
+    import AlgorithmKernel
 from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
     import ApplyAlgorithm
+from projects.aviris_regression_algorithms.model.ApplyAlgorithmCelery \
+    import ApplyAlgorithmCelery
+from projects.aviris_regression_algorithms.model.AvirisBatch \
+    import AvirisBatch
+from projects.aviris_regression_algorithms.model.BandMath import BandMath
+from projects.aviris_regression_algorithms.model.CoefficientModel \
+    import CoefficientModel
+from projects.aviris_regression_algorithms.model.GeoTiffOptions \
+    import GeoTiffOptions
+from projects.aviris_regression_algorithms.model.Mosaic import Mosaic
+from projects.aviris_regression_algorithms.model.SceneCatalog \
+    import SceneCatalog
 
 
 # -----------------------------------------------------------------------------
@@ -19,6 +40,8 @@ from projects.aviris_regression_algorithms.model.ApplyAlgorithm \
 # projects/aviris_regression_algorithms/view/AvirisCommandLineView.py -a 'Avg Chl' -c /att/nobackup/rlgill/AVIRIS/Chl_Coeff_input.csv -i /att/nobackup/rlgill/AVIRIS/test/ang20170624t181530_rdn_v2p9/clipTest.img -o /att/nobackup/rlgill/AVIRIS/test/output -d 1 1
 #
 # projects/aviris_regression_algorithms/view/AvirisCommandLineView.py -a 'Avg Chl' -c /att/nobackup/rlgill/AVIRIS/Chl_Coeff_input.csv -i /att/pubrepo/ABoVE/archived_data/ORNL/ABoVE_Airborne_AVIRIS_NG/data/ang20180819t010027/ang20180819t010027_rdn_v2r2/ang20180819t010027_rdn_v2r2_img -o /att/nobackup/rlgill/AVIRIS/test/output
+#
+# projects/aviris_regression_algorithms/view/AvirisCommandLineView.py -a 'Avg Chl' -c /att/nobackup/rlgill/AVIRIS/Chl_Coeff_input.csv -b '/att/pubrepo/ABoVE/archived_data/ORNL/ABoVE_Airborne_AVIRIS_NG/data/*/*_rdn_*/*_img' -o /att/nobackup/rlgill/AVIRIS/test/output -w 20
 # -----------------------------------------------------------------------------
 def main():
 
@@ -26,35 +49,600 @@ def main():
     desc = 'This application runs the AVIRIS algorithm prototype.'
     parser = argparse.ArgumentParser(description=desc)
 
-    parser.add_argument('-a',
-                        required=True,
-                        help='Name of algorithm in coefficient file to apply')
+    algGroup = parser.add_mutually_exclusive_group(required=True)
+
+    algGroup.add_argument('-a',
+                          nargs='+',
+                          help='Names of algorithms in coefficient file to ' +
+                               'apply in one pass over the image')
+
+    algGroup.add_argument('--all',
+                          action='store_true',
+                          help='Apply every algorithm in the coefficient ' +
+                               'file in one pass over the image')
+
+    parser.add_argument('--accuracy',
+                        action='store_true',
+                        help='Instead of writing the outputs, compare the ' +
+                             'algorithms computed in float32 to float64, ' +
+                             'writing <image>_precision.csv')
+
+    parser.add_argument('--aoi',
+                        nargs='+',
+                        help='Area of interest to process, as "ulx uly lrx ' +
+                             'lry" or a polygon\'s WKT, or a file of it.  ' +
+                             'The outputs are cropped to it.  In batch ' +
+                             'mode, each scene is, and scenes outside it ' +
+                             'are skipped.  It cannot be used with --mosaic.')
+
+    parser.add_argument('--aoi_epsg',
+                        type=int,
+                        help='EPSG code of the area of interest\'s SRS.  ' +
+                             'The default is the image\'s SRS, or, in ' +
+                             'batch mode, geographic.')
+
+    parser.add_argument('--aoi_fill',
+                        action='store_true',
+                        help='Instead of cropping the outputs to the area ' +
+                             'of interest, write the whole image, with no ' +
+                             'data outside it.')
+
+    parser.add_argument('-b',
+                        help='Glob pattern of image files, or a file ' +
+                             'listing them, to process as a batch.  Each ' +
+                             'scene is written to a subdirectory of the ' +
+                             'output directory, and skipped if its outputs ' +
+                             'are newer than its image.')
+
+    parser.add_argument('--bigtiff',
+                        choices=GeoTiffOptions.BIGTIFF_CHOICES,
+                        help='Whether to write BigTIFF outputs')
+
+    parser.add_argument('--block_size',
+                        type=int,
+                        help='Write tiled outputs with square blocks of ' +
+                             'this many pixels, a multiple of 16')
+
+    modelGroup = parser.add_mutually_exclusive_group(required=True)
+
+    modelGroup.add_argument('-c',
+                            help='Path to coefficient CSV file or its ' +
+                                 'compiled sidecar')
+
+    modelGroup.add_argument('-e',
+                            help='Band math program, or a file of one, ' +
+                                 'whose named expressions are applied ' +
+                                 'instead of a coefficient file, like ' +
+                                 '"ndvi = (b60 - b35) / (b60 + b35)"')
+
+    parser.add_argument('--cache_interleave',
+                        choices=['bsq', 'bil', 'bip'],
+                        help='Read from a copy of the ENVI image in this ' +
+                             'interleave, made in the output directory ' +
+                             'once and reused by later runs')
+
+    parser.add_argument('--catalog',
+                        help='Path to a scene catalog, created if needed.  ' +
+                             'In batch mode, it is refreshed with the ' +
+                             'batch\'s images, and, with --aoi, only the ' +
+                             'scenes intersecting the area are processed.')
+
+    parser.add_argument('--celery',
+                        metavar='SCRATCH_DIR',
+                        help='Compute the image\'s blocks as Celery tasks ' +
+                             'across the cluster, writing them to this ' +
+                             'scratch directory, which every node shares, ' +
+                             'and assemble the outputs from them')
+
+    parser.add_argument('--checkpoint',
+                        type=int,
+                        default=ApplyAlgorithm.DEFAULT_CHECKPOINT_SECONDS,
+                        help='Seconds between checkpoints, from which an ' +
+                             'interrupted run resumes.  A negative value ' +
+                             'turns them off.')
+
+    parser.add_argument('--cog',
+                        action='store_true',
+                        help='Write cloud-optimized GeoTIFFs:  tiled, ' +
+                             'compressed and with overviews.  The other ' +
+                             'output options override its defaults.  Each ' +
+                             'is written uncompressed, then copied into ' +
+                             'place compressed, which needs disk space for ' +
+                             'both.')
 
-    parser.add_argument('-c',
-                        required=True,
-                        help='Path to coefficient CSV file')
+    parser.add_argument('--compress',
+                        choices=GeoTiffOptions.COMPRESS_CHOICES,
+                        help='Compression for the outputs')
 
     parser.add_argument('-d',
                         nargs=2,
                         type=int,
-                        help='Produce debugging output for the given ' +
-                             'pixel, defined as "row column".')
+                        action='append',
+                        help='Trace the given pixel, defined as "row ' +
+                             'column", writing its band values, divisor, ' +
+                             'mask reason and band contributions to ' +
+                             '<image>_traces.json.  Repeat it to trace ' +
+                             'several pixels.')
 
     parser.add_argument('-i',
                         default='.',
                         help='Path to image file')
 
+    parser.add_argument('--layer_dir',
+                        help='Directory in which to keep each image\'s ' +
+                             'no-data, mask and divisor layers, built by ' +
+                             'the first full run, so later runs, even with ' +
+                             'other coefficients, read fewer bands')
+
+    parser.add_argument('--mask',
+                        help='Band math expression selecting the pixels ' +
+                             'to exclude.  The default for a coefficient ' +
+                             'file is "' +
+                             AlgorithmKernel.defaultMask(
+                                 CoefficientModel.MASK_BANDS) +
+                             '".')
+
+    parser.add_argument('-m',
+                        type=int,
+                        default=ApplyAlgorithm.DEFAULT_MAX_BLOCK_BYTES //
+                        (1024 * 1024),
+                        help='Memory budget for one block of the band ' +
+                             'stack, in megabytes, per worker')
+
+    parser.add_argument('--mosaic',
+                        choices=Mosaic.RULES,
+                        help='In batch mode, write every scene into one ' +
+                             'tiled mosaic, <output directory>/mosaic.tif, ' +
+                             'merging overlaps by this rule, instead of ' +
+                             'writing each scene\'s outputs.  Tiles are ' +
+                             '--block_size pixels, by default ' +
+                             str(Mosaic.DEFAULT_TILE_SIZE) + '.  "best" ' +
+                             'keeps the result farthest from its scene\'s ' +
+                             'row and column edges, the nearest nadir only ' +
+                             'when each raster is its swath, as with ' +
+                             'rotated geotransforms, not north-up scenes ' +
+                             'padded with no-data.')
+
+    parser.add_argument('--mosaic_epsg',
+                        type=int,
+                        help='EPSG code of the mosaic\'s SRS.  The default ' +
+                             'is the first scene\'s SRS.  Another needs ' +
+                             '--mosaic_pixel_size.')
+
+    parser.add_argument('--mosaic_pixel_size',
+                        type=float,
+                        help='Pixel size of the mosaic, in the units of its ' +
+                             'SRS.  The default is the first scene\'s.')
+
     parser.add_argument('-o',
                         default='.',
                         help='Path to output directory')
 
+    parser.add_argument('--overviews',
+                        nargs='+',
+                        type=int,
+                        help='Overview levels to build, like "2 4 8".  ' +
+                             'With --cog, they are chosen automatically.')
+
+    parser.add_argument('-p',
+                        help='Path to a CSV of points at which to evaluate ' +
+                             'the algorithms, instead of the whole image.  ' +
+                             'It must have "row" and "col" columns, or map ' +
+                             '"x" and "y" columns in the image\'s SRS.  ' +
+                             'Other columns are copied to the output, ' +
+                             '<image>_points.csv.')
+
+    parser.add_argument('--prefetch',
+                        type=int,
+                        default=0,
+                        help='Read this many blocks ahead of the ' +
+                             'computation in a reader thread, and write ' +
+                             'results in a writer thread, so I/O and ' +
+                             'computation overlap.  Up to 2 * prefetch + ' +
+                             '1 blocks are in flight, sharing -m, unless ' +
+                             '--tile_size is given, when each takes its ' +
+                             'own.')
+
+    parser.add_argument('--predictor',
+                        type=int,
+                        choices=[1, 2, 3],
+                        help='Compression predictor:  1 none, 2 ' +
+                             'horizontal, 3 floating point')
+
+    parser.add_argument('--precision',
+                        choices=ApplyAlgorithm.PRECISIONS,
+                        default='float64',
+                        help='Precision of the computation.  The outputs ' +
+                             'are float32 either way.')
+
+    parser.add_argument('-s',
+                        action='store_true',
+                        help='Save the compiled coefficient model beside ' +
+                             'the CSV, so later runs skip parsing it')
+
+    parser.add_argument('--separate',
+                        action='store_true',
+                        help='Write one file per algorithm, instead of one ' +
+                             'multi-band file, when applying several')
+
+    parser.add_argument('--skip_empty',
+                        action='store_true',
+                        help='Index the image\'s no-data pixels once, in ' +
+                             'the output directory, and write blocks ' +
+                             'without valid pixels without reading them')
+
+    parser.add_argument('--tile_size',
+                        nargs=2,
+                        type=int,
+                        help='Process the image in tiles of "columns rows", ' +
+                             'instead of row strips sized by -m')
+
+    parser.add_argument('-w',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes.  In batch mode, ' +
+                             'this is the number of scenes processed at once.')
+
     args = parser.parse_args()
-    aa = ApplyAlgorithm(args.c, args.i, args.o)
+
+    if args.e:
+
+        model = BandMath(open(args.e).read() if os.path.isfile(args.e)
+                         else args.e)
+
+    else:
+
+        model = CoefficientModel.read(args.c, args.s)
+
+    algorithmNames = model.algorithmNames() if args.all else args.a
+    separateFiles = args.separate or len(algorithmNames) == 1
+    outputOptions = outputOptionsFromArgs(args)
+
+    # Celery distributes the blocks of one image, run by this process.
+    if args.celery and \
+       (args.b or args.w > 1 or args.layer_dir or args.prefetch or args.d):
+
+        parser.error('--celery cannot be combined with -b, -w, ' +
+                     '--layer_dir, --prefetch or -d.')
+
+    # Options of one image, and, for a mosaic, of each scene's outputs
+    if args.b:
+
+        checkpoint = args.checkpoint != \
+            ApplyAlgorithm.DEFAULT_CHECKPOINT_SECONDS
+
+        options = [('-p', args.p),
+                   ('-d', args.d),
+                   ('--accuracy', args.accuracy),
+                   ('--tile_size', args.tile_size),
+                   ('--cache_interleave', args.cache_interleave),
+                   ('--checkpoint', checkpoint)]
+
+        if args.mosaic:
+
+            options += [('--aoi', args.aoi),
+                        ('--aoi_fill', args.aoi_fill),
+                        ('--separate', args.separate),
+                        ('--skip_empty', args.skip_empty),
+                        ('--layer_dir', args.layer_dir),
+                        ('--prefetch', args.prefetch)]
+
+        given = [name for name, value in options if value]
+
+        if given:
+
+            parser.error(', '.join(given) +
+                         (' cannot be used with --mosaic.' if args.mosaic
+                          else ' cannot be used with -b.'))
+
+    elif args.catalog or args.mosaic or args.mosaic_epsg or \
+            args.mosaic_pixel_size:
+
+        parser.error('--catalog, --mosaic, --mosaic_epsg and ' +
+                     '--mosaic_pixel_size need -b.')
+
+    if args.b:
+
+        images = AvirisBatch.findImages(args.b)
+
+        if args.catalog:
+            images = catalogImages(args, images)
+
+        if args.mosaic:
+
+            # Mosaic tiles are written as whole GeoTIFF blocks.
+            if not outputOptions.blockSize:
+                outputOptions.blockSize = Mosaic.DEFAULT_TILE_SIZE
+
+            mosaicSrs = None
+
+            if args.mosaic_epsg:
+
+                mosaicSrs = SpatialReference()
+                mosaicSrs.ImportFromEPSG(args.mosaic_epsg)
+
+            mosaic = Mosaic(model,
+                            images,
+                            os.path.join(args.o, 'mosaic.tif'),
+                            algorithmNames,
+                            args.mosaic,
+                            mosaicSrs,
+                            args.mosaic_pixel_size,
+                            outputOptions.blockSize,
+                            args.w,
+                            args.m * 1024 * 1024,
+                            outputOptions,
+                            args.precision,
+                            args.mask)
+
+            report = mosaic.run()
+
+            for key in sorted(report):
+                print (key + ': ' + str(report[key]))
+
+            return
+
+        batch = AvirisBatch(model,
+                            images,
+                            args.o,
+                            algorithmNames,
+                            separateFiles,
+                            args.w,
+                            args.m * 1024 * 1024,
+                            None,
+                            outputOptions,
+                            args.precision,
+                            args.mask,
+                            args.skip_empty,
+                            args.layer_dir,
+                            args.prefetch,
+                            batchAreaFromArgs(args),
+                            not args.aoi_fill)
+
+        batch.run()
+        print (batch.summary())
+        return
+
+    checkpointSeconds = args.checkpoint if args.checkpoint >= 0 else None
+
+    if args.celery:
+
+        aa = ApplyAlgorithmCelery(model,
+                                  args.i,
+                                  args.o,
+                                  args.celery,
+                                  None,
+                                  args.m * 1024 * 1024,
+                                  args.tile_size,
+                                  outputOptions,
+                                  args.cache_interleave,
+                                  args.precision,
+                                  checkpointSeconds,
+                                  args.mask,
+                                  args.skip_empty)
+
+    else:
+
+        aa = ApplyAlgorithm(model,
+                            args.i,
+                            args.o,
+                            None,
+                            args.m * 1024 * 1024,
+                            args.w,
+                            args.tile_size,
+                            outputOptions,
+                            args.cache_interleave,
+                            args.precision,
+                            checkpointSeconds,
+                            args.mask,
+                            args.skip_empty,
+                            args.layer_dir,
+                            args.prefetch)
+
+    if args.aoi:
+
+        aa.clip(areaOfInterestFromArgs(args, aa.imageFile.srs()),
+                not args.aoi_fill)
+
+    if args.p:
+
+        queryPoints(aa, args.p, algorithmNames, args.o)
+        return
+
+    if args.accuracy:
+
+        comparePrecision(aa, algorithmNames, args.o)
+        return
 
     if args.d:
-        aa.debug(args.d[0], args.d[1])
+        aa.trace(args.d)
+
+    aa.applyAlgorithms(algorithmNames, separateFiles)
+
+    for key in sorted(aa.report):
+        print (key + ': ' + str(aa.report[key]))
+
+
+# -----------------------------------------------------------------------------
+# areaOfInterestFromArgs
+#
+# This returns the Envelope or polygon given by --aoi, in the SRS given by
+# --aoi_epsg or the image's SRS.
+# -----------------------------------------------------------------------------
+def areaOfInterestFromArgs(args, imageSrs):
+
+    srs = imageSrs
+
+    if args.aoi_epsg:
+
+        srs = SpatialReference()
+        srs.ImportFromEPSG(args.aoi_epsg)
+
+    if len(args.aoi) == 4:
+
+        ulx, uly, lrx, lry = [float(v) for v in args.aoi]
+        envelope = Envelope()
+        envelope.addPoint(ulx, uly, 0, srs)
+        envelope.addPoint(lrx, lry, 0, srs)
+        return envelope
+
+    wkt = ' '.join(args.aoi)
+
+    if os.path.isfile(wkt):
+        wkt = open(wkt).read()
+
+    polygon = ogr.CreateGeometryFromWkt(wkt)
+
+    if not polygon:
+        raise RuntimeError('Invalid area of interest: ' + wkt)
+
+    polygon.AssignSpatialReference(srs)
+
+    return polygon
+
+
+# -----------------------------------------------------------------------------
+# batchAreaFromArgs
+#
+# This returns the area of interest given by --aoi for a batch, which is
+# geographic unless --aoi_epsg is given, or None.
+# -----------------------------------------------------------------------------
+def batchAreaFromArgs(args):
+
+    if not args.aoi:
+        return None
+
+    geographic = SpatialReference()
+    geographic.ImportFromEPSG(4326)
+
+    return areaOfInterestFromArgs(args, geographic)
+
+
+# -----------------------------------------------------------------------------
+# catalogImages
+#
+# This refreshes the catalog given by --catalog with the images and returns
+# those of them intersecting --aoi, which is geographic unless --aoi_epsg is
+# given.  Without --aoi, it returns every image.
+# -----------------------------------------------------------------------------
+def catalogImages(args, images):
+
+    catalog = SceneCatalog(args.catalog)
+    counts = catalog.refresh(images)
+
+    print ('Catalog ' + args.catalog + ': ' +
+           ', '.join(str(counts[k]) + ' ' + k for k in sorted(counts)))
+
+    if args.aoi:
+
+        area = batchAreaFromArgs(args)
+        images = [scene['path'] for scene in catalog.query(area, images)]
+
+        print (str(len(images)) + ' scenes intersect the area of interest.')
+
+    catalog.close()
+
+    return images
+
+
+# -----------------------------------------------------------------------------
+# comparePrecision
+# -----------------------------------------------------------------------------
+def comparePrecision(aa, algorithmNames, outDir):
+
+    report = aa.comparePrecision(algorithmNames)
+    fields = ['Algorithm'] + ApplyAlgorithm.ACCURACY_FIELDS
+    baseName = os.path.basename(aa.imageFile.fileName())
+
+    outFile = os.path.join(outDir,
+                           os.path.splitext(baseName)[0] + '_precision.csv')
+
+    with open(outFile, 'w') as f:
+
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+
+        for name in algorithmNames:
+
+            row = dict(report[name])
+            row['Algorithm'] = name
+            writer.writerow(row)
+
+            print (name + ': ' +
+                   ', '.join(k + ' ' + str(report[name][k])
+                             for k in ApplyAlgorithm.ACCURACY_FIELDS))
+
+    print ('Wrote ' + outFile)
+
+
+# -----------------------------------------------------------------------------
+# outputOptionsFromArgs
+# -----------------------------------------------------------------------------
+def outputOptionsFromArgs(args):
+
+    if args.cog:
+
+        defaults = GeoTiffOptions.cloudOptimized()
+
+        return GeoTiffOptions(args.block_size or defaults.blockSize,
+                              args.compress or defaults.compress,
+                              args.predictor or defaults.predictor,
+                              args.bigtiff or defaults.bigTiff,
+                              args.overviews or defaults.overviewLevels,
+                              True)
+
+    return GeoTiffOptions(args.block_size,
+                          args.compress,
+                          args.predictor,
+                          args.bigtiff,
+                          args.overviews)
+
+
+# -----------------------------------------------------------------------------
+# queryPoints
+# -----------------------------------------------------------------------------
+def queryPoints(aa, pointFile, algorithmNames, outDir):
+
+    with open(pointFile) as f:
+        rows = list(csv.DictReader(f))
+
+    if not rows:
+        raise RuntimeError(pointFile + ' has no points.')
+
+    if 'x' in rows[0] and 'y' in rows[0]:
+
+        points = [(float(r['x']), float(r['y'])) for r in rows]
+        mapCoordinates = True
+
+    elif 'row' in rows[0] and 'col' in rows[0]:
+
+        points = [(int(r['row']), int(r['col'])) for r in rows]
+        mapCoordinates = False
+
+    else:
+
+        raise RuntimeError(pointFile + ' must have "row" and "col" or ' +
+                           '"x" and "y" columns.')
+
+    table = aa.queryPoints(points, algorithmNames, mapCoordinates)
+    fields = ApplyAlgorithm.POINT_FIELDS + algorithmNames
+    extraFields = [k for k in rows[0] if k not in fields]
+    baseName = os.path.basename(aa.imageFile.fileName())
+
+    outFile = os.path.join(outDir,
+                           os.path.splitext(baseName)[0] + '_points.csv')
+
+    with open(outFile, 'w') as f:
+
+        writer = csv.DictWriter(f, extraFields + fields)
+        writer.writeheader()
+
+        for row, entry in zip(rows, table):
+
+            entry.update((k, row[k]) for k in extraFields)
+            writer.writerow(entry)
 
-    aa.applyAlgorithm(args.a)
+    print ('Wrote ' + str(len(table)) + ' points to ' + outFile)
 
 
 # ------------------------------------------------------------------------------